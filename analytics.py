@@ -0,0 +1,84 @@
+import pandas as pd
+
+# Per-user, per-day totals of forms tested, sample weight and fine gold, kept up to
+# date by triggers on forms so dashboards read O(days) rows instead of every form.
+# Forms whose createdAt is '' (unparseable legacy dates) are left out.
+SUMMARY_COLUMNS = ('userId', 'day', 'forms', 'sampleWeight', 'fineGold')
+
+# pandas period of each dashboard view; weeks run Monday to Sunday
+PERIODS = {
+    'Day': 'D',
+    'Week': 'W-SUN',
+    'Month': 'M',
+}
+
+_ADD = '''INSERT INTO daily_summary (userId, day, forms, sampleWeight, fineGold)
+          SELECT {row}.userId, substr({row}.createdAt, 1, 10), 1, COALESCE({row}.grossWeight, 0), COALESCE({row}.goldPurity, 0)
+          WHERE length({row}.createdAt) >= 10
+          ON CONFLICT (userId, day) DO UPDATE SET forms = forms + 1,
+              sampleWeight = sampleWeight + excluded.sampleWeight, fineGold = fineGold + excluded.fineGold;'''
+
+_REMOVE = '''UPDATE daily_summary SET forms = forms - 1,
+              sampleWeight = sampleWeight - COALESCE({row}.grossWeight, 0), fineGold = fineGold - COALESCE({row}.goldPurity, 0)
+          WHERE userId = {row}.userId AND day = substr({row}.createdAt, 1, 10);'''
+
+
+def create_tables(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS daily_summary (
+        userId INTEGER,
+        day TEXT,
+        forms INTEGER NOT NULL,
+        sampleWeight REAL NOT NULL,
+        fineGold REAL NOT NULL,
+        PRIMARY KEY (userId, day)
+    )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_daily_summary_day ON daily_summary (day)')
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS daily_summary_insert AFTER INSERT ON forms BEGIN
+        {_ADD.format(row='new')}
+    END''')
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS daily_summary_delete AFTER DELETE ON forms BEGIN
+        {_REMOVE.format(row='old')}
+    END''')
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS daily_summary_update
+        AFTER UPDATE OF grossWeight, goldPurity, createdAt, userId ON forms BEGIN
+        {_REMOVE.format(row='old')}
+        {_ADD.format(row='new')}
+    END''')
+
+
+# Recompute every summary row from the forms table
+def rebuild(cursor):
+    cursor.execute('DELETE FROM daily_summary')
+    cursor.execute('''INSERT INTO daily_summary (userId, day, forms, sampleWeight, fineGold)
+                      SELECT userId, substr(createdAt, 1, 10), COUNT(*), COALESCE(SUM(grossWeight), 0), COALESCE(SUM(goldPurity), 0)
+                      FROM forms WHERE length(createdAt) >= 10 GROUP BY userId, substr(createdAt, 1, 10)''')
+
+
+# Summary rows for an inclusive range of days, with the username of each row
+def load_summary(cursor, start_date=None, end_date=None, user_id=None):
+    clauses, params = ['s.forms > 0'], []
+    if start_date:
+        clauses.append('s.day >= ?')
+        params.append(start_date.isoformat())
+    if end_date:
+        clauses.append('s.day <= ?')
+        params.append(end_date.isoformat())
+    if user_id is not None:
+        clauses.append('s.userId = ?')
+        params.append(user_id)
+    cursor.execute(f'''SELECT {", ".join("s." + c for c in SUMMARY_COLUMNS)}, u.username
+                       FROM daily_summary s LEFT JOIN users u ON u.id = s.userId
+                       WHERE {" AND ".join(clauses)} ORDER BY s.day''', params)
+    frame = pd.DataFrame(cursor.fetchall(), columns=SUMMARY_COLUMNS + ('username',))
+    frame['day'] = pd.to_datetime(frame['day'])
+    return frame
+
+
+# Totals per period ('Day', 'Week' or 'Month'), overall or per user
+def rollup(summary, period='Day', by_user=False):
+    starts = summary['day'].dt.to_period(PERIODS[period]).dt.start_time.rename(period.lower())
+    keys = [starts] + ([summary['username']] if by_user else [])
+    totals = summary.groupby(keys)[['forms', 'sampleWeight', 'fineGold']].sum().reset_index()
+    totals = totals[totals['forms'] > 0]
+    # Average purity of the gold tested, weighted by sample weight
+    return totals.assign(purity=(totals['fineGold'] / totals['sampleWeight'].where(totals['sampleWeight'] > 0) * 100).round(2))
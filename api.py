@@ -0,0 +1,373 @@
+# Headless JSON ingestion for XRF analyzers and scales, run beside the Streamlit app:
+# python -m api [serve] [--host HOST] [--port PORT] [--secrets .streamlit/secrets.toml]
+# python -m api create-token --user USERNAME --name LABEL
+import argparse
+import base64
+import binascii
+import hashlib
+import json
+import math
+import os
+import sys
+import tomllib
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import apikeys
+import counters
+import database
+import errorlog
+import photos
+import queries
+import validation
+from cache import VersionStore
+from writer import GroupCommitWriter
+
+# Most items one batch request may hold
+MAX_BATCH = 500
+MAX_BODY_BYTES = 32 * 1024 * 1024
+
+FORM_TEXT_FIELDS = ('date', 'time', 'customerName', 'itemName', 'mobileNumber')
+NUMBER_FIELDS = ('grossWeight', 'gold')
+
+DATE_ERROR = "Date must be dd-mm-YYYY and time HH:MM:SS"
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Body length from the Content-Length header; a missing header means no body
+def _content_length(value):
+    if value is None:
+        return 0
+    value = value.strip()
+    if not (value.isascii() and value.isdigit()):
+        raise ApiError(400, "Content-Length must be a non-negative integer")
+    return int(value)
+
+
+# Copy the request's fields over `base`; returns the conversion errors
+def _apply_fields(base, item, text_fields):
+    errors = []
+    for name in text_fields:
+        if name in item:
+            base[name] = '' if item[name] is None else str(item[name]).strip()
+    for name in NUMBER_FIELDS:
+        if name in item:
+            value = item[name]
+            try:
+                base[name] = float(value) if value not in (None, '') else None
+            except (TypeError, ValueError):
+                errors.append(f"{name} must be a number")
+                continue
+            if base[name] is not None and not math.isfinite(base[name]):
+                errors.append(f"{name} must be a finite number")
+    return errors
+
+
+# Decoded and encoded photo of an item, done before the write so the writer thread
+# never waits on Pillow
+def _prepare_photo(item):
+    data = item.get('photo')
+    if not data:
+        return None
+    if isinstance(data, str) and data.startswith('data:'):
+        data = data.split(',', 1)[-1]
+    try:
+        return photos.encode_photo(base64.b64decode(data, validate=True))
+    except photos.PhotoTooLarge:
+        raise
+    except (binascii.Error, TypeError, ValueError, OSError) as e:
+        raise ValueError(f"photo is not a valid base64 image: {e}")
+
+
+# Creates or updates forms and templates in one writer unit per request, with the
+# same validation and karat/fine gold derivation as the form editor
+class IngestService:
+    def __init__(self, pool, writer, versions=None, token_ttl=60.0, max_batch=MAX_BATCH, on_error=None):
+        self.pool = pool
+        self.writer = writer
+        self.versions = versions or VersionStore()
+        self.tokens = apikeys.TokenCache(token_ttl)
+        self.max_batch = max_batch
+        self.on_error = on_error
+
+    # Owner user id of a bearer token
+    def authenticate(self, token):
+        if not token:
+            raise ApiError(401, "Missing bearer token")
+        with self.pool.connection() as conn:
+            owner = self.tokens.resolve(conn.cursor(), token)
+        if owner is None:
+            raise ApiError(401, "Invalid or revoked token")
+        return owner[1]
+
+    def _prepare(self, items):
+        if not isinstance(items, list) or not items:
+            raise ApiError(400, "Expected a non-empty list of items")
+        if len(items) > self.max_batch:
+            raise ApiError(413, f"At most {self.max_batch} items per request")
+        prepared = []
+        for item in items:
+            if not isinstance(item, dict):
+                prepared.append((item, None, ["Each item must be a JSON object"]))
+                continue
+            try:
+                prepared.append((item, _prepare_photo(item), []))
+            except ValueError as e:
+                prepared.append((item, None, [str(e)]))
+        return prepared
+
+    def _form_work(self, cursor, user_id, item, photo, errors):
+        existing = None
+        if item.get('formNumber') is not None:
+            try:
+                existing = queries.get_form_by_number(cursor, user_id, int(item['formNumber']))
+            except (TypeError, ValueError):
+                return {'errors': ["formNumber must be an integer"]}
+            if existing is None:
+                return {'errors': [f"Form {item['formNumber']} not found"]}
+        if existing is not None:
+            form_data = existing.to_form_data()
+        else:
+            now = datetime.now()
+            form_data = {'date': now.strftime('%d-%m-%Y'), 'time': now.strftime('%H:%M:%S'), 'customerName': '',
+                         'itemName': '', 'mobileNumber': '', 'grossWeight': None, 'gold': None, 'photoHash': None}
+        errors = errors + _apply_fields(form_data, item, FORM_TEXT_FIELDS)
+        if errors:
+            return {'errors': errors}
+        errors = validation.validate_form_data(form_data)
+        created_at = queries.created_at(form_data['date'], form_data['time'])
+        if not created_at:
+            errors.append(DATE_ERROR)
+        if errors:
+            return {'errors': errors}
+
+        gross_weight, gold = form_data['grossWeight'], form_data['gold']
+        if photo:
+            photos.save_photo(cursor, photo)
+            form_data['photoHash'] = photo['hash']
+        updated_at = datetime.now().isoformat()
+        values = (form_data['date'], form_data['time'], form_data['customerName'], form_data['itemName'],
+                  form_data['mobileNumber'], gross_weight, gross_weight, gold, validation.karat_for(gold),
+                  form_data['photoHash'], updated_at, validation.gold_purity_for(gold, gross_weight))
+        if existing is not None:
+            cursor.execute('''UPDATE forms SET date = ?, time = ?, customerName = ?, itemName = ?, mobileNumber = ?,
+                              grossWeight = ?, netWeight = ?, gold = ?, karat = ?, photoHash = ?, updatedAt = ?, goldPurity = ?,
+                              createdAt = ? WHERE id = ?''', values + (created_at, existing.id))
+            form_id, form_number, action = existing.id, existing.formNumber, 'update_form'
+        else:
+            form_number, action = counters.allocate(cursor, user_id), 'create_form'
+            cursor.execute('''INSERT INTO forms (formNumber, date, time, customerName, itemName, mobileNumber, grossWeight, netWeight,
+                              gold, karat, photoHash, updatedAt, goldPurity, createdAt, userId)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                           (form_number,) + values + (created_at, user_id))
+            form_id = cursor.lastrowid
+        cursor.execute('INSERT INTO audit_log (action, userId, username, timestamp) VALUES (?, ?, ?, ?)',
+                       (action, user_id, f"Form {form_number}", updated_at))
+        return {'id': form_id, 'formNumber': form_number, 'created': existing is None,
+                'karat': validation.karat_for(gold), 'goldPurity': validation.gold_purity_for(gold, gross_weight)}
+
+    def _template_work(self, cursor, user_id, item, photo, errors):
+        template_id = item.get('id')
+        if template_id is not None:
+            cursor.execute(f'SELECT {", ".join(queries.TEMPLATE_COLUMNS)} FROM templates WHERE id = ? AND userId = ?',
+                           (template_id, user_id))
+            row = cursor.fetchone()
+            if row is None:
+                return {'errors': [f"Template {template_id} not found"]}
+            template_data = dict(zip(queries.TEMPLATE_COLUMNS, row))
+        else:
+            template_data = {'itemName': '', 'grossWeight': None, 'gold': None}
+        errors = errors + _apply_fields(template_data, item, ('itemName',))
+        errors = errors or validation.validate_template_data(template_data)
+        if errors:
+            return {'errors': errors}
+        gross_weight, gold = template_data['grossWeight'], template_data['gold']
+        values = (template_data['itemName'], gross_weight, gross_weight, gold, validation.karat_for(gold))
+        if template_id is not None:
+            cursor.execute('UPDATE templates SET itemName = ?, grossWeight = ?, netWeight = ?, gold = ?, karat = ? WHERE id = ?',
+                           values + (template_id,))
+        else:
+            cursor.execute('INSERT INTO templates (itemName, grossWeight, netWeight, gold, karat, userId) VALUES (?, ?, ?, ?, ?, ?)',
+                           values + (user_id,))
+            template_id = cursor.lastrowid
+        return {'id': template_id, 'created': item.get('id') is None, 'karat': values[4]}
+
+    # Write a list of items; returns (status, response). With an idempotency key the
+    # stored response of an earlier identical request is returned instead.
+    def write(self, kind, user_id, items, single=False, idempotency_key=None, body=b''):
+        prepared = self._prepare(items)
+        item_work = self._form_work if kind == 'forms' else self._template_work
+        request_hash = hashlib.sha256(f"{kind}:{int(single)}:".encode() + body).hexdigest()
+
+        def work(cursor):
+            if idempotency_key:
+                try:
+                    stored = apikeys.find_request(cursor, user_id, idempotency_key, request_hash)
+                except ValueError as e:
+                    return 409, json.dumps({'error': str(e)}), False
+                if stored:
+                    return stored[0], stored[1], False
+            results = [dict(index=index, **(item_work(cursor, user_id, item, photo, errors) if isinstance(item, dict)
+                                            else {'errors': errors}))
+                       for index, (item, photo, errors) in enumerate(prepared)]
+            written = sum('errors' not in result for result in results)
+            if single:
+                result = results[0]
+                status = 422 if 'errors' in result else 201 if result['created'] else 200
+                response = result
+            else:
+                status, response = 200, {'written': written, 'rejected': len(results) - written, 'results': results}
+            response = json.dumps(response)
+            if idempotency_key:
+                apikeys.save_request(cursor, user_id, idempotency_key, request_hash, status, response)
+            return status, response, written > 0
+
+        status, response, changed = self.writer.submit(work, statements=len(prepared) * 4 + 2).result()
+        if changed:
+            # Open Streamlit sessions on this host reload the user's forms and templates
+            self.versions.bump(user_id)
+        return status, response
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'GoldFormsAPI/1'
+    # Headers and body go out as separate writes; without this, Nagle holds the body
+    # back until the client's delayed ACK, about 40 ms per keep-alive request
+    disable_nagle_algorithm = True
+    service = None
+
+    ROUTES = {
+        '/forms': ('forms', True),
+        '/forms/batch': ('forms', False),
+        '/templates': ('templates', True),
+        '/templates/batch': ('templates', False),
+    }
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        data = body.encode('utf-8') if isinstance(body, str) else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send(200, {'status': 'ok'})
+        else:
+            self._send(404, {'error': "Not found"})
+
+    def do_POST(self):
+        length = None
+        body = None
+        try:
+            length = _content_length(self.headers.get('Content-Length'))
+            route = self.ROUTES.get(self.path.split('?', 1)[0])
+            if route is None:
+                raise ApiError(404, "Not found")
+            if length > MAX_BODY_BYTES:
+                raise ApiError(413, f"Request body is larger than {MAX_BODY_BYTES // (1024 * 1024)} MB")
+            body = self.rfile.read(length)
+            authorization = self.headers.get('Authorization', '')
+            user_id = self.service.authenticate(authorization[7:].strip() if authorization.startswith('Bearer ') else None)
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                raise ApiError(400, "Request body is not valid JSON")
+            kind, single = route
+            if single:
+                items = [payload]
+            else:
+                items = payload.get(kind) if isinstance(payload, dict) else payload
+            status, response = self.service.write(kind, user_id, items, single,
+                                                  self.headers.get('Idempotency-Key'), body)
+            self._send(status, response)
+        except ApiError as e:
+            if length != 0 and body is None:
+                # The unread body would otherwise be taken for the next request
+                self.close_connection = True
+            self._send(e.status, {'error': str(e)})
+        except Exception as e:
+            if self.service.on_error:
+                self.service.on_error(f"API error: {str(e)}")
+            self._send(503, {'error': "Could not save; try again"})
+
+
+def make_server(service, host='127.0.0.1', port=8600):
+    handler = type('BoundHandler', (Handler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def _settings(path):
+    if not os.path.exists(path):
+        raise SystemExit(f"Secrets file not found: {path}")
+    with open(path, 'rb') as f:
+        return tomllib.load(f)
+
+
+def build_service(settings):
+    connect = database.connector(settings['turso'])
+    api_settings = settings.get('api', {})
+    pool = database.ConnectionPool(connect, size=int(api_settings.get('pool_size', 4)))
+    database.ensure_schema(pool)
+    error_logger = errorlog.ErrorLogger(connect, spool_path=settings.get('errors', {}).get('spool_path'))
+    writer = GroupCommitWriter(connect, max_delay_ms=int(settings.get('writer', {}).get('max_delay_ms', 50)),
+                               on_error=error_logger.log)
+    return IngestService(pool, writer, VersionStore(settings.get('cache', {}).get('version_path')),
+                         token_ttl=float(api_settings.get('token_ttl', 60.0)),
+                         max_batch=int(api_settings.get('max_batch', MAX_BATCH)), on_error=error_logger.log)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="JSON ingestion API for analyzers and scales")
+    parser.add_argument('command', nargs='?', choices=('serve', 'create-token'), default='serve')
+    parser.add_argument('--secrets', default=os.path.join('.streamlit', 'secrets.toml'))
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--user', help="create-token: username the token writes as")
+    parser.add_argument('--name', help="create-token: label for the device")
+    args = parser.parse_args(argv)
+    settings = _settings(args.secrets)
+
+    if args.command == 'create-token':
+        if not args.user or not args.name:
+            parser.error("create-token needs --user and --name")
+        conn = database.connector(settings['turso'])()
+        database.init_db(conn)
+        cursor = conn.cursor()
+        cursor.execute('SELECT id FROM users WHERE username = ?', (args.user,))
+        user = cursor.fetchone()
+        if not user:
+            raise SystemExit(f"Unknown user: {args.user}")
+        token = apikeys.create_token(cursor, user[0], args.name)
+        conn.commit()
+        conn.sync()
+        print(token)
+        return 0
+
+    api_settings = settings.get('api', {})
+    server = make_server(build_service(settings), args.host or api_settings.get('host', '127.0.0.1'),
+                         args.port or int(api_settings.get('port', 8600)))
+    print(f"Listening on http://{server.server_address[0]}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import hashlib
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+
+TOKEN_COLUMNS = ('id', 'name', 'userId', 'createdAt', 'revokedAt')
+
+# How long a response is kept for replays of the same idempotency key
+IDEMPOTENCY_TTL = timedelta(hours=24)
+
+
+# Tokens are stored as SHA-256 hashes; the token itself is only shown when created
+def create_tables(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS api_tokens (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        tokenHash TEXT NOT NULL UNIQUE,
+        userId INTEGER NOT NULL,
+        createdAt TEXT,
+        revokedAt TEXT
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS api_requests (
+        userId INTEGER NOT NULL,
+        idempotencyKey TEXT NOT NULL,
+        requestHash TEXT NOT NULL,
+        status INTEGER NOT NULL,
+        response TEXT NOT NULL,
+        createdAt TEXT NOT NULL,
+        PRIMARY KEY (userId, idempotencyKey)
+    )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_api_requests_created_at ON api_requests (createdAt)')
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+# New token for a user; returns the token, which cannot be recovered later
+def create_token(cursor, user_id, name):
+    token = 'gf_' + secrets.token_urlsafe(32)
+    cursor.execute('INSERT INTO api_tokens (name, tokenHash, userId, createdAt) VALUES (?, ?, ?, ?)',
+                   (name, hash_token(token), user_id, datetime.now().isoformat()))
+    return token
+
+
+def revoke_token(cursor, token_id):
+    cursor.execute('UPDATE api_tokens SET revokedAt = ? WHERE id = ? AND revokedAt IS NULL', (datetime.now().isoformat(), token_id))
+
+
+def list_tokens(cursor):
+    cursor.execute(f'''SELECT {", ".join("t." + c for c in TOKEN_COLUMNS)}, u.username
+                       FROM api_tokens t LEFT JOIN users u ON u.id = t.userId ORDER BY t.id''')
+    return [dict(zip(TOKEN_COLUMNS + ('username',), row)) for row in cursor.fetchall()]
+
+
+# Token lookups for the API, cached `ttl` seconds so a revoked token stops working within that time
+class TokenCache:
+    def __init__(self, ttl=60.0):
+        self.ttl = ttl
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    # (token id, user id) for a live token, or None
+    def resolve(self, cursor, token):
+        token_hash = hash_token(token)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._tokens.get(token_hash)
+        if cached and now - cached[1] < self.ttl:
+            return cached[0]
+        cursor.execute('SELECT id, userId FROM api_tokens WHERE tokenHash = ? AND revokedAt IS NULL', (token_hash,))
+        row = cursor.fetchone()
+        owner = (row[0], row[1]) if row else None
+        with self._lock:
+            self._tokens[token_hash] = (owner, now)
+        return owner
+
+
+# The stored (status, response) for an idempotency key. Raises ValueError when the
+# key was used before with a different request body.
+def find_request(cursor, user_id, key, request_hash):
+    cursor.execute('SELECT requestHash, status, response FROM api_requests WHERE userId = ? AND idempotencyKey = ?',
+                   (user_id, key))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    if row[0] != request_hash:
+        raise ValueError("Idempotency key was already used with a different request")
+    return row[1], row[2]
+
+
+def save_request(cursor, user_id, key, request_hash, status, response):
+    now = datetime.now()
+    cursor.execute('DELETE FROM api_requests WHERE createdAt < ?', ((now - IDEMPOTENCY_TTL).isoformat(),))
+    cursor.execute('''INSERT INTO api_requests (userId, idempotencyKey, requestHash, status, response, createdAt)
+                      VALUES (?, ?, ?, ?, ?, ?)''', (user_id, key, request_hash, status, response, now.isoformat()))
@@ -1,82 +1,140 @@
 import streamlit as st
 import streamlit.components.v1 as components
-import libsql_experimental as libsql 
-import bcrypt
 import pandas as pd
-from datetime import datetime
-import base64
-from PIL import Image
-import io
+from datetime import datetime, timedelta
 import uuid
 import os
+import sys
+try:
+    import resource
+except ImportError:
+    resource = None
+import database
+import queries
+import photos
+import export
+import analytics
+import audit
+import search
+import counters
+import importer
+import printing
+import certificates
+import validation
+import metrics
+import errorlog
+import auth
+import apikeys
+from cache import FormCache, VersionStore
+from records import FormRecord
+from writer import GroupCommitWriter, GROUPED
 
 # Database setup
-db_url = st.secrets["turso"]["database_url"]
-auth_token = st.secrets["turso"]["auth_token"]
-db = libsql.connect(db_url, auth_token=auth_token, sync_url=db_url)
-cursor = db.cursor()
+@st.cache_resource
+def get_pool():
+    pool_settings = st.secrets.get("pool", {})
+    pool = database.ConnectionPool(
+        metrics.instrument(database.connector(st.secrets["turso"])),
+        size=int(pool_settings.get("size", 4)),
+        timeout=float(pool_settings.get("timeout", 10.0)),
+        health_check_interval=float(pool_settings.get("health_check_interval", 30.0))
+    )
+    database.ensure_schema(pool)
+    return pool
+
+# Errors are written in the background on a connection of their own, so a failing
+# database cannot stall or flood the pages that report it
+@st.cache_resource
+def get_error_logger():
+    error_settings = st.secrets.get("errors", {})
+    return errorlog.ErrorLogger(
+        database.connector(st.secrets["turso"]),
+        window=float(error_settings.get("window_seconds", 60.0)),
+        max_pending=int(error_settings.get("max_pending", 1000)),
+        spool_path=error_settings.get("spool_path")
+    )
+
+@st.cache_resource
+def get_writer():
+    writer_settings = st.secrets.get("writer", {})
+    writer = GroupCommitWriter(
+        metrics.instrument(database.connector(st.secrets["turso"])),
+        mode=writer_settings.get("mode", GROUPED),
+        max_delay_ms=int(writer_settings.get("max_delay_ms", 50)),
+        max_statements=int(writer_settings.get("max_statements", 100))
+    )
+    # Failed fire-and-forget writes end up in error_logs
+    writer.on_error = get_error_logger().log
+    return writer
+
+@st.cache_resource
+def get_retention():
+    audit_settings = st.secrets.get("audit", {})
+    return audit.RetentionScheduler(
+        get_pool(),
+        days=int(audit_settings.get("retention_days", 0)),
+        archive=audit_settings.get("archive", audit.ARCHIVE_FILE),
+        archive_dir=audit_settings.get("archive_dir", "audit_archive"),
+        on_error=get_error_logger().log
+    )
+
+# Shared by every session of this process; other processes on the host see the same write versions
+@st.cache_resource
+def get_form_cache():
+    cache_settings = st.secrets.get("cache", {})
+    return FormCache(VersionStore(cache_settings.get("version_path")), form_window=queries.RECENT_FORMS)
+
+# Only an embedded replica needs pulling from the primary
+@st.cache_resource
+def get_syncer():
+    turso_settings = st.secrets["turso"]
+    if turso_settings.get("mode", database.REMOTE) != database.REPLICA:
+        return None
+    max_staleness = turso_settings.get("max_staleness")
+    return database.ReplicaSyncer(
+        get_pool(),
+        interval=float(turso_settings.get("sync_interval", 60.0)),
+        max_staleness=float(max_staleness) if max_staleness is not None else None,
+        on_error=get_error_logger().log
+    )
 
+# Hashing runs on a small worker pool shared by every session; upgraded hashes are saved through the writer
+@st.cache_resource
+def get_auth_service():
+    auth_settings = st.secrets.get("auth", {})
+    return auth.AuthService(
+        workers=int(auth_settings.get("workers", 2)),
+        max_pending=int(auth_settings.get("max_pending", 16)),
+        rounds=int(auth_settings.get("bcrypt_rounds", auth.BCRYPT_ROUNDS)),
+        max_failures=int(auth_settings.get("max_failures", 5)),
+        lockout=float(auth_settings.get("lockout_seconds", 300.0)),
+        store_hash=lambda user_id, hashed: get_writer().execute('UPDATE users SET password = ? WHERE id = ?', (hashed, user_id))
+    )
+
+@st.cache_resource
+def get_render_cache():
+    return certificates.RenderCache(st.secrets.get("certificates", {}).get("cache_dir"))
+
+pool = get_pool()
+error_logger = get_error_logger()
+writer = get_writer()
+retention = get_retention()
+form_cache = get_form_cache()
+render_cache = get_render_cache()
+syncer = get_syncer()
+auth_service = get_auth_service()
+
+# Peak resident memory of this process, where the platform reports it
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+# Queued for the error logger; returns at once even when the database is down
 def log_error(message):
-    timestamp = datetime.now().isoformat()
-    try:
-        cursor.execute('INSERT INTO error_logs (message, timestamp) VALUES (?, ?)', (message, timestamp))
-        db.sync()
-    except Exception as e:
-        # Fallback to Streamlit error if database logging fails
-        st.error(f"Failed to log error: {str(e)}")
-
-# Initialize database
-def init_db():
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE,
-        password TEXT,
-        is_admin BOOLEAN DEFAULT 0
-    )''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS forms (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        formNumber INTEGER,
-        date TEXT,
-        time TEXT,
-        customerName TEXT,
-        itemName TEXT,
-        mobileNumber TEXT,
-        grossWeight REAL,
-        netWeight REAL,
-        gold REAL,
-        karat REAL,
-        photo TEXT,
-        userId INTEGER
-    )''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS templates (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        itemName TEXT,
-        grossWeight REAL,
-        netWeight REAL,
-        gold REAL,
-        karat REAL,
-        userId INTEGER
-    )''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS audit_log (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        action TEXT,
-        userId INTEGER,
-        username TEXT,
-        timestamp TEXT
-    )''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS error_logs (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        message TEXT,
-        timestamp TEXT
-    )''')
-    # Create default admin user if not exists
-    cursor.execute('SELECT * FROM users WHERE username = ?', ('admin',))
-    if not cursor.fetchone():
-        hashed_password = bcrypt.hashpw('admin123'.encode('utf-8'), bcrypt.gensalt())
-        cursor.execute('INSERT INTO users (username, password, is_admin) VALUES (?, ?, ?)', ('admin', hashed_password, 1))
-    db.sync()
-
-init_db()
+    error_logger.log(message)
 
 # Session state management
 def initialize_session_state():
@@ -90,8 +148,8 @@ def initialize_session_state():
         st.session_state.forms = []
     if 'current_form_id' not in st.session_state:
         st.session_state.current_form_id = None
-    if 'current_form_index' not in st.session_state:
-        st.session_state.current_form_index = -1
+    if 'current_form_record' not in st.session_state:
+        st.session_state.current_form_record = None
     if 'is_editing' not in st.session_state:
         st.session_state.is_editing = False
     if 'templates' not in st.session_state:
@@ -101,11 +159,29 @@ def initialize_session_state():
     if 'form_data' not in st.session_state:
         st.session_state.form_data = None
     if 'form_select' not in st.session_state:
-        st.session_state.form_select = "New Form"
+        st.session_state.form_select = None
     if 'last_template_select' not in st.session_state:
         st.session_state.last_template_select = "None"
     if 'search_active' not in st.session_state:
         st.session_state.search_active = False
+    if 'pending_photo' not in st.session_state:
+        st.session_state.pending_photo = None
+    if 'pending_upload_id' not in st.session_state:
+        st.session_state.pending_upload_id = None
+    if 'photo_upload' not in st.session_state:
+        st.session_state.photo_upload = None
+    if 'import_preview' not in st.session_state:
+        st.session_state.import_preview = None
+    if 'workflow_page_keys' not in st.session_state:
+        st.session_state.workflow_page_keys = {}
+    if 'report_export' not in st.session_state:
+        st.session_state.report_export = None
+    if 'audit_page_keys' not in st.session_state:
+        st.session_state.audit_page_keys = {}
+    if 'next_form_number' not in st.session_state:
+        st.session_state.next_form_number = None
+    if 'certificate' not in st.session_state:
+        st.session_state.certificate = None
 
 initialize_session_state()
 
@@ -136,16 +212,25 @@ def login_page():
     username = st.text_input("Username", key="login_username")
     password = st.text_input("Password", type="password", key="login_password")
     if st.button("Login"):
-        cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
-        user = cursor.fetchone()
-        if user and bcrypt.checkpw(password.encode('utf-8'), user[2]):
-            st.session_state.user_id = user[0]
-            st.session_state.is_admin = bool(user[3])
-            cursor.execute('INSERT INTO audit_log (action, userId, username, timestamp) VALUES (?, ?, ?, ?)',
-                           ('login', user[0], username, datetime.now().isoformat()))
-            db.sync()
+        try:
+            user = auth_service.authenticate(cursor, username, password, st.session_state.session_id)
+        except auth.Throttled as e:
+            st.error(f"Too many failed attempts. Try again in {e.retry_after:.0f} seconds.")
+            return
+        except auth.AuthBusy:
+            st.error("Too many logins at once. Please try again in a moment.")
+            return
+        except Exception as e:
+            log_error(f"Login error: {str(e)}")
+            st.error("Login failed")
+            return
+        if user:
+            st.session_state.user_id = user.id
+            st.session_state.is_admin = user.is_admin
+            writer.execute('INSERT INTO audit_log (action, userId, username, timestamp) VALUES (?, ?, ?, ?)',
+                           ('login', user.id, username, datetime.now().isoformat()))
             st.session_state.form_data = new_form()
-            st.session_state.form_select = "New Form"
+            st.session_state.form_select = None
             st.session_state.page = "main" if not st.session_state.is_admin else "admin"
             st.success("Login successful!")
             st.rerun()
@@ -158,26 +243,29 @@ def logout():
     st.session_state.is_admin = False
     st.session_state.forms = []
     st.session_state.current_form_id = None
-    st.session_state.current_form_index = -1
+    st.session_state.current_form_record = None
     st.session_state.is_editing = False
     st.session_state.templates = []
     st.session_state.page = "login"
     st.session_state.form_data = None
-    st.session_state.form_select = "New Form"
+    st.session_state.form_select = None
     st.session_state.last_template_select = "None"
     st.session_state.search_active = False
+    st.session_state.pending_photo = None
+    st.session_state.pending_upload_id = None
+    st.session_state.photo_upload = None
+    st.session_state.import_preview = None
+    st.session_state.report_export = None
+    st.session_state.next_form_number = None
+    st.session_state.certificate = None
     st.rerun()
 
-# Load forms for a user
+# Load forms for a user; only queries when another write has changed them
+@metrics.stage('load_forms')
 def load_forms(user_id):
     try:
-        cursor.execute('SELECT * FROM forms WHERE userId = ? ORDER BY formNumber DESC', (user_id,))
-        forms = cursor.fetchall()
-        st.session_state.forms = [{
-            'id': row[0], 'formNumber': row[1], 'date': row[2], 'time': row[3],
-            'customerName': row[4], 'itemName': row[5], 'mobileNumber': row[6],
-            'grossWeight': row[7], 'netWeight': row[8], 'gold': row[9], 'karat': row[10], 'photo': row[11]
-        } for row in forms]
+        st.session_state.forms = form_cache.get_forms(
+            user_id, lambda: queries.list_forms(cursor, user_id, limit=queries.RECENT_FORMS))
         return len(st.session_state.forms)
     except Exception as e:
         log_error(f"Load forms error: {str(e)}")
@@ -185,14 +273,10 @@ def load_forms(user_id):
         return 0
 
 # Load templates for a user
+@metrics.stage('load_templates')
 def load_templates(user_id):
     try:
-        cursor.execute('SELECT * FROM templates WHERE userId = ?', (user_id,))
-        templates = cursor.fetchall()
-        st.session_state.templates = [{
-            'id': row[0], 'itemName': row[1], 'grossWeight': row[2], 'netWeight': row[3],
-            'gold': row[4], 'karat': row[5]
-        } for row in templates]
+        st.session_state.templates = form_cache.get_templates(user_id, lambda: queries.list_templates(cursor, user_id))
         return len(st.session_state.templates)
     except Exception as e:
         log_error(f"Load templates error: {str(e)}")
@@ -201,52 +285,68 @@ def load_templates(user_id):
 
 # Validate form data
 def validate_form(form_data):
-    valid = True
-    if form_data['mobileNumber'] and not (form_data['mobileNumber'].isdigit() and len(form_data['mobileNumber']) == 10):
-        st.error("Please enter a valid 10-digit mobile number")
-        valid = False
-    
-    if form_data['grossWeight'] is not None and float(form_data['grossWeight']) < 0:
-        st.error("Gross Weight must be non-negative")
-        valid = False
-    if form_data['gold'] is not None and (float(form_data['gold']) < 0 or float(form_data['gold']) > 100):
-        st.error("Gold percentage must be between 0 and 100")
-        valid = False
-    
-    if not form_data['customerName'] or not form_data['itemName'] or form_data['grossWeight'] is None or form_data['gold'] is None:
-        st.error("Customer Name, Item Name, Gross Weight, and Gold (%) are required fields for saving/printing.")
-        valid = False
-
-    return valid
+    errors = validation.validate_form_data(form_data)
+    for error in errors:
+        st.error(error)
+    return not errors
 
 # Save form
+@metrics.stage('save_form')
 def save_form(form_data):
     try:
         gross_weight_val = float(form_data['grossWeight']) if form_data['grossWeight'] is not None else None
         gold_val = float(form_data['gold']) if form_data['grossWeight'] is not None else None
 
         net_weight = gross_weight_val
-        karat = round((gold_val / 100) * 24, 2) if gold_val is not None else None
-
-        if st.session_state.current_form_id:
-            cursor.execute('''UPDATE forms SET formNumber = ?, date = ?, time = ?, customerName = ?, itemName = ?, mobileNumber = ?, 
-                            grossWeight = ?, netWeight = ?, gold = ?, karat = ?, photo = ? WHERE id = ? AND userId = ?''',
-                          (form_data['formNumber'], form_data['date'], form_data['time'], form_data['customerName'], form_data['itemName'], 
-                           form_data['mobileNumber'], gross_weight_val, net_weight, gold_val, karat, form_data['photo'], 
-                           st.session_state.current_form_id, st.session_state.user_id))
-            cursor.execute('INSERT INTO audit_log (action, userId, username, timestamp) VALUES (?, ?, ?, ?)',
-                          ('update_form', st.session_state.user_id, f"Form {form_data['formNumber']}", datetime.now().isoformat()))
-        else:
-            cursor.execute('''INSERT INTO forms (formNumber, date, time, customerName, itemName, mobileNumber, grossWeight, netWeight, 
-                            gold, karat, photo, userId) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                          (form_data['formNumber'], form_data['date'], form_data['time'], form_data['customerName'], form_data['itemName'], 
-                           form_data['mobileNumber'], gross_weight_val, net_weight, gold_val, karat, form_data['photo'], 
-                           st.session_state.user_id))
-            st.session_state.current_form_id = cursor.lastrowid
-            cursor.execute('INSERT INTO audit_log (action, userId, username, timestamp) VALUES (?, ?, ?, ?)',
-                          ('create_form', st.session_state.user_id, f"Form {form_data['formNumber']}", datetime.now().isoformat()))
-        db.sync()
-        load_forms(st.session_state.user_id)
+        karat = validation.karat_for(gold_val)
+        gold_purity = validation.gold_purity_for(gold_val, gross_weight_val)
+
+        form_id = st.session_state.current_form_id
+        user_id = st.session_state.user_id
+        # A photo still being processed belongs to this save
+        collect_photo_upload(wait=True)
+        photo_hash = form_data['photoHash'] or None
+        pending_photo = st.session_state.pending_photo
+        updated_at = datetime.now().isoformat()
+        values = (form_data['date'], form_data['time'], form_data['customerName'], form_data['itemName'], 
+                  form_data['mobileNumber'], gross_weight_val, net_weight, gold_val, karat, photo_hash, updated_at)
+
+        def write(cur):
+            if pending_photo and pending_photo['hash'] == photo_hash:
+                photos.save_photo(cur, pending_photo)
+            if form_id:
+                # A legacy inline photo the migration could not decode (photoHash '') is the
+                # only copy, so it is kept, and stays marked, until a new photo replaces it
+                cur.execute('''UPDATE forms SET date = ?, time = ?, customerName = ?, itemName = ?, mobileNumber = ?, 
+                               grossWeight = ?, netWeight = ?, gold = ?, karat = ?,
+                               photoHash = COALESCE(?, CASE WHEN photo IS NOT NULL THEN '' END), updatedAt = ?, goldPurity = ?,
+                               photo = CASE WHEN ? IS NULL THEN photo END WHERE id = ? AND userId = ?''',
+                            values + (gold_purity, photo_hash, form_id, user_id))
+                # The editor holds the number as text; records always carry an int
+                form_number, action = int(form_data['formNumber']), 'update_form'
+            else:
+                # The number is only taken now, in the same transaction as the insert
+                form_number, action = counters.allocate(cur, user_id), 'create_form'
+                cur.execute('''INSERT INTO forms (formNumber, date, time, customerName, itemName, mobileNumber, grossWeight, netWeight, 
+                               gold, karat, photoHash, updatedAt, goldPurity, createdAt, userId)
+                               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                            (form_number,) + values + (gold_purity, queries.created_at(form_data['date'], form_data['time']), user_id))
+            saved_id = form_id or cur.lastrowid
+            cur.execute('INSERT INTO audit_log (action, userId, username, timestamp) VALUES (?, ?, ?, ?)',
+                        (action, user_id, f"Form {form_number}", datetime.now().isoformat()))
+            return saved_id, form_number
+
+        saved_id, form_number = writer.submit(write, statements=4).result()
+        if not form_id:
+            form_data['formNumber'] = form_number
+            st.session_state.next_form_number = int(form_number) + 1
+        st.session_state.current_form_id = saved_id
+        st.session_state.pending_photo = None
+        # Patch the shared list with the saved row instead of reloading every form
+        saved = FormRecord.from_row((saved_id, form_number) + values)
+        st.session_state.current_form_record = saved
+        form_cache.upsert_form(user_id, saved)
+        load_forms(user_id)
         return True
     except Exception as e:
         log_error(f"Save form error: {str(e)}")
@@ -256,13 +356,14 @@ def save_form(form_data):
 # Create new form
 def new_form():
     st.session_state.current_form_id = None
-    st.session_state.current_form_index = -1
+    st.session_state.current_form_record = None
     st.session_state.is_editing = True
     st.session_state.last_template_select = "None"
     
-    cursor.execute('SELECT formNumber FROM forms WHERE userId = ? ORDER BY formNumber DESC LIMIT 1', (st.session_state.user_id,))
-    latest_form_number_db = cursor.fetchone()
-    form_number = int(latest_form_number_db[0]) + 1 if latest_form_number_db else 1
+    # Only a preview; the real number is allocated when the form is saved
+    if st.session_state.next_form_number is None:
+        st.session_state.next_form_number = counters.peek_next(cursor, st.session_state.user_id)
+    form_number = st.session_state.next_form_number
 
     now = datetime.now()
     return {
@@ -276,106 +377,95 @@ def new_form():
         'netWeight': None,
         'gold': None,
         'karat': None,
-        'photo': '',
+        'photoHash': None,
         'goldPurity': None
     }
 
-# Helper to load form data into st.session_state.form_data from a given list
-def load_form_from_list(index, form_list):
-    if 0 <= index < len(form_list):
-        st.session_state.current_form_index = index
-        st.session_state.current_form_id = form_list[index]['id']
-        st.session_state.is_editing = False
-        form_data = form_list[index].copy()
-        form_data['goldPurity'] = round((float(form_data['gold']) * float(form_data['grossWeight'])) / 100, 3) if form_data['gold'] is not None and form_data['grossWeight'] is not None else None
-        return form_data
-    return None
+# Load a form record into st.session_state.form_data. Records are shared between
+# sessions; only the form being edited gets its own copy.
+def load_form_record(record):
+    st.session_state.current_form_id = record.id
+    st.session_state.current_form_record = record
+    st.session_state.is_editing = False
+    return record.to_form_data()
+
+# The form before (older) or after the one on screen. Search hits are stepped through
+# in their ranked order; otherwise it is a single indexed seek on the form number.
+def adjacent_form(older, search_results=None):
+    record = st.session_state.current_form_record
+    if search_results is not None:
+        ids = [f.id for f in search_results]
+        if record is None or record.id not in ids:
+            return search_results[0] if older and search_results else None
+        position = ids.index(record.id) + (1 if older else -1)
+        return search_results[position] if 0 <= position < len(search_results) else None
+    if record is None:
+        return st.session_state.forms[0] if older and st.session_state.forms else None
+    seek = queries.prev_form if older else queries.next_form
+    return seek(cursor, st.session_state.user_id, record.formNumber)
 
 # Save template
 def save_template(template_data):
     try:
         gold_val = float(template_data['gold']) if template_data['gold'] is not None else None
-        karat = round((gold_val / 100) * 24, 2) if gold_val is not None else None
+        karat = validation.karat_for(gold_val)
         gross_weight_val = float(template_data['grossWeight']) if template_data['grossWeight'] is not None else None
 
-        cursor.execute('''INSERT INTO templates (itemName, grossWeight, netWeight, gold, karat, userId)
+        template_id = writer.execute('''INSERT INTO templates (itemName, grossWeight, netWeight, gold, karat, userId)
                          VALUES (?, ?, ?, ?, ?, ?)''',
                       (template_data['itemName'], gross_weight_val, gross_weight_val,
-                       gold_val, karat, st.session_state.user_id))
-        db.sync()
+                       gold_val, karat, st.session_state.user_id)).result()
+        form_cache.add_template(st.session_state.user_id, dict(zip(queries.TEMPLATE_COLUMNS, (
+            template_id, template_data['itemName'], gross_weight_val, gross_weight_val, gold_val, karat))))
         load_templates(st.session_state.user_id)
         st.success("Template saved successfully")
     except Exception as e:
         log_error(f"Save template error: {str(e)}")
         st.error("Error saving template")
 
-# Generate print HTML
-def generate_print_html(form):
-    karat_display = f"{form['karat']:.2f}" if form['karat'] is not None else ''
-    gold_display = f"{form['gold']:.3f}" if form['gold'] is not None else ''
-    sample_weight_display = f"{form['grossWeight']:.3f}" if form['grossWeight'] is not None else ''
-    gold_purity_display = f"{form['goldPurity']:.3f}" if form['goldPurity'] is not None else ''
-
-    styles = {
-        'date': 'position: absolute; top: 80px; left: 30px; width: 100px; font-size: 14px;',
-        'time': 'position: absolute; top: 80px; left: 200px; width: 100px; font-size: 14px;',
-        'formNumber': 'position: absolute; top: 80px; left: 350px; width: 100px; font-size: 14px;',
-        'customerName': 'position: absolute; top: 120px; left: 30px; width: 350px; font-size: 16px;',
-        'itemName': 'position: absolute; top: 160px; left: 30px; width: 350px; font-size: 14px;',
-        'sampleWeight': 'position: absolute; top: 200px; left: 30px; width: 100px; font-size: 14px;',
-        'fineness': 'position: absolute; top: 240px; left: 30px; width: 100px; font-size: 14px; color: red; font-weight: bold;',
-        'goldPurity': 'position: absolute; top: 280px; left: 30px; width: 100px; font-size: 14px;',
-        'karat': 'position: absolute; top: 320px; left: 30px; width: 100px; font-size: 14px;',
-        'photo': 'position: absolute; top: 120px; right: 30px; width: 200px; height: 200px; object-fit: contain; border: 1px solid #ccc;'
-    }
+# Take the result of the photo upload started by an earlier run, once it is ready
+# (or, with `wait`, as soon as it is). Returns True while it is still processing.
+def collect_photo_upload(wait=False):
+    upload = st.session_state.photo_upload
+    if upload is None:
+        return False
+    form_id, future = upload
+    if not wait and not future.done():
+        return True
+    st.session_state.photo_upload = None
+    try:
+        photo = future.result(timeout=30.0)
+    except photos.PhotoTooLarge as e:
+        st.error(str(e))
+        return False
+    except Exception as e:
+        log_error(f"Photo upload error: {str(e)}")
+        st.error("Could not read the uploaded photo")
+        return False
+    # Dropped if the user moved on to another form in the meantime
+    if form_id == st.session_state.current_form_id and st.session_state.form_data is not None:
+        st.session_state.pending_photo = photo
+        st.session_state.form_data['photoHash'] = photo['hash']
+    return False
 
-    return f'''
-    <html>
-        <head>
-            <style>
-                @page {{
-                    size: 6in 7.5in;
-                    margin: 0;
-                }}
-                body {{
-                    font-family: Arial, sans-serif;
-                    margin: 0;
-                    padding: 0;
-                    width: 432px; /* 6 inches at 72 DPI */
-                    height: 540px; /* 7.5 inches at 72 DPI */
-                    position: relative;
-                    overflow: hidden; /* Prevent content from spilling to additional pages */
-                }}
-                .print-overlay {{
-                    position: absolute;
-                    top: 0;
-                    left: 0;
-                    width: 100%;
-                    height: 100%;
-                    page-break-after: avoid;
-                    page-break-inside: avoid;
-                }}
-                .header, .footer, .title, .subtitle, .contact-info, .certificate {{
-                    display: none;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="print-overlay">
-                <div style="{styles['date']}"><span>{form['date'] or ''}</span></div>
-                <div style="{styles['time']}"><span>{form['time'] or ''}</span></div>
-                <div style="{styles['formNumber']}"><span>{form['formNumber'] or ''}</span></div>
-                <div style="{styles['customerName']}"><span>{form['customerName'] or ''}</span></div>
-                <div style="{styles['itemName']}"><span>{form['itemName'] or ''}</span></div>
-                <div style="{styles['sampleWeight']}"><span>{sample_weight_display} g</span></div>
-                <div style="{styles['fineness']}"><span>{gold_display} %</span></div>
-                <div style="{styles['goldPurity']}"><span>{gold_purity_display} g</span></div>
-                <div style="{styles['karat']}"><span>{karat_display}</span></div>
-                {f'<img src="{form["photo"]}" alt="Photo" style="{styles["photo"]}">' if form["photo"] else ''}
-            </div>
-        </body>
-    </html>
-    '''
+# Placeholder shown while the photo is processed; reruns the page once it is ready
+@st.fragment(run_every=0.5)
+def photo_upload_status():
+    if collect_photo_upload():
+        st.info("Processing photo...")
+    else:
+        st.rerun()
+
+# Photo variant for the form being edited, whether it is stored yet or not
+def load_photo_variant(photo_hash, variant):
+    pending = st.session_state.pending_photo
+    if pending and pending['hash'] == photo_hash:
+        return pending[photos.VARIANT_COLUMNS[variant]], pending['mimeType']
+    return photos.load_photo(cursor, photo_hash, variant)
+
+def load_original_photo(photo_hash):
+    photo = photos.load_photo(cursor, photo_hash, 'original')
+    return photo[0] if photo else None
 
 # Print form directly
 def print_form(form):
@@ -385,36 +475,19 @@ def print_form(form):
 
         if validate_form(form):
             form['netWeight'] = form['grossWeight']
-            form['karat'] = round((float(form['gold']) / 100) * 24, 2) if form['gold'] is not None else None
-            form['goldPurity'] = round((float(form['gold']) * float(form['grossWeight'])) / 100, 3) if form['gold'] is not None and form['grossWeight'] is not None else None
+            form['karat'] = validation.karat_for(form['gold'])
+            form['goldPurity'] = validation.gold_purity_for(form['gold'], form['grossWeight'])
 
             if save_form(form):
-                html_content = generate_print_html(form)
-                components.html(
-                    f"""
-                    <script>
-                        var win = window.open('', '_blank');
-                        if (win) {{
-                            win.document.write(`{html_content}`);
-                            win.document.close();
-                            win.onload = function() {{
-                                setTimeout(function() {{
-                                    win.print();
-                                    win.close();
-                                }}, 500);
-                            }};
-                        }} else {{
-                            console.error('Failed to open new window. Please allow pop-ups.');
-                            alert('Failed to open print window. Please allow pop-ups for this site.');
-                        }}
-                    </script>
-                    """,
-                    height=0,
-                    width=0
-                )
+                # Make sure the certificate is durable before it goes to paper
+                writer.flush()
+                photo = load_photo_variant(form['photoHash'], 'print') if form['photoHash'] else None
+                with metrics.timed(metrics.STAGE, 'render_print_document'):
+                    document = printing.render_document([printing.render_page(form)], {form['photoHash']: photo} if photo else {})
+                components.html(printing.print_script(document), height=0, width=0)
                 st.success("Form saved and sent to printer!")
                 st.session_state.form_data = new_form()
-                st.session_state.form_select = "New Form"
+                st.session_state.form_select = None
                 st.session_state.search_active = False
                 st.rerun()
             else:
@@ -444,71 +517,136 @@ def admin_page():
             if cursor.fetchone():
                 st.error("Username already exists")
             else:
-                hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
                 try:
-                    cursor.execute('INSERT INTO users (username, password, is_admin) VALUES (?, ?, ?)', (new_username, hashed_password, 0))
-                    cursor.execute('INSERT INTO audit_log (action, userId, username, timestamp) VALUES (?, ?, ?, ?)',
-                                  ('create_user', st.session_state.user_id, new_username, datetime.now().isoformat()))
-                    db.sync()
+                    hashed_password = auth_service.hash_password(new_password)
+                    writer.execute_many([
+                        ('INSERT INTO users (username, password, is_admin) VALUES (?, ?, ?)', (new_username, hashed_password, 0)),
+                        ('INSERT INTO audit_log (action, userId, username, timestamp) VALUES (?, ?, ?, ?)',
+                         ('create_user', st.session_state.user_id, new_username, datetime.now().isoformat()))
+                    ]).result()
+                    auth_service.users.invalidate(new_username)
                     st.success("User created successfully")
                 except Exception as e:
                     log_error(f"Create user error: {str(e)}")
                     st.error("Error creating user")
 
+    st.subheader("Bulk Import")
+    cursor.execute('SELECT id, username FROM users ORDER BY username')
+    user_ids = {username: user_id for user_id, username in cursor.fetchall()}
+    import_user = st.selectbox("Import Forms For", list(user_ids), key="import_user")
+    import_file = st.file_uploader("Forms File (CSV or Excel)", type=["csv", "xlsx", "xls"], key="import_file")
+    if import_file is not None:
+        try:
+            # Parse and validate once per uploaded file, not on every rerun
+            preview = st.session_state.import_preview
+            if preview is None or preview['file_id'] != import_file.file_id:
+                table = importer.read_table(import_file, import_file.name)
+                frame, errors = importer.prepare(table)
+                preview = st.session_state.import_preview = {
+                    'file_id': import_file.file_id, 'table': table, 'frame': frame, 'errors': errors, 'imported': None}
+            rejected = int((preview['errors'] != '').sum())
+            valid = len(preview['frame']) - rejected
+            st.write(f"{valid} valid rows, {rejected} rejected")
+            if rejected:
+                report = importer.error_report(preview['table'], preview['errors'])
+                st.dataframe(report)
+                st.download_button("Download Rejected Rows", report.to_csv(index=False), file_name="rejected_rows.csv", mime="text/csv")
+            if preview['imported'] is not None:
+                st.info(f"This file was already imported ({preview['imported']} forms)")
+            elif st.button(f"Import {valid} Forms", key="import_button", disabled=valid == 0):
+                with pool.connection() as conn:
+                    preview['imported'] = importer.import_forms(conn, user_ids[import_user], preview['frame'], preview['errors'])
+                form_cache.invalidate(user_ids[import_user])
+                st.session_state.workflow_page_keys = {}
+                st.success(f"Imported {preview['imported']} forms for {import_user}")
+        except importer.ImportFailed as e:
+            st.error(str(e))
+        except Exception as e:
+            log_error(f"Bulk import error: {str(e)}")
+            st.error("Failed to import forms")
+
+    # Tokens for analyzers and scales posting to the ingestion API (python -m api)
+    st.subheader("API Tokens")
+    col1, col2, col3 = st.columns([2, 2, 1])
+    token_user = col1.selectbox("Writes Forms As", list(user_ids), key="api_token_user")
+    token_name = col2.text_input("Device Name", key="api_token_name")
+    if col3.button("Create Token", key="create_api_token_button"):
+        if not token_name:
+            st.error("Device name is required")
+        else:
+            try:
+                token = writer.submit(lambda cur: apikeys.create_token(cur, user_ids[token_user], token_name)).result()
+                st.success("Token created. Copy it now; it is not shown again.")
+                st.code(token)
+            except Exception as e:
+                log_error(f"Create API token error: {str(e)}")
+                st.error("Failed to create token")
+    try:
+        tokens = apikeys.list_tokens(cursor)
+        if tokens:
+            st.dataframe(pd.DataFrame([{
+                'ID': token['id'], 'Device': token['name'], 'User': token['username'], 'Created': token['createdAt'],
+                'Revoked': token['revokedAt'] or ''
+            } for token in tokens]), hide_index=True)
+            active = {f"{token['name']} ({token['username']})": token['id'] for token in tokens if not token['revokedAt']}
+            if active:
+                col1, col2 = st.columns([3, 1])
+                revoke = col1.selectbox("Revoke Token", list(active), key="api_token_revoke")
+                if col2.button("Revoke", key="revoke_api_token_button"):
+                    writer.submit(lambda cur: apikeys.revoke_token(cur, active[revoke])).result()
+                    st.rerun()
+        st.caption("Revoked tokens stop working within a minute")
+    except Exception as e:
+        log_error(f"API tokens error: {str(e)}")
+        st.error("Failed to load API tokens")
+
     st.subheader("Workflow Monitoring")
     sort_by = st.selectbox("Sort By", ["formNumber", "date", "username"], key="sort_by")
     filter_username = st.text_input("Filter by Username", key="filter_username")
     items_per_page = 10
     
     try:
-        cursor.execute('SELECT f.*, u.username FROM forms f JOIN users u ON f.userId = u.id')
-        forms = cursor.fetchall()
-        df = pd.DataFrame([{
-            'Username': row[12], 'Form Number': row[1], 'Date': row[2], 'Customer Name': row[4],
-            'Item Name': row[5], 'Mobile Number': row[6], 'Gross Weight': row[7],
-            'Net Weight': row[8], 'Gold': row[9], 'Karat': row[10], 'id': row[0], 'Photo': row[11]
-        } for row in forms])
-
-        if filter_username:
-            df = df[df['Username'].str.lower().str.contains(filter_username.lower())]
-        
-        df['Date_dt'] = pd.to_datetime(df['Date'], format='%d-%m-%Y', errors='coerce')
-
-        if sort_by == 'formNumber':
-            df = df.sort_values('Form Number', ascending=False)
-        elif sort_by == 'date':
-            df = df.sort_values('Date_dt', ascending=False)
-        elif sort_by == 'username':
-            df = df.sort_values('Username')
-        
-        df = df.drop(columns=['Date_dt'])
-
-        total_pages = max(1, (len(df) + items_per_page - 1) // items_per_page)
+        total = queries.count_workflow_forms(cursor, filter_username)
+        total_pages = max(1, (total + items_per_page - 1) // items_per_page)
         page = st.number_input("Select Page", min_value=1, value=1, step=1, key="page_select")
         page = min(page, total_pages)
-        start_idx = (page - 1) * items_per_page
-        end_idx = start_idx + items_per_page
-        paginated_df = df.iloc[start_idx:end_idx]
-        
+
+        # Remember the seek key of every page we have reached for this sort and filter
+        page_keys = st.session_state.workflow_page_keys.setdefault((sort_by, filter_username), {1: None})
+        if page not in page_keys:
+            page_keys[page] = queries.workflow_page_key(cursor, sort_by, filter_username, (page - 1) * items_per_page)
+        rows, next_key = queries.page_workflow_forms(cursor, sort_by, filter_username, page_keys[page], items_per_page)
+        if next_key is not None:
+            page_keys[page + 1] = next_key
+
         st.write(f"Showing page {page} of {total_pages}")
-        for index, row in paginated_df.iterrows():
-            with st.expander(f"Form {row['Form Number']} - {row['Customer Name'] or 'No Customer'}"):
-                st.write(f"**Username:** {row['Username']}")
-                st.write(f"**Date:** {row['Date']}")
-                st.write(f"**Item Name:** {row['Item Name'] or 'N/A'}")
-                st.write(f"**Mobile Number:** {row['Mobile Number'] or 'N/A'}")
-                st.write(f"**Gross Weight:** {row['Gross Weight'] or 'N/A'} g")
-                st.write(f"**Net Weight:** {row['Net Weight'] or 'N/A'} g")
-                st.write(f"**Gold:** {row['Gold'] or 'N/A'} %")
-                st.write(f"**Karat:** {f'{row['Karat']:.2f}' if row['Karat'] is not None else 'N/A'}")
-                if row['Photo']:
-                    st.image(row['Photo'], caption="Form Photo", width=300)
-                if st.button(f"Delete Form {row['Form Number']}", key=f"delete_{row['id']}"):
+        for row in rows:
+            with st.expander(f"Form {row['formNumber']} - {row['customerName'] or 'No Customer'}"):
+                karat_display = f"{row['karat']:.2f}" if row['karat'] is not None else 'N/A'
+                st.write(f"**Username:** {row['username']}")
+                st.write(f"**Date:** {row['date']}")
+                st.write(f"**Item Name:** {row['itemName'] or 'N/A'}")
+                st.write(f"**Mobile Number:** {row['mobileNumber'] or 'N/A'}")
+                st.write(f"**Gross Weight:** {row['grossWeight'] or 'N/A'} g")
+                st.write(f"**Net Weight:** {row['netWeight'] or 'N/A'} g")
+                st.write(f"**Gold:** {row['gold'] or 'N/A'} %")
+                st.write(f"**Karat:** {karat_display}")
+                # Expander bodies always run, so only fetch the photo when asked for
+                if st.checkbox("Show Photo", key=f"show_photo_{row['id']}"):
+                    photo = queries.get_form_photo(cursor, row['id'])
+                    if photo:
+                        st.image(photo, caption="Form Photo", width=300)
+                    else:
+                        st.write("No photo")
+                if st.button(f"Delete Form {row['formNumber']}", key=f"delete_{row['id']}"):
                     try:
-                        cursor.execute('DELETE FROM forms WHERE id = ?', (row['id'],))
-                        cursor.execute('INSERT INTO audit_log (action, userId, username, timestamp) VALUES (?, ?, ?, ?)',
-                                      ('delete_form', st.session_state.user_id, f"Form {row['Form Number']}", datetime.now().isoformat()))
-                        db.sync()
+                        writer.execute_many([
+                            ('DELETE FROM forms WHERE id = ?', (row['id'],)),
+                            ('INSERT INTO audit_log (action, userId, username, timestamp) VALUES (?, ?, ?, ?)',
+                             ('delete_form', st.session_state.user_id, f"Form {row['formNumber']}", datetime.now().isoformat()))
+                        ]).result()
+                        form_cache.remove_form(row['userId'], row['id'])
+                        st.session_state.workflow_page_keys = {}
                         st.success("Form deleted successfully")
                         st.rerun()
                     except Exception as e:
@@ -519,62 +657,270 @@ def admin_page():
         st.error("Failed to load workflow")
 
     st.subheader("Audit Log")
+    col1, col2, col3, col4 = st.columns(4)
+    audit_start = col1.date_input("From Date", value=None, format="DD-MM-YYYY", key="audit_start_date")
+    audit_end = col2.date_input("To Date", value=None, format="DD-MM-YYYY", key="audit_end_date")
+    audit_action = col3.selectbox("Action", ("All",) + audit.ACTIONS, key="audit_action")
+    audit_user = col4.text_input("User", key="audit_user")
+    audit_filters = (audit_start, audit_end, None if audit_action == "All" else audit_action, audit_user)
+    audit_per_page = 20
     try:
-        cursor.execute('SELECT * FROM audit_log ORDER BY timestamp DESC')
-        logs = cursor.fetchall()
+        total = audit.count_audit(cursor, *audit_filters)
+        total_pages = max(1, (total + audit_per_page - 1) // audit_per_page)
+        page = st.number_input("Audit Page", min_value=1, value=1, step=1, key="audit_page_select")
+        page = min(page, total_pages)
+        page_keys = st.session_state.audit_page_keys.setdefault(audit_filters, {1: None})
+        if page not in page_keys:
+            page_keys[page] = audit.audit_page_key(cursor, *audit_filters, offset=(page - 1) * audit_per_page)
+        logs, next_key = audit.page_audit(cursor, *audit_filters, after=page_keys[page], limit=audit_per_page)
+        if next_key is not None:
+            page_keys[page + 1] = next_key
         df = pd.DataFrame([{
-            'Action': row[1], 'User ID': row[2], 'Username': row[3], 'Timestamp': row[4]
+            'Action': row['action'], 'User ID': row['userId'], 'Username': row['username'], 'Timestamp': row['timestamp']
         } for row in logs])
+        st.write(f"Showing page {page} of {total_pages} ({total} entries)")
         st.dataframe(df)
     except Exception as e:
         log_error(f"Audit log error: {str(e)}")
         st.error("Failed to load audit log")
 
+    if retention.days:
+        st.caption(f"Entries older than {retention.days} days are archived to "
+                   f"{'the audit_log_archive table' if retention.archive == audit.ARCHIVE_TABLE else retention.archive_dir}. "
+                   f"Last run: {retention.last_run.strftime('%d-%m-%Y %H:%M:%S') if retention.last_run else 'never'} "
+                   f"({retention.last_moved} archived)")
+        if st.button("Apply Retention Now", key="apply_retention_button"):
+            try:
+                moved = retention.run_now()
+                st.session_state.audit_page_keys = {}
+                st.success(f"Archived {moved} audit entries")
+            except Exception as e:
+                log_error(f"Audit retention error: {str(e)}")
+                st.error("Failed to apply retention policy")
+
+    # Each row is a group of identical errors; count says how many it stands for
+    st.subheader("Error Log")
+    col1, col2 = st.columns(2)
+    error_hours = col1.selectbox("Period", [1, 24, 24 * 7], index=1, format_func=lambda h: f"Last {h} hours" if h < 48 else "Last 7 days",
+                                 key="error_period")
+    error_text = col2.text_input("Message Contains", key="error_text")
+    error_since = datetime.now() - timedelta(hours=error_hours)
+    try:
+        rates = errorlog.hourly_rate(cursor, error_since)
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Errors", sum(rate['errors'] for rate in rates))
+        col2.metric("Last Hour", sum(rate['errors'] for rate in rates
+                                     if rate['hour'] >= (datetime.now() - timedelta(hours=1)).isoformat()[:13]))
+        col3.metric("Rows Written", sum(rate['messages'] for rate in rates))
+        if rates:
+            st.bar_chart(pd.DataFrame(rates).set_index('hour')[['errors']])
+        errors = errorlog.recent_errors(cursor, error_since, error_text)
+        st.dataframe(pd.DataFrame([{
+            'Message': row['message'], 'Count': row['count'], 'First Seen': row['timestamp'], 'Last Seen': row['lastSeen']
+        } for row in errors]), hide_index=True)
+    except Exception as e:
+        log_error(f"Error log viewer error: {str(e)}")
+        st.error("Failed to load error log")
+    stats = error_logger.stats()
+    st.caption(f"Logged: {stats['logged']} · Collapsed into earlier rows: {stats['collapsed']} · Pending: {stats['pending']} · "
+               f"Dropped (queue full): {stats['dropped']} · Spooled to file: {stats['spooled']} "
+               f"({stats['spool_bytes'] / 1024:.1f} KiB waiting) · Replayed: {stats['replayed']}")
+
+    # Reads only the per-day aggregates kept by triggers on forms
+    st.subheader("Gold Analytics")
+    col1, col2, col3, col4 = st.columns(4)
+    today = datetime.now().date()
+    analytics_start = col1.date_input("From", value=today - timedelta(days=90), format="DD-MM-YYYY", key="analytics_start")
+    analytics_end = col2.date_input("To", value=today, format="DD-MM-YYYY", key="analytics_end")
+    analytics_period = col3.selectbox("Period", list(analytics.PERIODS), index=1, key="analytics_period")
+    analytics_by_user = col4.checkbox("Per User", key="analytics_by_user")
+    try:
+        summary = analytics.load_summary(cursor, analytics_start, analytics_end)
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Forms Tested", int(summary['forms'].sum()))
+        col2.metric("Sample Weight", f"{summary['sampleWeight'].sum():.3f} g")
+        col3.metric("Fine Gold", f"{summary['fineGold'].sum():.3f} g")
+        totals = analytics.rollup(summary, analytics_period, analytics_by_user)
+        period_column = analytics_period.lower()
+        if not totals.empty:
+            chart = (totals.pivot(index=period_column, columns='username', values='fineGold') if analytics_by_user
+                     else totals.set_index(period_column)[['fineGold']])
+            st.bar_chart(chart)
+        st.dataframe(totals.rename(columns={
+            period_column: analytics_period, 'username': 'Username', 'forms': 'Forms', 'sampleWeight': 'Sample Weight (g)',
+            'fineGold': 'Fine Gold (g)', 'purity': 'Avg Purity (%)'}), hide_index=True)
+    except Exception as e:
+        log_error(f"Analytics error: {str(e)}")
+        st.error("Failed to load analytics")
+
+    st.subheader("Connection Pool")
+    stats = pool.stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("In Use", f"{stats['in_use']} / {stats['size']}")
+    col2.metric("Peak In Use", stats['peak_in_use'])
+    col3.metric("Avg Wait", f"{stats['wait_avg'] * 1000:.1f} ms")
+    col4.metric("Max Wait", f"{stats['wait_max'] * 1000:.1f} ms")
+    st.caption(f"Checkouts: {stats['checkouts']} · Connections created: {stats['created']} · Reconnects: {stats['reconnects']} · Timeouts: {stats['timeouts']}")
+    if syncer is not None:
+        staleness = syncer.staleness()
+        st.caption(f"Embedded replica · Last pull: {f'{staleness:.0f}s ago' if staleness is not None else 'never'} · "
+                   f"Pulls: {syncer.syncs} · Sync errors: {syncer.errors} · "
+                   f"Max staleness: {f'{syncer.max_staleness:.0f}s' if syncer.max_staleness is not None else 'unbounded'}")
+
+    st.subheader("Write Path")
+    stats = writer.stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Mode", stats['mode'])
+    col2.metric("Avg Statements / Commit", f"{stats['avg_group_size']:.1f}")
+    col3.metric("Syncs", stats['syncs'])
+    col4.metric("Pending", stats['pending'])
+    st.caption(f"Units: {stats['units']} · Commits: {stats['groups']} · Failed units: {stats['failed_units']} · Sync errors: {stats['sync_errors']}")
+
+    st.subheader("Read Cache")
+    stats = form_cache.stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Cached Users", stats['users'])
+    col2.metric("Hits", stats['hits'])
+    col3.metric("Misses", stats['misses'])
+    rss = peak_rss_mb()
+    st.caption(f"Form records held: {stats['records']} ({stats['bytes'] / 1024:.1f} KiB, shared by all sessions)"
+               + (f" · Peak process RSS: {rss:.1f} MB" if rss is not None else ""))
+
+    st.subheader("Authentication")
+    stats = auth_service.stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Logins", stats['logins'])
+    col2.metric("Failed", stats['failures'])
+    col3.metric("Throttled", stats['throttled'])
+    col4.metric("Avg Hash", f"{stats['avg_hash_ms']:.0f} ms")
+    st.caption(f"bcrypt cost: {auth_service.rounds} · Rehashed at login: {stats['rehashed']} · "
+               f"Refused while busy: {stats['busy']} · User lookups cached: {stats['user_cache_hits']} of "
+               f"{stats['user_cache_hits'] + stats['user_cache_misses']}")
+
+    # Latency of pages, stages, queries and syncs in this process since start or the last reset
+    st.subheader("Performance")
+    snapshot = metrics.registry.snapshot()
+    performance_columns = {'name': 'Operation', 'count': 'Calls', 'p50_ms': 'p50 (ms)', 'p95_ms': 'p95 (ms)',
+                           'p99_ms': 'p99 (ms)', 'max_ms': 'Max (ms)', 'total_s': 'Total (s)'}
+    for kind, label in ((metrics.PAGE, "Pages"), (metrics.STAGE, "Stages"), (metrics.SYNC, "Syncs")):
+        rows = metrics.summary(snapshot, kind)
+        if rows:
+            st.markdown(f"**{label}**")
+            st.dataframe(pd.DataFrame(rows)[list(performance_columns)].rename(columns=performance_columns).round(2),
+                         hide_index=True)
+    slow_queries = metrics.summary(snapshot, metrics.QUERY)[:10]
+    if slow_queries:
+        st.markdown("**Slowest Queries (by p95)**")
+        query_columns = dict(performance_columns, name='Statement', rows_per_call='Rows / Call', bytes_per_call='Bytes / Call')
+        st.dataframe(pd.DataFrame(slow_queries)[list(query_columns)].rename(columns=query_columns).round(2), hide_index=True)
+    st.caption(f"Since {datetime.fromtimestamp(metrics.registry.since).strftime('%d-%m-%Y %H:%M:%S')} · "
+               "Percentiles are bucketed and accurate to about 20%")
+    if st.button("Reset Performance Metrics", key="reset_metrics_button"):
+        metrics.registry.reset()
+        st.rerun()
+
 # Report page
 def report_page():
     st.title("Form Report")
     sort_by = st.selectbox("Sort By", ["formNumber", "date"], key="report_sort_by")
     filter_customer = st.text_input("Filter by Customer Name", key="filter_customer")
+    col1, col2 = st.columns(2)
+    start_date = col1.date_input("From Date", value=None, format="DD-MM-YYYY", key="report_start_date")
+    end_date = col2.date_input("To Date", value=None, format="DD-MM-YYYY", key="report_end_date")
+    if st.checkbox("Today's forms only", key="report_today"):
+        start_date = end_date = datetime.now().date()
     items_per_page = 10
+    user_id = st.session_state.user_id
     
     try:
-        cursor.execute('SELECT * FROM forms WHERE userId = ?', (st.session_state.user_id,))
-        forms = cursor.fetchall()
-        df = pd.DataFrame([{
-            'Form Number': row[1], 'Date': row[2], 'Customer Name': row[4], 'Item Name': row[5],
-            'Mobile Number': row[6], 'Gross Weight': row[7], 'Net Weight': row[8],
-            'Gold': row[9], 'Karat': row[10]
-        } for row in forms])
-        
-        df['Date_dt'] = pd.to_datetime(df['Date'], format='%d-%m-%Y', errors='coerce')
-
-        if filter_customer:
-            df = df[df['Customer Name'].str.lower().str.contains(filter_customer.lower(), na=False)]
-        
-        if sort_by == 'formNumber':
-            df = df.sort_values('Form Number', ascending=False)
-        elif sort_by == 'date':
-            df = df.sort_values('Date_dt', ascending=False)
-        
-        df = df.drop(columns=['Date_dt'])
-
-        df['Karat'] = df['Karat'].apply(lambda x: f"{x:.2f}" if pd.notna(x) else 'N/A')
-        
-        total_pages = max(1, (len(df) + items_per_page - 1) // items_per_page)
+        total = queries.count_report_rows(cursor, user_id, filter_customer, start_date, end_date)
+        total_pages = max(1, (total + items_per_page - 1) // items_per_page)
         page = st.number_input("Select Page", min_value=1, value=1, step=1, key="report_page_select")
         page = min(page, total_pages)
-        start_idx = (page - 1) * items_per_page
-        end_idx = start_idx + items_per_page
-        paginated_df = df.iloc[start_idx:end_idx]
+        rows = queries.page_report_rows(cursor, user_id, sort_by, filter_customer, start_date, end_date,
+                                        items_per_page, (page - 1) * items_per_page)
+        df = pd.DataFrame([{
+            'Form Number': row['formNumber'], 'Date': row['date'], 'Customer Name': row['customerName'], 'Item Name': row['itemName'],
+            'Mobile Number': row['mobileNumber'], 'Gross Weight': row['grossWeight'], 'Net Weight': row['netWeight'],
+            'Gold': row['gold'], 'Karat': f"{row['karat']:.2f}" if row['karat'] is not None else 'N/A'
+        } for row in rows])
         
         st.write(f"Showing page {page} of {total_pages}")
-        st.dataframe(paginated_df)
-        csv = df.to_csv(index=False)
-        st.download_button("Download CSV", csv, file_name="report.csv", mime="text/csv")
+        st.dataframe(df)
     except Exception as e:
         log_error(f"Report error: {str(e)}")
         st.error("Failed to load report")
 
+    # The export only runs when asked for, and streams rows into a temp file
+    st.subheader("Export")
+    export_format = st.selectbox("Format", export.available_formats(), format_func=str.upper, key="report_export_format")
+    export_filters = (export_format, sort_by, filter_customer, start_date, end_date)
+    if st.button("Prepare Export", key="prepare_export_button"):
+        try:
+            with metrics.timed(metrics.STAGE, 'export_report'):
+                fileobj, mime_type, extension, exported = export.export_report(cursor, user_id, *export_filters)
+            st.session_state.report_export = (export_filters, fileobj, mime_type, extension, exported)
+        except Exception as e:
+            log_error(f"Report export error: {str(e)}")
+            st.error("Failed to export report")
+    prepared = st.session_state.report_export
+    if prepared and prepared[0] == export_filters:
+        _, fileobj, mime_type, extension, exported = prepared
+        # st.download_button takes bytes or a real file, not a spooled temp file
+        fileobj.seek(0)
+        st.download_button(f"Download {extension.upper()} ({exported} forms)", fileobj.read(), file_name=f"report.{extension}", mime=mime_type)
+
+    # Reprint many certificates in one document and one print dialog
+    st.subheader("Batch Print")
+    select_by = st.radio("Select Forms By", ["Form Range", "Date", "Search"], horizontal=True, key="batch_print_by")
+    if select_by == "Form Range":
+        col1, col2 = st.columns(2)
+        first = col1.number_input("From Form", min_value=1, value=1, step=1, key="batch_print_first")
+        last = col2.number_input("To Form", min_value=1, value=first, step=1, key="batch_print_last")
+    elif select_by == "Date":
+        print_date = st.date_input("Date", format="DD-MM-YYYY", key="batch_print_date")
+    else:
+        print_query = st.text_input("Search", key="batch_print_query")
+    def select_batch():
+        if select_by == "Form Range":
+            return printing.select_by_range(cursor, user_id, int(first), int(last))
+        if select_by == "Date":
+            return printing.select_by_date(cursor, user_id, print_date)
+        return search.search_forms(cursor, user_id, print_query, limit=printing.MAX_BATCH) if print_query else []
+
+    col1, col2 = st.columns(2)
+    if col1.button("Print Forms", key="batch_print_button"):
+        try:
+            selected = select_batch()
+            if selected:
+                with metrics.timed(metrics.STAGE, 'render_print_batch'):
+                    document = printing.render_batch(cursor, selected)
+                components.html(printing.print_script(document), height=0, width=0)
+                st.success(f"Sent {len(selected)} forms to the printer"
+                           + (f" (at most {printing.MAX_BATCH} per job)" if len(selected) == printing.MAX_BATCH else ""))
+            else:
+                st.warning("No forms match the selection")
+        except Exception as e:
+            log_error(f"Batch print error: {str(e)}")
+            st.error("Failed to print forms")
+    if col2.button("Prepare PDF", key="batch_pdf_button"):
+        try:
+            matched = select_batch()
+            # Every page is rendered at printer DPI, so a PDF takes fewer forms than a print job
+            selected = matched[:certificates.MAX_PDF_PAGES]
+            if selected:
+                with metrics.timed(metrics.STAGE, 'render_batch_pdf'):
+                    data = render_cache.batch_pdf([record.to_form_data() for record in selected], load_original_photo)
+                if len(matched) > len(selected):
+                    st.info(f"The PDF holds the first {len(selected)} of {len(matched)} forms")
+                st.download_button(f"Download PDF ({len(selected)} certificates)", data, file_name="certificates.pdf",
+                                   mime="application/pdf")
+            else:
+                st.warning("No forms match the selection")
+        except Exception as e:
+            log_error(f"Batch certificate error: {str(e)}")
+            st.error("Failed to render certificates")
+
 # Main form page
 def main_page():
     st.title("Gold Testing Form")
@@ -591,16 +937,13 @@ def main_page():
         st.session_state.search_active = False
 
         if search_query:
-            current_forms_list = [
-                f for f in st.session_state.forms
-                if search_query.lower() in f['customerName'].lower() or str(search_query) in str(f['formNumber'])
-            ]
+            current_forms_list = search.search_forms(cursor, st.session_state.user_id, search_query)
             st.session_state.search_active = True
             
             if not current_forms_list:
                 st.warning("No forms found matching your search. Showing a new form.")
                 st.session_state.form_data = new_form()
-                st.session_state.form_select = "New Form"
+                st.session_state.form_select = None
                 st.session_state.is_editing = True
                 st.session_state.search_active = False
                 st.rerun()
@@ -608,75 +951,59 @@ def main_page():
 
         if st.session_state.form_data is None:
             if st.session_state.forms:
-                st.session_state.form_data = load_form_from_list(0, st.session_state.forms)
-                st.session_state.form_select = f"Form {st.session_state.form_data['formNumber']} - {st.session_state.form_data['customerName'] or 'No Customer'}"
+                st.session_state.form_data = load_form_record(st.session_state.forms[0])
+                st.session_state.form_select = st.session_state.current_form_id
             else:
                 st.session_state.form_data = new_form()
-                st.session_state.form_select = "New Form"
+                st.session_state.form_select = None
                 st.session_state.is_editing = True
 
-        form_options_display = [f"Form {f['formNumber']} - {f['customerName'] or 'No Customer'}" for f in current_forms_list]
-        form_options_display.insert(0, "New Form")
-
-        initial_form_select_index = 0
-        if st.session_state.form_select == "New Form":
-            initial_form_select_index = 0
-        elif st.session_state.current_form_id:
-            current_form_display_string = f"Form {st.session_state.form_data['formNumber']} - {st.session_state.form_data['customerName'] or 'No Customer'}"
-            try:
-                initial_form_select_index = form_options_display.index(current_form_display_string)
-            except ValueError:
-                initial_form_select_index = 0
-                st.session_state.form_data = new_form()
-                st.session_state.form_select = "New Form"
-                st.session_state.is_editing = True
+        # Only the recent forms or search hits are offered, plus the form on screen
+        # when Previous/Next reached it outside of them
+        forms_by_id = {f.id: f for f in current_forms_list}
+        current_record = st.session_state.current_form_record
+        if current_record is not None and current_record.id not in forms_by_id:
+            forms_by_id = {current_record.id: current_record, **forms_by_id}
+        form_options = [None] + list(forms_by_id)
+        selected_id = st.session_state.current_form_id if st.session_state.current_form_id in forms_by_id else None
 
-        form_select = st.selectbox("Select Form", form_options_display, index=initial_form_select_index, key="form_select_box")
+        form_select = st.selectbox("Select Form", form_options, index=form_options.index(selected_id),
+                                   format_func=lambda form_id: forms_by_id[form_id].label if form_id is not None else "New Form",
+                                   key="form_select_box")
 
         if form_select != st.session_state.form_select:
             st.session_state.form_select = form_select
-            if form_select == "New Form":
+            if form_select is None:
                 st.session_state.form_data = new_form()
                 st.session_state.is_editing = True
                 st.session_state.search_active = False
             else:
-                selected_form_number_str = form_select.split(' ')[1]
-                selected_form_obj = next((f for f in current_forms_list if str(f['formNumber']) == selected_form_number_str), None)
-                if selected_form_obj:
-                    idx_in_current_list = current_forms_list.index(selected_form_obj)
-                    st.session_state.form_data = load_form_from_list(idx_in_current_list, current_forms_list)
-                    st.session_state.is_editing = False
-                else:
-                    st.error("Selected form not found. Loading a new form.")
-                    st.session_state.form_data = new_form()
-                    st.session_state.form_select = "New Form"
-                    st.session_state.is_editing = True
+                st.session_state.form_data = load_form_record(forms_by_id[form_select])
             st.rerun()
 
     with col2:
         st.markdown("<div style='height: 30px;'></div>", unsafe_allow_html=True)
         if st.button("New Form", key="new_form_button_side"):
             st.session_state.form_data = new_form()
-            st.session_state.form_select = "New Form"
+            st.session_state.form_select = None
             st.session_state.search_active = False
             st.rerun()
-        
+
+        search_results = current_forms_list if st.session_state.search_active else None
         if st.button("Previous", key="prev_form_button"):
-            if current_forms_list and (st.session_state.current_form_index == -1 or st.session_state.current_form_index + 1 < len(current_forms_list)):
-                new_index = st.session_state.current_form_index + 1 if st.session_state.current_form_index != -1 else 0
-                st.session_state.form_data = load_form_from_list(new_index, current_forms_list)
-                if st.session_state.form_data:
-                    st.session_state.form_select = f"Form {st.session_state.form_data['formNumber']} - {st.session_state.form_data['customerName'] or 'No Customer'}"
+            record = adjacent_form(True, search_results)
+            if record:
+                st.session_state.form_data = load_form_record(record)
+                st.session_state.form_select = record.id
                 st.rerun()
             else:
                 st.warning("No older forms available.")
 
         if st.button("Next", key="next_form_button"):
-            if current_forms_list and st.session_state.current_form_index > 0:
-                new_index = st.session_state.current_form_index - 1
-                st.session_state.form_data = load_form_from_list(new_index, current_forms_list)
-                if st.session_state.form_data:
-                    st.session_state.form_select = f"Form {st.session_state.form_data['formNumber']} - {st.session_state.form_data['customerName'] or 'No Customer'}"
+            record = adjacent_form(False, search_results)
+            if record:
+                st.session_state.form_data = load_form_record(record)
+                st.session_state.form_select = record.id
                 st.rerun()
             else:
                 st.warning("No newer forms available.")
@@ -724,15 +1051,10 @@ def main_page():
             'userId': st.session_state.user_id
         }
         
-        if not template_data['itemName']:
-            st.error("Template requires an Item Name.")
-        elif template_data['grossWeight'] is None or template_data['gold'] is None:
-            st.error("Template requires Gross Weight and Gold (%) to be specified.")
-        elif template_data['grossWeight'] < 0:
-            st.error("Gross Weight must be non-negative for template.")
-        elif not (0 <= template_data['gold'] <= 100):
-            st.error("Gold percentage must be between 0 and 100 for template.")
-        else:
+        errors = validation.validate_template_data(template_data)
+        for error in errors:
+            st.error(error)
+        if not errors:
             save_template(template_data)
 
     st.markdown('<div class="form-container"><div class="form-grid">', unsafe_allow_html=True)
@@ -741,7 +1063,8 @@ def main_page():
     col1, col2 = st.columns(2)
     with col1:
         st.markdown('<label>Form Number</label>', unsafe_allow_html=True)
-        form_data['formNumber'] = st.text_input("Form Number", value=str(form_data['formNumber']) if form_data['formNumber'] is not None else '', disabled=True, key="form_number")
+        form_data['formNumber'] = st.text_input("Form Number", value=str(form_data['formNumber']) if form_data['formNumber'] is not None else '', disabled=True, key="form_number",
+                                                help=None if st.session_state.current_form_id else "Next number; assigned when the form is saved")
     with col2:
         st.markdown('<label>Date</label>', unsafe_allow_html=True)
         form_data['date'] = st.text_input("Date", value=form_data['date'], disabled=True, key="date")
@@ -787,16 +1110,26 @@ def main_page():
     
     st.markdown('<div style="grid-column: span 2;"><label>Photo</label></div>', unsafe_allow_html=True)
     uploaded_file = st.file_uploader("Upload Photo", type=["png", "jpg", "jpeg"], disabled=not st.session_state.is_editing, key="photo_uploader")
-    if uploaded_file is not None:
-        image = Image.open(uploaded_file)
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        form_data['photo'] = f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
-    
-    if form_data['photo']:
-        st.image(form_data['photo'], caption="Photo Preview", width=300)
+    # The uploader keeps its file across reruns; only a newly uploaded file is processed.
+    # Processing runs on the upload workers; this run only starts it and later runs
+    # pick up the result.
+    if uploaded_file is not None and uploaded_file.file_id != st.session_state.pending_upload_id:
+        try:
+            future = photos.upload_processor.submit(uploaded_file.getvalue())
+            st.session_state.photo_upload = (st.session_state.current_form_id, future)
+            st.session_state.pending_upload_id = uploaded_file.file_id
+        except photos.UploadQueueFull as e:
+            # Not marked as handled, so the next rerun tries again
+            st.warning(str(e))
+    if collect_photo_upload():
+        photo_upload_status()
+
+    if form_data['photoHash']:
+        preview = load_photo_variant(form_data['photoHash'], 'preview')
+        if preview:
+            st.image(preview[0], caption="Photo Preview", width=300)
         if st.button("Clear Photo", key="clear_photo_button"):
-            form_data['photo'] = ''
+            form_data['photoHash'] = None
             st.rerun()
 
     st.markdown('</div></div>', unsafe_allow_html=True)
@@ -806,28 +1139,62 @@ def main_page():
         print_form(form_data)
     st.markdown('</div>', unsafe_allow_html=True)
 
+    # Server-rendered certificate of the saved form, for printers that take PDF or PNG
+    record = st.session_state.current_form_record
+    if record is not None and not st.session_state.is_editing:
+        col1, col2 = st.columns(2)
+        certificate_format = col1.selectbox("Certificate Format", list(certificates.FORMATS), format_func=str.upper, key="certificate_format")
+        certificate_key = (record.id, record.updatedAt, certificate_format)
+        if col2.button("Render Certificate", key="render_certificate_button"):
+            try:
+                with metrics.timed(metrics.STAGE, 'render_certificate'):
+                    data = render_cache.certificate(record.to_form_data(), load_original_photo, certificate_format)
+                st.session_state.certificate = (certificate_key, data)
+            except Exception as e:
+                log_error(f"Certificate render error: {str(e)}")
+                st.error("Failed to render certificate")
+        if st.session_state.certificate and st.session_state.certificate[0] == certificate_key:
+            st.download_button(f"Download Certificate ({certificate_format.upper()})", st.session_state.certificate[1],
+                               file_name=f"certificate-{record.formNumber}.{certificate_format}",
+                               mime=certificates.FORMATS[certificate_format][1])
+
 # Main app routing
-if st.session_state.user_id:
-    st.sidebar.button("Logout", on_click=logout)
+# A replica older than the configured staleness is pulled before this run reads from it
+if syncer is not None:
+    try:
+        syncer.ensure_fresh()
+    except Exception as e:
+        log_error(f"Replica sync error: {str(e)}")
+db = pool.acquire()
+cursor = db.cursor()
+try:
+    if st.session_state.user_id:
+        st.sidebar.button("Logout", on_click=logout)
     
-    nav_options = ["Main", "Report"]
-    if st.session_state.is_admin:
-        nav_options.insert(1, "Admin")
+        nav_options = ["Main", "Report"]
+        if st.session_state.is_admin:
+            nav_options.insert(1, "Admin")
 
-    if st.session_state.page.capitalize() not in nav_options:
-        st.session_state.page = "main"
+        if st.session_state.page.capitalize() not in nav_options:
+            st.session_state.page = "main"
 
-    selected_nav = st.sidebar.radio("Navigate", nav_options, index=nav_options.index(st.session_state.page.capitalize()))
+        selected_nav = st.sidebar.radio("Navigate", nav_options, index=nav_options.index(st.session_state.page.capitalize()))
     
-    if selected_nav.lower() != st.session_state.page:
-        st.session_state.page = selected_nav.lower()
-        st.rerun()
+        if selected_nav.lower() != st.session_state.page:
+            st.session_state.page = selected_nav.lower()
+            st.rerun()
 
-if st.session_state.page == "login":
-    login_page()
-elif st.session_state.page == "admin":
-    admin_page()
-elif st.session_state.page == "report":
-    report_page()
-else:
-    main_page()
+    # Timed even when st.rerun() or st.stop() cuts the page short
+    page = st.session_state.page if st.session_state.page in ("login", "admin", "report") else "main"
+    with metrics.timed(metrics.PAGE, f"{page}_page"):
+        if page == "login":
+            login_page()
+        elif page == "admin":
+            admin_page()
+        elif page == "report":
+            report_page()
+        else:
+            main_page()
+finally:
+    # Hand the connection back to the pool, even when st.rerun() ends the run early
+    pool.release(db)
@@ -0,0 +1,153 @@
+import gzip
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+import queries
+
+ACTIONS = ('login', 'create_form', 'update_form', 'delete_form', 'create_user', 'import_forms')
+
+AUDIT_COLUMNS = ('id', 'action', 'userId', 'username', 'timestamp')
+
+# Where rows past the retention window go
+ARCHIVE_FILE = 'file'
+ARCHIVE_TABLE = 'table'
+
+
+def create_archive_table(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS audit_log_archive (
+        id INTEGER PRIMARY KEY,
+        action TEXT,
+        userId INTEGER,
+        username TEXT,
+        timestamp TEXT,
+        archivedAt TEXT
+    )''')
+
+
+# WHERE clause for the audit viewer. Dates are inclusive; `user` matches the acting user's name.
+def audit_filter(start_date=None, end_date=None, action=None, user=''):
+    clauses, params = [], []
+    if start_date:
+        clauses.append('timestamp >= ?')
+        params.append(start_date.isoformat())
+    if end_date:
+        clauses.append('timestamp < ?')
+        params.append((end_date + timedelta(days=1)).isoformat())
+    if action:
+        clauses.append('action = ?')
+        params.append(action)
+    if user:
+        clauses.append("userId IN (SELECT id FROM users WHERE username LIKE ? ESCAPE '\\')")
+        params.append(queries.like_pattern(user))
+    return ('WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+def count_audit(cursor, start_date=None, end_date=None, action=None, user=''):
+    where, params = audit_filter(start_date, end_date, action, user)
+    cursor.execute(f'SELECT COUNT(*) FROM audit_log {where}', params)
+    return cursor.fetchone()[0]
+
+
+# Keyset page of audit entries, newest first. `after` is the (timestamp, id) of the
+# last row of the previous page; returns the rows and the key for the next page.
+def page_audit(cursor, start_date=None, end_date=None, action=None, user='', after=None, limit=20):
+    where, params = audit_filter(start_date, end_date, action, user)
+    if after is not None:
+        where = f'{where} AND (timestamp, id) < (?, ?)' if where else 'WHERE (timestamp, id) < (?, ?)'
+        params += list(after)
+    cursor.execute(f'SELECT {", ".join(AUDIT_COLUMNS)} FROM audit_log {where} ORDER BY timestamp DESC, id DESC LIMIT ?',
+                   params + [limit])
+    rows = cursor.fetchall()
+    next_key = (rows[-1][4], rows[-1][0]) if len(rows) == limit else None
+    return [dict(zip(AUDIT_COLUMNS, row)) for row in rows], next_key
+
+
+# Seek key of the row just before `offset`, for jumping straight to a page
+def audit_page_key(cursor, start_date=None, end_date=None, action=None, user='', offset=0):
+    if offset <= 0:
+        return None
+    where, params = audit_filter(start_date, end_date, action, user)
+    cursor.execute(f'SELECT timestamp, id FROM audit_log {where} ORDER BY timestamp DESC, id DESC LIMIT 1 OFFSET ?',
+                   params + [offset - 1])
+    row = cursor.fetchone()
+    return tuple(row) if row else None
+
+
+def _archive_to_file(rows, archive_dir, archived_at):
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"audit_log-{archived_at[:10]}.jsonl.gz")
+    # Appending gzip members keeps one readable file per day even across several runs
+    with gzip.open(path, 'at', encoding='utf-8') as archive:
+        for row in rows:
+            archive.write(json.dumps(dict(zip(AUDIT_COLUMNS, row))) + '\n')
+    return path
+
+
+# Move audit rows older than `days` out of the live table, in batches. Each batch is
+# archived before it is deleted, so an interrupted run loses nothing.
+def apply_retention(conn, days, archive=ARCHIVE_FILE, archive_dir='audit_archive', batch_size=1000):
+    if days is None or days <= 0:
+        return 0
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+    archived_at = datetime.now().isoformat()
+    cursor = conn.cursor()
+    if archive == ARCHIVE_TABLE:
+        create_archive_table(cursor)
+        conn.commit()
+    moved = 0
+    while True:
+        cursor.execute(f'SELECT {", ".join(AUDIT_COLUMNS)} FROM audit_log WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?',
+                       (cutoff, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        if archive == ARCHIVE_TABLE:
+            cursor.executemany('''INSERT OR IGNORE INTO audit_log_archive (id, action, userId, username, timestamp, archivedAt)
+                                  VALUES (?, ?, ?, ?, ?, ?)''', [tuple(row) + (archived_at,) for row in rows])
+        else:
+            _archive_to_file(rows, archive_dir, archived_at)
+        cursor.executemany('DELETE FROM audit_log WHERE id = ?', [(row[0],) for row in rows])
+        conn.commit()
+        moved += len(rows)
+    if moved:
+        conn.sync()
+    return moved
+
+
+# Background thread that applies the retention policy on an interval
+class RetentionScheduler:
+    def __init__(self, pool, days, archive=ARCHIVE_FILE, archive_dir='audit_archive', interval=24 * 3600, on_error=None):
+        self.pool = pool
+        self.days = days
+        self.archive = archive
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self.on_error = on_error
+        self.last_run = None
+        self.last_moved = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='audit-retention', daemon=True)
+        if days and days > 0:
+            self._thread.start()
+
+    def run_now(self):
+        with self._lock:
+            with self.pool.connection() as conn:
+                self.last_moved = apply_retention(conn, self.days, self.archive, self.archive_dir)
+            self.last_run = datetime.now()
+            return self.last_moved
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_now()
+            except Exception as e:
+                if self.on_error:
+                    self.on_error(f"Audit retention error: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,222 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import bcrypt
+
+# bcrypt cost for new hashes; stored hashes with a different cost are rehashed at login
+BCRYPT_ROUNDS = 12
+
+User = namedtuple('User', ['id', 'username', 'password', 'is_admin'])
+
+
+class AuthBusy(RuntimeError):
+    pass
+
+
+class Throttled(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Too many failed attempts; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def _as_bytes(value):
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+
+def hash_password(password, rounds=BCRYPT_ROUNDS):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds))
+
+
+# Cost factor of a stored hash: '$2b$12$...' has 12 rounds
+def hash_rounds(hashed):
+    try:
+        return int(_as_bytes(hashed).split(b'$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+# Failed attempts per key. `max_failures` failures within `window` seconds lock the
+# key for `lockout` seconds; a success clears it. The oldest keys are forgotten past
+# `max_keys`, so a flood of made-up usernames cannot grow it without bound.
+class Throttle:
+    def __init__(self, max_failures=5, window=300.0, lockout=300.0, max_keys=10000):
+        self.max_failures = max_failures
+        self.window = window
+        self.lockout = lockout
+        self.max_keys = max_keys
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Seconds until `key` may try again; 0 when it is not locked
+    def retry_after(self, key):
+        with self._lock:
+            state = self._keys.get(key)
+            if not state or not state['locked_until']:
+                return 0.0
+            return max(0.0, state['locked_until'] - time.monotonic())
+
+    def failure(self, key):
+        now = time.monotonic()
+        with self._lock:
+            state = self._keys.pop(key, None)
+            if state is None or now - state['first'] > self.window:
+                state = {'first': now, 'failures': 0, 'locked_until': 0.0}
+            state['failures'] += 1
+            if state['failures'] >= self.max_failures:
+                state['locked_until'] = now + self.lockout
+            self._keys[key] = state
+            while len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+
+    def success(self, key):
+        with self._lock:
+            self._keys.pop(key, None)
+
+
+# Login rows by username, kept `ttl` seconds so repeated attempts skip the query.
+# Unknown usernames are cached too, as None.
+class UserCache:
+    def __init__(self, ttl=60.0, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, cursor, username):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._users.get(username)
+            if cached and now - cached[1] < self.ttl:
+                self._users.move_to_end(username)
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+        cursor.execute('SELECT id, username, password, is_admin FROM users WHERE username = ?', (username,))
+        row = cursor.fetchone()
+        user = User(row[0], row[1], _as_bytes(row[2]), bool(row[3])) if row else None
+        with self._lock:
+            self._users[username] = (user, now)
+            self._users.move_to_end(username)
+            while len(self._users) > self.max_entries:
+                self._users.popitem(last=False)
+        return user
+
+    def invalidate(self, username):
+        with self._lock:
+            self._users.pop(username, None)
+
+
+# Password hashing and checking on a bounded pool of worker threads, so a burst of
+# logins cannot take every CPU of the process. At most `max_pending` jobs wait or
+# run at once; past that callers get AuthBusy instead of queueing. Attempts are
+# throttled per username and per session. `store_hash(user_id, hashed)` persists a
+# hash upgraded to the current cost after a successful login; it may return a
+# Future, and the upgrade only counts once that resolves.
+class AuthService:
+    def __init__(self, workers=2, max_pending=16, rounds=BCRYPT_ROUNDS, max_failures=5, window=300.0, lockout=300.0,
+                 user_ttl=60.0, store_hash=None):
+        self.rounds = rounds
+        self.store_hash = store_hash
+        self.users = UserCache(user_ttl)
+        self.user_throttle = Throttle(max_failures, window, lockout)
+        self.session_throttle = Throttle(max_failures * 2, window, lockout)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='auth')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        # Usernames whose upgraded hash is still being written
+        self._rehashing = set()
+        self._stats = {'logins': 0, 'failures': 0, 'throttled': 0, 'busy': 0, 'rehashed': 0, 'hash_time': 0.0, 'hashes': 0}
+        # Unknown usernames are checked against this, so they cost as much as real ones
+        self._dummy_hash = hash_password('not-a-password', rounds)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _timed(self, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._stats['hash_time'] += time.perf_counter() - start
+                self._stats['hashes'] += 1
+
+    def _run(self, fn, *args, timeout=30.0):
+        if not self._slots.acquire(blocking=False):
+            self._count('busy')
+            raise AuthBusy("Too many logins in progress")
+        try:
+            future = self._executor.submit(self._timed, fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result(timeout)
+
+    def hash_password(self, password, timeout=30.0):
+        return self._run(hash_password, password, self.rounds, timeout=timeout)
+
+    def check_password(self, password, hashed, timeout=30.0):
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), _as_bytes(hashed), timeout=timeout)
+
+    # The user for valid credentials, or None. Raises Throttled while the username or
+    # session is locked out and AuthBusy when the worker pool is saturated.
+    def authenticate(self, cursor, username, password, session_id=None):
+        keys = [(self.user_throttle, username)] + ([(self.session_throttle, session_id)] if session_id else [])
+        retry_after = max(throttle.retry_after(key) for throttle, key in keys)
+        if retry_after:
+            self._count('throttled')
+            raise Throttled(retry_after)
+        user = self.users.get(cursor, username)
+        valid = self.check_password(password, user.password if user else self._dummy_hash) and user is not None
+        if not valid:
+            self._count('failures')
+            for throttle, key in keys:
+                throttle.failure(key)
+            return None
+        for throttle, key in keys:
+            throttle.success(key)
+        self._count('logins')
+        if hash_rounds(user.password) != self.rounds and self.store_hash:
+            self._rehash(user, password)
+        return user
+
+    def _rehash(self, user, password):
+        with self._lock:
+            if user.username in self._rehashing:
+                return
+            self._rehashing.add(user.username)
+        try:
+            stored = self.store_hash(user.id, self.hash_password(password))
+        except AuthBusy:
+            self._stored(user.username, False)  # The next login tries again
+            return
+        except BaseException:
+            self._stored(user.username, False)
+            raise
+        if isinstance(stored, Future):
+            stored.add_done_callback(lambda future: self._stored(user.username, future.exception() is None))
+        else:
+            self._stored(user.username, True)
+
+    # The cached user is only dropped once the upgraded hash is written, so logins
+    # in between neither re-read the old hash nor upgrade it again
+    def _stored(self, username, written):
+        with self._lock:
+            self._rehashing.discard(username)
+        if written:
+            self.users.invalidate(username)
+            self._count('rehashed')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['avg_hash_ms'] = stats['hash_time'] / stats['hashes'] * 1000 if stats['hashes'] else 0.0
+        stats['user_cache_hits'] = self.users.hits
+        stats['user_cache_misses'] = self.users.misses
+        return stats
@@ -0,0 +1,96 @@
+# Sustained ingestion rate of the JSON API, without a browser in the loop:
+# python -m benchmarks.api_load [--clients N] [--requests N] [--batch N]
+import argparse
+import http.client
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+
+import api
+import apikeys
+import database
+from benchmarks import generate
+from benchmarks.data_access import percentile
+from cache import VersionStore
+from writer import GroupCommitWriter
+
+
+def sample_form(rng):
+    gross = round(rng.uniform(0.5, 60), 3)
+    return {'customerName': f'{rng.choice(generate.FIRST_NAMES)} {rng.choice(generate.LAST_NAMES)}',
+            'itemName': rng.choice(generate.ITEMS), 'mobileNumber': f'9{rng.randrange(10**9):09d}',
+            'grossWeight': gross, 'gold': round(rng.uniform(58, 99.9), 2)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the ingestion API against a local database")
+    parser.add_argument('--clients', type=int, default=8, help="concurrent keep-alive connections")
+    parser.add_argument('--requests', type=int, default=200, help="requests per client")
+    parser.add_argument('--batch', type=int, default=1, help="forms per request; 1 uses the single-form endpoint")
+    parser.add_argument('--max-delay-ms', type=int, default=50, help="group-commit delay of the writer")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'api.db')
+        user_ids = generate.build(path, forms=0, users=1, templates_per_user=0, photo_count=0, log=None)
+        connect = database.connector({'mode': database.LOCAL, 'local_path': path})
+        pool = database.ConnectionPool(connect, size=args.clients)
+        writer = GroupCommitWriter(connect, max_delay_ms=args.max_delay_ms)
+        token = writer.submit(lambda cur: apikeys.create_token(cur, user_ids[0], 'load test')).result()
+        service = api.IngestService(pool, writer, VersionStore(os.path.join(directory, 'versions.db')))
+        server = api.make_server(service, '127.0.0.1', 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_address[1]
+
+        timings, statuses, lock = [], {}, threading.Lock()
+
+        def client(number):
+            rng = random.Random(args.seed + number)
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+            for _ in range(args.requests):
+                if args.batch == 1:
+                    route, body = '/forms', sample_form(rng)
+                else:
+                    route, body = '/forms/batch', {'forms': [sample_form(rng) for _ in range(args.batch)]}
+                headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json',
+                           'Idempotency-Key': str(uuid.UUID(int=rng.getrandbits(128)))}
+                start = time.perf_counter()
+                conn.request('POST', route, json.dumps(body), headers)
+                response = conn.getresponse()
+                response.read()
+                with lock:
+                    timings.append(time.perf_counter() - start)
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+            conn.close()
+
+        threads = [threading.Thread(target=client, args=(number,)) for number in range(args.clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+        server.server_close()
+        writer.close()
+
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM forms')
+            saved = cursor.fetchone()[0]
+
+    timings.sort()
+    stats = writer.stats()
+    print(f"{len(timings)} requests of {args.batch} form(s) from {args.clients} clients in {elapsed:.2f}s")
+    print(f"{saved} forms saved: {saved / elapsed:.0f} forms/s, {len(timings) / elapsed:.0f} requests/s · statuses {statuses}")
+    print(f"latency p50 {percentile(timings, 50) * 1000:.1f} ms · p95 {percentile(timings, 95) * 1000:.1f} ms · "
+          f"p99 {percentile(timings, 99) * 1000:.1f} ms · avg {stats['avg_group_size']:.1f} statements per commit")
+
+
+if __name__ == '__main__':
+    main()
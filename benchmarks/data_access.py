@@ -0,0 +1,278 @@
+# Latency of the app's data-access paths against a local SQLite file standing in for Turso:
+# python -m benchmarks.data_access PATH [--generate 100k] [-n N] [--output report.json] [--baseline old.json]
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import analytics
+import counters
+import database
+import queries
+import search
+import validation
+from benchmarks import generate
+from writer import GroupCommitWriter
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+# Nearest-rank percentile of sorted samples
+def percentile(samples, p):
+    return samples[max(0, min(len(samples) - 1, round(p / 100 * len(samples)) - 1))]
+
+
+def _size(value):
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 8 if value is not None else 0
+
+
+# Remove the forms save_form added and put the user's form counter back, so the
+# file can be benchmarked again unchanged
+def _cleanup(cursor, ctx):
+    cursor.executemany('DELETE FROM forms WHERE id = ?', [(form_id,) for form_id, _ in ctx['saved']])
+    cursor.executemany('DELETE FROM audit_log WHERE id = ?', [(audit_id,) for _, audit_id in ctx['saved']])
+    if ctx['counter'] is None:
+        cursor.execute('DELETE FROM form_counters WHERE userId = ?', (ctx['user_id'],))
+    else:
+        cursor.execute('UPDATE form_counters SET lastNumber = ? WHERE userId = ?', (ctx['counter'], ctx['user_id']))
+    return []
+
+
+# Cursor that tallies the rows and bytes every fetch hands back to Python
+class CountingCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.rows = 0
+        self.bytes = 0
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _count(self, rows):
+        self.rows += len(rows)
+        self.bytes += sum(_size(value) for row in rows for value in row)
+        return rows
+
+    def fetchall(self):
+        return self._count(self._cursor.fetchall())
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._count([row])
+        return row
+
+
+# The busiest user and a spread of their data, so every path has something to find
+def _context(cursor):
+    cursor.execute('SELECT userId, COUNT(*) FROM forms GROUP BY userId ORDER BY 2 DESC LIMIT 1')
+    user_id, form_count = cursor.fetchone()
+    cursor.execute('SELECT MAX(formNumber), MAX(createdAt) FROM forms WHERE userId = ?', (user_id,))
+    last_number, last_created = cursor.fetchone()
+    cursor.execute('SELECT customerName FROM forms WHERE userId = ? ORDER BY formNumber LIMIT 1', (user_id,))
+    customer = cursor.fetchone()[0]
+    cursor.execute('SELECT lastNumber FROM form_counters WHERE userId = ?', (user_id,))
+    counter = cursor.fetchone()
+    last_day = datetime.fromisoformat(last_created).date()
+    return {
+        'user_id': user_id,
+        'forms': form_count,
+        'middle_number': last_number // 2,
+        'customer': customer.split()[-1][:3],
+        'report_start': last_day - timedelta(days=30),
+        'report_end': last_day,
+        'summary_start': last_day - timedelta(days=90),
+        'saved': [],
+        'counter': counter[0] if counter else None,
+    }
+
+
+def _save_form(cursor, user_id, saved):
+    gross, gold = 12.5, 91.6
+    now = datetime.now()
+    date, clock = now.strftime('%d-%m-%Y'), now.strftime('%H:%M:%S')
+    form_number = counters.allocate(cursor, user_id)
+    cursor.execute('''INSERT INTO forms (formNumber, date, time, customerName, itemName, mobileNumber, grossWeight, netWeight,
+                      gold, karat, photoHash, updatedAt, goldPurity, createdAt, userId)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                   (form_number, date, clock, 'Bench Customer', 'Ring', '9000000000', gross, gross, gold,
+                    validation.karat_for(gold), None, now.isoformat(), validation.gold_purity_for(gold, gross),
+                    queries.created_at(date, clock), user_id))
+    form_id = cursor.lastrowid
+    cursor.execute('INSERT INTO audit_log (action, userId, username, timestamp) VALUES (?, ?, ?, ?)',
+                   ('create_form', user_id, f'Form {form_number}', now.isoformat()))
+    saved.append((form_id, cursor.lastrowid))
+    return [form_id]
+
+
+def _update_form(cursor, user_id, form_number):
+    cursor.execute('UPDATE forms SET grossWeight = grossWeight, goldPurity = goldPurity, updatedAt = ? WHERE userId = ? AND formNumber = ?',
+                   (datetime.now().isoformat(), user_id, form_number))
+    return []
+
+
+def _workflow_deep_page(cursor):
+    after = queries.workflow_page_key(cursor, 'date', offset=1000)
+    return queries.page_workflow_forms(cursor, 'date', after=after)[0]
+
+
+def _report(cursor, ctx):
+    queries.count_report_rows(cursor, ctx['user_id'], start_date=ctx['report_start'], end_date=ctx['report_end'])
+    return queries.page_report_rows(cursor, ctx['user_id'], 'date', start_date=ctx['report_start'], end_date=ctx['report_end'])
+
+
+# Each path as (name, reads?, call). Reads take the pooled cursor; writes go through
+# the group-commit writer the way the app's save_form does, and run last so the
+# reads see the generated data only.
+def operations(ctx):
+    uid = ctx['user_id']
+    return [
+        ('load_forms', True, lambda c: queries.list_forms(c, uid, limit=queries.RECENT_FORMS)),
+        ('load_all_forms', True, lambda c: queries.list_forms(c, uid)),
+        ('load_templates', True, lambda c: queries.list_templates(c, uid)),
+        ('navigate', True, lambda c: [queries.next_form(c, uid, ctx['middle_number']),
+                                      queries.prev_form(c, uid, ctx['middle_number'])]),
+        ('new_form', True, lambda c: [counters.peek_next(c, uid)]),
+        ('admin_workflow_count', True, lambda c: [queries.count_workflow_forms(c)]),
+        ('admin_workflow_page', True, lambda c: queries.page_workflow_forms(c, 'formNumber')[0]),
+        ('admin_workflow_deep_page', True, _workflow_deep_page),
+        ('report_page', True, lambda c: _report(c, ctx)),
+        ('search', True, lambda c: search.search_forms(c, uid, ctx['customer'])),
+        ('daily_summary', True, lambda c: analytics.load_summary(c, ctx['summary_start'], ctx['report_end'])),
+        ('save_form', False, lambda c: _save_form(c, uid, ctx['saved'])),
+        ('update_form', False, lambda c: _update_form(c, uid, ctx['middle_number'])),
+    ]
+
+
+def _measure(call, iterations):
+    timings, rows, transferred, returned = [], 0, 0, 0
+    for _ in range(iterations):
+        cursor = CountingCursor(None)
+        start = time.perf_counter()
+        result = call(cursor)
+        timings.append(time.perf_counter() - start)
+        rows += cursor.rows
+        transferred += cursor.bytes
+        returned += len(result)
+    return timings, rows, transferred, returned
+
+
+def run(path, iterations=50, warmup=2, only=None, max_delay_ms=50, log=print):
+    connect = database.connector({'mode': database.LOCAL, 'local_path': path})
+    pool = database.ConnectionPool(connect, size=1)
+    database.ensure_schema(pool)
+    writer = GroupCommitWriter(connect, max_delay_ms=max_delay_ms)
+    report = {'database': os.path.abspath(path), 'iterations': iterations, 'operations': {}}
+    try:
+        with pool.connection() as conn:
+            ctx = _context(conn.cursor())
+            report['forms'] = ctx['forms']
+            for name, reads, call in operations(ctx):
+                if only and name not in only:
+                    continue
+
+                def timed(counting, call=call, reads=reads):
+                    if reads:
+                        counting._cursor = conn.cursor()
+                        return call(counting)
+
+                    def write(cur):
+                        counting._cursor = cur
+                        return call(counting)
+                    return writer.submit(write).result()
+
+                _measure(timed, warmup)
+                timings, rows, transferred, returned = _measure(timed, iterations)
+                # Allocations are traced on a separate pass; tracing slows every call down
+                tracemalloc.start()
+                _measure(timed, 1)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                timings.sort()
+                result = {f'p{p}_ms': round(percentile(timings, p) * 1000, 3) for p in PERCENTILES}
+                result.update({
+                    'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+                    'max_ms': round(timings[-1] * 1000, 3),
+                    'rows_fetched': rows / iterations,
+                    'bytes_fetched': transferred / iterations,
+                    'results': returned / iterations,
+                    'peak_alloc_kib': round(peak / 1024, 1),
+                })
+                report['operations'][name] = result
+                if log:
+                    log(f"{name:<26} p50 {result['p50_ms']:>9.3f} ms  p95 {result['p95_ms']:>9.3f} ms  "
+                        f"p99 {result['p99_ms']:>9.3f} ms  rows {result['rows_fetched']:>9.0f}  "
+                        f"bytes {result['bytes_fetched']:>11.0f}  peak {result['peak_alloc_kib']:>9.1f} KiB")
+        if ctx['saved']:
+            writer.submit(lambda cur: _cleanup(cur, ctx)).result()
+    finally:
+        writer.close()
+    if resource is not None:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        report['peak_rss_mb'] = round(peak_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    return report
+
+
+# Operations whose p95 grew by more than `threshold` times since the baseline report.
+# Growth under `min_delta_ms` is left out: sub-millisecond paths swing by more than
+# the threshold between two runs of the same code.
+def regressions(report, baseline, threshold=1.25, min_delta_ms=0.5):
+    slower = {}
+    for name, result in report['operations'].items():
+        before = baseline.get('operations', {}).get(name)
+        if not before or before['p95_ms'] <= 0 or result['p95_ms'] - before['p95_ms'] < min_delta_ms:
+            continue
+        if result['p95_ms'] / before['p95_ms'] > threshold:
+            slower[name] = round(result['p95_ms'] / before['p95_ms'], 2)
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the app's data-access paths on a local database file")
+    parser.add_argument('path', help="database file; see benchmarks.generate")
+    parser.add_argument('--generate', type=generate.parse_count, metavar='FORMS',
+                        help="generate this many forms first when the file does not exist (10k, 100k, 1m or a number)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-n', '--iterations', type=int, default=50)
+    parser.add_argument('--only', nargs='+', metavar='OPERATION', help="run just these operations")
+    parser.add_argument('--max-delay-ms', type=int, default=50, help="group-commit delay of the writer, as in [writer]")
+    parser.add_argument('--output', help="write the JSON report here")
+    parser.add_argument('--baseline', help="earlier JSON report to compare p95 latencies against")
+    parser.add_argument('--threshold', type=float, default=1.25, help="p95 ratio that counts as a regression")
+    parser.add_argument('--min-delta-ms', type=float, default=0.5,
+                        help="smallest p95 growth in milliseconds that counts as a regression")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.path):
+        if not args.generate:
+            parser.error(f"{args.path} does not exist; pass --generate to create it")
+        generate.build(args.path, forms=args.generate, seed=args.seed, log=None)
+
+    report = run(args.path, args.iterations, only=args.only, max_delay_ms=args.max_delay_ms)
+    report.update({'generatedAt': datetime.now().isoformat(), 'python': platform.python_version(),
+                   'database_bytes': os.path.getsize(args.path)})
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(report, json.load(f), args.threshold, args.min_delta_ms)
+        for name, ratio in slower.items():
+            print(f"REGRESSION {name}: p95 {ratio}x the baseline")
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
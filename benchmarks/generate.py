@@ -0,0 +1,142 @@
+# Seeded synthetic data for the benchmarks:
+# python -m benchmarks.generate PATH [--forms 10k|100k|1m|N] [--users N] [--seed N]
+import argparse
+import io
+import random
+import time
+from datetime import datetime, timedelta
+
+import bcrypt
+from PIL import Image
+
+import counters
+import database
+import photos
+import queries
+import validation
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+FIRST_NAMES = ('Aarav', 'Vivaan', 'Aditya', 'Ananya', 'Diya', 'Ishaan', 'Kavya', 'Meera', 'Nikhil', 'Pooja',
+               'Rahul', 'Riya', 'Sanjay', 'Sneha', 'Suresh', 'Tanvi', 'Varun', 'Vinay', 'Yash', 'Zoya')
+LAST_NAMES = ('Agarwal', 'Bansal', 'Chopra', 'Desai', 'Gupta', 'Iyer', 'Jain', 'Kapoor', 'Mehta', 'Nair',
+              'Patel', 'Rao', 'Reddy', 'Shah', 'Sharma', 'Singh', 'Soni', 'Verma')
+ITEMS = ('Ring', 'Chain', 'Bangle', 'Necklace', 'Earring', 'Pendant', 'Bracelet', 'Coin', 'Anklet', 'Nose Pin')
+
+# Every generated user logs in with this password
+PASSWORD = 'bench123'
+
+
+def parse_count(text):
+    return SCALES.get(text.lower()) or int(text.replace('_', ''))
+
+
+# A JPEG upload of roughly phone-camera character: a flat colour under sensor-like noise
+def sample_upload(rng, size):
+    width, height = size, size * 3 // 4
+    base = Image.new('RGB', (width, height), tuple(rng.randrange(80, 220) for _ in range(3)))
+    noise = Image.effect_noise((width, height), rng.uniform(20, 60)).convert('RGB')
+    buffered = io.BytesIO()
+    Image.blend(base, noise, 0.35).save(buffered, format='JPEG', quality=90)
+    return buffered.getvalue()
+
+
+# Fill an empty, migrated database. Photos go through the same encoder as uploads
+# and are shared by `photo_ratio` of the forms, `photo_count` distinct ones in all.
+def generate(conn, forms=SCALES['10k'], users=10, templates_per_user=20, photo_count=50, photo_size=1600,
+             photo_ratio=0.5, days=365, end=datetime(2024, 12, 31), seed=1, batch_size=5000, log=print):
+    rng = random.Random(seed)
+    cursor = conn.cursor()
+
+    # A cheap cost keeps generation fast; the stored hash still verifies
+    password = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(4))
+    user_ids = []
+    for number in range(1, users + 1):
+        cursor.execute('INSERT INTO users (username, password, is_admin) VALUES (?, ?, 0)', (f'user{number:03d}', password))
+        user_ids.append(cursor.lastrowid)
+    # Some counters handle far more forms than others
+    weights = [rng.paretovariate(1.5) for _ in user_ids]
+
+    photo_hashes = []
+    for _ in range(photo_count):
+        photo = photos.encode_photo(sample_upload(rng, photo_size))
+        photos.save_photo(cursor, photo)
+        photo_hashes.append(photo['hash'])
+
+    for user_id in user_ids:
+        for _ in range(templates_per_user):
+            gross, gold = round(rng.uniform(0.5, 60), 3), round(rng.uniform(58, 99.9), 2)
+            cursor.execute('INSERT INTO templates (itemName, grossWeight, netWeight, gold, karat, userId) VALUES (?, ?, ?, ?, ?, ?)',
+                           (f'{rng.choice(ITEMS)} {rng.randint(1, 99)}', gross, gross, gold, validation.karat_for(gold), user_id))
+    conn.commit()
+
+    start = end - timedelta(days=days)
+    step = (end - start) / max(forms, 1)
+    names = {user_id: f'user{number:03d}' for number, user_id in enumerate(user_ids, 1)}
+    began = time.perf_counter()
+    for offset in range(0, forms, batch_size):
+        count = min(batch_size, forms - offset)
+        owners = rng.choices(user_ids, weights, k=count)
+        numbers = {user_id: counters.allocate(cursor, user_id, owners.count(user_id)) for user_id in set(owners)}
+        rows, audit_rows = [], []
+        for index, user_id in enumerate(owners):
+            created = start + step * (offset + index) + timedelta(seconds=rng.randint(0, 59))
+            form_number = numbers[user_id]
+            numbers[user_id] += 1
+            date, clock = created.strftime('%d-%m-%Y'), created.strftime('%H:%M:%S')
+            gross, gold = round(rng.uniform(0.5, 60), 3), round(rng.uniform(58, 99.9), 2)
+            rows.append((form_number, date, clock, f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                         rng.choice(ITEMS), f'9{rng.randrange(10**9):09d}' if rng.random() < 0.8 else '',
+                         gross, gross, gold, validation.karat_for(gold),
+                         rng.choice(photo_hashes) if photo_hashes and rng.random() < photo_ratio else None,
+                         created.isoformat(), validation.gold_purity_for(gold, gross),
+                         queries.created_at(date, clock), user_id))
+            audit_rows.append(('create_form', user_id, f'Form {form_number}', created.isoformat()))
+            if rng.random() < 0.05:
+                audit_rows.append(('login', user_id, names[user_id], created.isoformat()))
+        cursor.executemany('''INSERT INTO forms (formNumber, date, time, customerName, itemName, mobileNumber, grossWeight,
+                              netWeight, gold, karat, photoHash, updatedAt, goldPurity, createdAt, userId)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+        cursor.executemany('INSERT INTO audit_log (action, userId, username, timestamp) VALUES (?, ?, ?, ?)', audit_rows)
+        conn.commit()
+        if log:
+            done = offset + count
+            log(f"{done}/{forms} forms ({done / (time.perf_counter() - began):.0f}/s)")
+    cursor.execute('ANALYZE')
+    conn.commit()
+    return user_ids
+
+
+# Migrated database at `path` filled with generated data; the file must not hold forms yet
+def build(path, **options):
+    pool = database.ConnectionPool(database.connector({'mode': database.LOCAL, 'local_path': path}), size=1)
+    database.ensure_schema(pool)
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM forms')
+        if cursor.fetchone()[0]:
+            raise SystemExit(f"{path} already holds forms; generate into a new file")
+        return generate(conn, **options)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill a local SQLite file with synthetic forms")
+    parser.add_argument('path', help="database file to create")
+    parser.add_argument('--forms', type=parse_count, default=SCALES['10k'], help="10k, 100k, 1m or a number")
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--templates', type=int, default=20, help="templates per user")
+    parser.add_argument('--photos', type=int, default=50, help="distinct photos")
+    parser.add_argument('--photo-size', type=int, default=1600, help="width of each uploaded photo in pixels")
+    parser.add_argument('--photo-ratio', type=float, default=0.5, help="share of forms with a photo")
+    parser.add_argument('--days', type=int, default=365, help="days the forms are spread over")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    build(args.path, forms=args.forms, users=args.users, templates_per_user=args.templates, photo_count=args.photos,
+          photo_size=args.photo_size, photo_ratio=args.photo_ratio, days=args.days, seed=args.seed)
+    print(f"Generated {args.forms} forms for {args.users} users in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
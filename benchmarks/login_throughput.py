@@ -0,0 +1,73 @@
+# Login throughput under a shift-start burst: python -m benchmarks.login_throughput [--users N] [--clients N]
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import auth
+import database
+from benchmarks import generate
+from benchmarks.data_access import percentile
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Login throughput of the auth service")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--clients', type=int, default=16, help="concurrent login threads")
+    parser.add_argument('--logins', type=int, default=10, help="logins per client")
+    parser.add_argument('--workers', type=int, default=2, help="hashing workers")
+    parser.add_argument('--max-pending', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=auth.BCRYPT_ROUNDS)
+    parser.add_argument('--wrong', type=float, default=0.1, help="share of attempts with a wrong password")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'login.db')
+        generate.build(path, forms=0, users=args.users, templates_per_user=0, photo_count=0, log=None)
+        connect = database.connector({'mode': database.LOCAL, 'local_path': path})
+        conn = connect()
+        # Stored at the configured cost, so the measured logins do no rehashing
+        conn.cursor().execute("UPDATE users SET password = ? WHERE username LIKE 'user%'",
+                              (auth.hash_password(generate.PASSWORD, args.rounds),))
+        conn.commit()
+
+        service = auth.AuthService(workers=args.workers, max_pending=args.max_pending, rounds=args.rounds,
+                                   max_failures=10 ** 6)
+        timings, outcomes, lock = [], {'ok': 0, 'rejected': 0, 'busy': 0}, threading.Lock()
+
+        def client(number):
+            cursor = connect().cursor()
+            for attempt in range(args.logins):
+                username = f'user{(number * args.logins + attempt) % args.users + 1:03d}'
+                wrong = (number * args.logins + attempt) % round(1 / args.wrong) == 0 if args.wrong else False
+                start = time.perf_counter()
+                try:
+                    user = service.authenticate(cursor, username, 'wrong' if wrong else generate.PASSWORD, f'session{number}')
+                    outcome = 'ok' if user else 'rejected'
+                except auth.AuthBusy:
+                    outcome = 'busy'
+                with lock:
+                    timings.append(time.perf_counter() - start)
+                    outcomes[outcome] += 1
+
+        threads = [threading.Thread(target=client, args=(number,)) for number in range(args.clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+    timings.sort()
+    stats = service.stats()
+    print(f"{len(timings)} attempts from {args.clients} clients in {elapsed:.2f}s "
+          f"({(outcomes['ok'] + outcomes['rejected']) / elapsed:.1f} checked/s) at cost {args.rounds} on {args.workers} workers")
+    print(f"ok {outcomes['ok']} · rejected {outcomes['rejected']} · busy {outcomes['busy']} · "
+          f"avg hash {stats['avg_hash_ms']:.0f} ms · user cache hits {stats['user_cache_hits']}")
+    print(f"latency p50 {percentile(timings, 50) * 1000:.0f} ms · p95 {percentile(timings, 95) * 1000:.0f} ms · "
+          f"p99 {percentile(timings, 99) * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
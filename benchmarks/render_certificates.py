@@ -0,0 +1,54 @@
+# Certificate rendering throughput: python -m benchmarks.render_certificates [-n N]
+import argparse
+import io
+import random
+import tempfile
+import time
+
+from PIL import Image
+
+import certificates
+import photos
+
+
+def sample_forms(count, photo_hash):
+    rng = random.Random(1)
+    forms = []
+    for number in range(1, count + 1):
+        gross, gold = round(rng.uniform(1, 50), 3), round(rng.uniform(50, 99.9), 2)
+        forms.append({
+            'formNumber': number, 'date': '05-01-2024', 'time': '10:00:00',
+            'customerName': f'Customer {number}', 'itemName': rng.choice(['Ring', 'Chain', 'Bangle']),
+            'grossWeight': gross, 'gold': gold, 'karat': round(gold / 100 * 24, 2),
+            'goldPurity': round(gold * gross / 100, 3), 'photoHash': photo_hash if number % 2 else None,
+        })
+    return forms
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Certificate rendering throughput")
+    parser.add_argument('-n', type=int, default=50, help="certificates per run")
+    parser.add_argument('--format', choices=list(certificates.FORMATS), default='pdf')
+    parser.add_argument('--dpi', type=int, default=certificates.DPI)
+    args = parser.parse_args(argv)
+
+    buffered = io.BytesIO()
+    Image.new('RGB', (1200, 900), 'goldenrod').save(buffered, format='JPEG')
+    photo = photos.encode_photo(buffered.getvalue())
+    forms = sample_forms(args.n, photo['hash'])
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = certificates.RenderCache(directory)
+        for label in ('cold', 'warm'):
+            start = time.perf_counter()
+            size = sum(len(cache.certificate(form, lambda _: photo['original'], args.format, args.dpi)) for form in forms)
+            elapsed = time.perf_counter() - start
+            print(f"{label}: {args.n} {args.format} certificates at {args.dpi} DPI in {elapsed:.2f}s "
+                  f"({args.n / elapsed:.1f}/s, {size / args.n / 1024:.0f} KiB each)")
+        start = time.perf_counter()
+        size = len(cache.batch_pdf(forms, lambda _: photo['original'], args.dpi))
+        print(f"batch pdf: {args.n} pages in {time.perf_counter() - start:.2f}s ({size / 1024:.0f} KiB)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# Drives the Report page's export through Streamlit's AppTest against a generated
+# database, down to the download button, and times it:
+# python -m benchmarks.report_export [--forms N]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from streamlit.testing.v1 import AppTest
+
+import export
+from benchmarks import generate
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a report through the app and check it can be downloaded")
+    parser.add_argument('--forms', type=generate.parse_count, default=2000)
+    parser.add_argument('--timeout', type=float, default=120, help="seconds one script run may take")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'export.db')
+        generate.build(path, forms=args.forms, users=1, templates_per_user=0, photo_count=0, log=None)
+        app = AppTest.from_file(APP, default_timeout=args.timeout)
+        app.secrets['turso'] = {'mode': 'local', 'local_path': path}
+        app.secrets['cache'] = {'version_path': os.path.join(directory, 'versions.db')}
+        app.run()
+        app.text_input(key='login_username').input('user001')
+        app.text_input(key='login_password').input(generate.PASSWORD)
+        app.button[0].click().run()
+        app.session_state.page = 'report'
+        app.run()
+
+        for fmt in export.available_formats():
+            app.selectbox(key='report_export_format').select(fmt).run()
+            start = time.perf_counter()
+            app.button(key='prepare_export_button').click().run()
+            elapsed = time.perf_counter() - start
+            downloads = [element.proto.label for element in app.get('download_button')]
+            problems = [element.value for element in app.exception] + [element.value for element in app.error]
+            if problems or not downloads:
+                failures += 1
+                print(f"{fmt}: FAILED {problems or 'no download button'}")
+            else:
+                print(f"{fmt}: {downloads[0]} in {elapsed:.2f}s")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+import bisect
+import os
+import sqlite3
+import tempfile
+import threading
+
+import records
+
+
+# Per-user write versions shared by every process on this host, kept in a small
+# local SQLite file. Reading a version never touches the remote database.
+class VersionStore:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(tempfile.gettempdir(), 'gold_forms_versions.db')
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS versions (userId INTEGER PRIMARY KEY, version INTEGER NOT NULL)')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id):
+        row = self._connection().execute('SELECT version FROM versions WHERE userId = ?', (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    # Atomically increment a user's version; returns (previous, new)
+    def bump(self, user_id):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT version FROM versions WHERE userId = ?', (user_id,)).fetchone()
+            previous = row[0] if row else 0
+            conn.execute('INSERT INTO versions (userId, version) VALUES (?, ?) '
+                         'ON CONFLICT (userId) DO UPDATE SET version = excluded.version', (user_id, previous + 1))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return previous, previous + 1
+
+
+class _Entry:
+    __slots__ = ('version', 'forms', 'templates')
+
+    def __init__(self, version):
+        self.version = version
+        self.forms = None
+        self.templates = None
+
+
+# Read-through cache of each user's form list and templates, shared by all sessions
+# of the process. Lists are never mutated in place: deltas build a new list, so a
+# session holding the old one keeps a consistent snapshot.
+class FormCache:
+    def __init__(self, versions, form_window=None):
+        self.versions = versions
+        # Cached form lists hold at most this many of a user's newest forms
+        self.form_window = form_window
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, user_id, field, loader):
+        version = self.versions.get(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry.version == version and getattr(entry, field) is not None:
+                self.hits += 1
+                return getattr(entry, field)
+            self.misses += 1
+        value = loader()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry.version != version:
+                entry = self._entries[user_id] = _Entry(version)
+            setattr(entry, field, value)
+        return value
+
+    def get_forms(self, user_id, loader):
+        return self._get(user_id, 'forms', loader)
+
+    def get_templates(self, user_id, loader):
+        return self._get(user_id, 'templates', loader)
+
+    # Bump the user's version after a write and apply `delta` to the cached entry,
+    # unless another writer got in between, in which case the entry is dropped
+    def _apply(self, user_id, delta):
+        previous, version = self.versions.bump(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            if entry.version != previous:
+                del self._entries[user_id]
+                return
+            delta(entry)
+            entry.version = version
+
+    def upsert_form(self, user_id, form):
+        def delta(entry):
+            if entry.forms is None:
+                return
+            full = self.form_window is not None and len(entry.forms) >= self.form_window
+            if full and int(form.formNumber) < int(entry.forms[-1].formNumber):
+                # Older than everything in the window; the form stays out of it
+                return
+            forms = [f for f in entry.forms if f.id != form.id]
+            # Keep the newest-first order of load_forms
+            keys = [-int(f.formNumber) for f in forms]
+            forms.insert(bisect.bisect_left(keys, -int(form.formNumber)), form)
+            entry.forms = forms[:self.form_window] if self.form_window is not None else forms
+        self._apply(user_id, delta)
+
+    def remove_form(self, user_id, form_id):
+        def delta(entry):
+            if entry.forms is not None:
+                forms = [f for f in entry.forms if f.id != form_id]
+                full = self.form_window is not None and len(entry.forms) >= self.form_window
+                # A full window that loses a form must be reloaded to pull in the next older one
+                entry.forms = None if full and len(forms) < len(entry.forms) else forms
+        self._apply(user_id, delta)
+
+    def add_template(self, user_id, template):
+        def delta(entry):
+            if entry.templates is not None:
+                entry.templates = entry.templates + [template]
+        self._apply(user_id, delta)
+
+    def invalidate(self, user_id):
+        self.versions.bump(user_id)
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            stats = {'users': len(entries), 'hits': self.hits, 'misses': self.misses}
+        form_lists = [entry.forms for entry in entries if entry.forms is not None]
+        stats['records'] = sum(len(forms) for forms in form_lists)
+        stats['bytes'] = sum(records.memory_usage(forms) for forms in form_lists)
+        return stats
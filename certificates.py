@@ -0,0 +1,119 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+import printing
+
+# Printer resolution certificates are rendered at by default
+DPI = 300
+
+FORMATS = {
+    'pdf': ('PDF', 'application/pdf'),
+    'png': ('PNG', 'image/png'),
+}
+
+# Most certificates one batch PDF may hold; the print job takes more
+MAX_PDF_PAGES = 50
+
+# Bumped whenever the rendered output changes for the same form content
+RENDER_VERSION = 1
+
+_fonts = {}
+
+
+def _font(size, bold=False):
+    key = (size, bold)
+    if key not in _fonts:
+        try:
+            _fonts[key] = ImageFont.truetype('DejaVuSans-Bold.ttf' if bold else 'DejaVuSans.ttf', size)
+        except OSError:
+            _fonts[key] = ImageFont.load_default(size)
+    return _fonts[key]
+
+
+# Draw one certificate as an RGB page, laid out from printing.LAYOUT scaled from
+# 72 DPI to `dpi`. `photo` is the image bytes for the photo box, if any.
+def render_image(form, photo=None, dpi=DPI):
+    scale = dpi / 72
+    page = Image.new('RGB', (round(printing.PAGE_WIDTH * scale), round(printing.PAGE_HEIGHT * scale)), 'white')
+    draw = ImageDraw.Draw(page)
+    for name, text in printing.field_texts(form).items():
+        box = printing.LAYOUT[name]
+        draw.text((round(box['left'] * scale), round(box['top'] * scale)), text,
+                  font=_font(round(box['font_size'] * scale), box.get('bold', False)), fill=box.get('color', 'black'))
+    if photo:
+        box = printing.LAYOUT['photo']
+        width, height = round(box['width'] * scale), round(box['height'] * scale)
+        left, top = page.width - round(box['right'] * scale) - width, round(box['top'] * scale)
+        with Image.open(io.BytesIO(photo)) as image:
+            fitted = ImageOps.contain(image.convert('RGB'), (width, height))
+        page.paste(fitted, (left + (width - fitted.width) // 2, top + (height - fitted.height) // 2))
+        draw.rectangle((left, top, left + width - 1, top + height - 1), outline='#cccccc', width=max(1, round(scale)))
+    return page
+
+
+def encode(pages, fmt='pdf', dpi=DPI):
+    image_format, _ = FORMATS[fmt]
+    buffered = io.BytesIO()
+    if fmt == 'pdf':
+        pages[0].save(buffered, format=image_format, resolution=dpi, save_all=True, append_images=pages[1:])
+    else:
+        pages[0].save(buffered, format=image_format, dpi=(dpi, dpi))
+    return buffered.getvalue()
+
+
+# Content key of a rendered certificate: everything that ends up on the page
+def render_key(form, fmt='pdf', dpi=DPI):
+    content = {'fields': printing.field_texts(form), 'photo': form.get('photoHash') or None,
+               'layout': printing.LAYOUT, 'format': fmt, 'dpi': dpi, 'version': RENDER_VERSION}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+# Rendered certificates on disk, named by their content key. Identical forms share
+# a file, and an edited form gets a new key, so files never need invalidating.
+class RenderCache:
+    def __init__(self, directory=None):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'gold_forms_certificates')
+        os.makedirs(self.directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key, fmt):
+        return os.path.join(self.directory, f'{key}.{fmt}')
+
+    # Certificate bytes for one form. `load_photo` is called with the photo hash
+    # only when the certificate is not cached yet.
+    def certificate(self, form, load_photo, fmt='pdf', dpi=DPI):
+        path = self._path(render_key(form, fmt, dpi), fmt)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            self.hits += 1
+            return data
+        except FileNotFoundError:
+            self.misses += 1
+        photo = load_photo(form['photoHash']) if form.get('photoHash') else None
+        data = encode([render_image(form, photo, dpi)], fmt, dpi)
+        # Written under a temporary name and renamed, so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return data
+
+    # One multi-page PDF for many forms, assembled from their cached PNG pages.
+    # Each page is decoded and appended to the file on its own, so only one
+    # page's pixels are held at a time.
+    def batch_pdf(self, forms, load_photo, dpi=DPI):
+        if len(forms) > MAX_PDF_PAGES:
+            raise ValueError(f"At most {MAX_PDF_PAGES} certificates per PDF")
+        with tempfile.TemporaryFile(dir=self.directory) as f:
+            for index, form in enumerate(forms):
+                with Image.open(io.BytesIO(self.certificate(form, load_photo, 'png', dpi))) as page:
+                    page.save(f, format='PDF', resolution=dpi, append=index > 0)
+            f.seek(0)
+            return f.read()
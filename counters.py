@@ -0,0 +1,32 @@
+# Per-user form number counters. Numbers are taken inside the transaction that
+# saves the form, so two tabs of the same user can never get the same one.
+
+
+def create_table(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS form_counters (
+        userId INTEGER PRIMARY KEY,
+        lastNumber INTEGER NOT NULL
+    )''')
+
+
+# Seed counters from the numbers already in use
+def seed(cursor):
+    cursor.execute('''INSERT INTO form_counters (userId, lastNumber)
+                      SELECT userId, MAX(formNumber) FROM forms WHERE userId IS NOT NULL GROUP BY userId
+                      ON CONFLICT (userId) DO UPDATE SET lastNumber = MAX(lastNumber, excluded.lastNumber)''')
+
+
+# Reserve `count` consecutive numbers for a user; returns the first one
+def allocate(cursor, user_id, count=1):
+    cursor.execute('''INSERT INTO form_counters (userId, lastNumber) VALUES (?, ?)
+                      ON CONFLICT (userId) DO UPDATE SET lastNumber = lastNumber + excluded.lastNumber''',
+                   (user_id, count))
+    cursor.execute('SELECT lastNumber FROM form_counters WHERE userId = ?', (user_id,))
+    return cursor.fetchone()[0] - count + 1
+
+
+# The number the user's next form will most likely get; nothing is reserved
+def peek_next(cursor, user_id):
+    cursor.execute('SELECT lastNumber FROM form_counters WHERE userId = ?', (user_id,))
+    row = cursor.fetchone()
+    return row[0] + 1 if row else 1
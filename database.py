@@ -0,0 +1,254 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import auth
+import migrations
+
+try:
+    import libsql_experimental as libsql
+except ImportError:
+    libsql = None
+
+# How the app reaches the database, set by `mode` in the [turso] settings
+REMOTE = 'remote'    # every statement goes to the Turso URL
+REPLICA = 'replica'  # reads from a local embedded replica file, writes go to the primary
+LOCAL = 'local'      # a plain SQLite file standing in for Turso, for offline runs and benchmarks
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# sqlite3 connection with the libsql extras the app relies on. There is no primary
+# to sync with, so sync() does nothing.
+class LocalConnection:
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def sync(self):
+        pass
+
+
+# Connection factory for the [turso] settings
+def connector(settings):
+    mode = settings.get('mode', REMOTE)
+    if mode == LOCAL:
+        path = settings.get('local_path', 'forms.db')
+        return lambda: LocalConnection(path)
+    if libsql is None:
+        raise RuntimeError("libsql_experimental is required for the remote and replica modes")
+    db_url, auth_token = settings['database_url'], settings.get('auth_token')
+    if mode == REPLICA:
+        replica_path = settings.get('replica_path', 'replica.db')
+        return lambda: libsql.connect(replica_path, sync_url=db_url, auth_token=auth_token)
+    if mode != REMOTE:
+        raise ValueError(f"Unknown database mode: {mode}")
+    return lambda: libsql.connect(db_url, auth_token=auth_token, sync_url=db_url)
+
+
+# Bounded pool of database connections shared by every session of the process.
+# Each script run checks a connection out and hands it back when it finishes,
+# so concurrent sessions never share a cursor.
+class ConnectionPool:
+    def __init__(self, connect, size=4, timeout=10.0, health_check_interval=30.0):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._stats = {
+            'created': 0,
+            'checkouts': 0,
+            'in_use': 0,
+            'peak_in_use': 0,
+            'reconnects': 0,
+            'timeouts': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+        }
+
+    def _new_connection(self):
+        conn = self._connect()
+        with self._lock:
+            self._stats['created'] += 1
+        return conn
+
+    def _is_alive(self, conn):
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.fetchone()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+        try:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._new_connection()
+            else:
+                # Only ping connections that sat idle long enough to have gone stale
+                if time.monotonic() - last_used > self.health_check_interval and not self._is_alive(conn):
+                    self._discard(conn)
+                    conn = self._new_connection()
+                    with self._lock:
+                        self._stats['reconnects'] += 1
+        except BaseException:
+            self._slots.release()
+            raise
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            self._stats['peak_in_use'] = max(self._stats['peak_in_use'], self._stats['in_use'])
+            self._stats['wait_total'] += waited
+            self._stats['wait_max'] = max(self._stats['wait_max'], waited)
+        return conn
+
+    def release(self, conn, check=False):
+        try:
+            if getattr(conn, 'in_transaction', False):
+                conn.rollback()
+            if check and not self._is_alive(conn):
+                self._discard(conn)
+                with self._lock:
+                    self._stats['reconnects'] += 1
+            else:
+                self._idle.put((conn, time.monotonic()))
+        except Exception:
+            self._discard(conn)
+        finally:
+            with self._lock:
+                self._stats['in_use'] -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, check=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['size'] = self.size
+        stats['idle'] = self._idle.qsize()
+        stats['wait_avg'] = stats['wait_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        return stats
+
+
+# Keeps an embedded replica close to the primary: a background thread pulls changes
+# every `interval` seconds, and ensure_fresh() syncs before a read when the last pull
+# is older than `max_staleness`. Writes sync on their own connection as they commit.
+class ReplicaSyncer:
+    def __init__(self, pool, interval=60.0, max_staleness=None, on_error=None):
+        self.pool = pool
+        self.interval = interval
+        self.max_staleness = max_staleness
+        self.on_error = on_error
+        self.syncs = 0
+        self.errors = 0
+        self._last_sync = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='replica-sync', daemon=True)
+        if interval and interval > 0:
+            self._thread.start()
+
+    def sync_now(self):
+        with self._lock:
+            with self.pool.connection() as conn:
+                conn.sync()
+            self._last_sync = time.monotonic()
+            self.syncs += 1
+
+    # Seconds since the last successful pull, or None before the first one
+    def staleness(self):
+        return time.monotonic() - self._last_sync if self._last_sync is not None else None
+
+    def ensure_fresh(self):
+        if self.max_staleness is None:
+            return
+        staleness = self.staleness()
+        if staleness is None or staleness > self.max_staleness:
+            self.sync_now()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.sync_now()
+            except Exception as e:
+                self.errors += 1
+                if self.on_error:
+                    self.on_error(f"Replica sync error: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+
+
+# Bring the schema up to date and create the default admin user
+def init_db(conn):
+    migrations.migrate(conn)
+    cursor = conn.cursor()
+    # Create default admin user if not exists
+    cursor.execute('SELECT id FROM users WHERE username = ?', ('admin',))
+    if not cursor.fetchone():
+        hashed_password = auth.hash_password('admin123')
+        cursor.execute('INSERT INTO users (username, password, is_admin) VALUES (?, ?, ?)', ('admin', hashed_password, 1))
+        conn.commit()
+        conn.sync()
+    # A hot query falling back to a table scan is worth knowing about, but not worth refusing to start
+    problems = migrations.check_query_plans(cursor)
+    if problems:
+        timestamp = datetime.now().isoformat()
+        cursor.execute('INSERT INTO error_logs (message, timestamp, lastSeen) VALUES (?, ?, ?)',
+                       (f"Hot queries not using an index: {problems}", timestamp, timestamp))
+        conn.commit()
+
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+# Run the schema bootstrap exactly once per process
+def ensure_schema(pool):
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with pool.connection() as conn:
+            init_db(conn)
+        _schema_ready = True
@@ -0,0 +1,182 @@
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import queries
+
+ERROR_COLUMNS = ('id', 'message', 'count', 'timestamp', 'lastSeen')
+
+# Where batches go while the database cannot be written; replayed once it can
+SPOOL_FILE = os.path.join(tempfile.gettempdir(), 'gold_forms_errors.jsonl')
+
+
+# Errors are queued and written by a background thread, so logging never waits on
+# the database that may be the thing failing. Repeats of a message within `window`
+# seconds of its row being started only bump that row's count. When the queue is
+# full new errors are counted and dropped; when the database is unreachable the
+# batch is appended to a spool file and written after the next successful batch.
+class ErrorLogger:
+    def __init__(self, connect, window=60.0, max_pending=1000, batch_size=200, flush_interval=1.0, spool_path=None):
+        self._connect = connect
+        self.window = window
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_path = spool_path or SPOOL_FILE
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._conn = None
+        # message -> (row id, when the row was started) for rows still open to repeats
+        self._open_rows = {}
+        self._lock = threading.Lock()
+        self._stats = {'logged': 0, 'dropped': 0, 'rows': 0, 'collapsed': 0, 'spooled': 0, 'replayed': 0, 'write_errors': 0}
+        self._thread = threading.Thread(target=self._run, name='error-logger', daemon=True)
+        self._thread.start()
+
+    # Queue a message; never blocks and never raises
+    def log(self, message, timestamp=None):
+        try:
+            self._queue.put_nowait((message, timestamp or datetime.now()))
+            outcome = 'logged'
+        except queue.Full:
+            outcome = 'dropped'
+        self._count(outcome)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    # Wait until everything queued so far has been written or spooled
+    def flush(self, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        return dict(stats, pending=self._queue.qsize(),
+                    spool_bytes=os.path.getsize(self.spool_path) if os.path.exists(self.spool_path) else 0)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Let a burst gather so it becomes one write
+            time.sleep(self.flush_interval)
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    # Collapse identical messages of a batch into (message, first, last, count) entries
+    @staticmethod
+    def _collapse(batch):
+        entries = {}
+        for message, timestamp in batch:
+            if message in entries:
+                first, last, count = entries[message]
+                entries[message] = (min(first, timestamp), max(last, timestamp), count + 1)
+            else:
+                entries[message] = (timestamp, timestamp, 1)
+        return [(message, first, last, count) for message, (first, last, count) in entries.items()]
+
+    def _write_batch(self, batch):
+        entries = self._collapse(batch)
+        try:
+            replayed = self._read_spool()
+            self._write(replayed + entries)
+            if replayed:
+                os.remove(self.spool_path)
+                self._count('replayed', len(replayed))
+        except Exception:
+            self._count('write_errors')
+            self._reset_connection()
+            self._spool(entries)
+
+    def _write(self, entries):
+        if self._conn is None:
+            self._conn = self._connect()
+        cursor = self._conn.cursor()
+        for message, first, last, count in entries:
+            open_row = self._open_rows.get(message)
+            if open_row and abs(first - open_row[1]) <= timedelta(seconds=self.window):
+                cursor.execute('UPDATE error_logs SET count = count + ?, lastSeen = MAX(lastSeen, ?) WHERE id = ?',
+                               (count, last.isoformat(), open_row[0]))
+                if cursor.rowcount:
+                    self._count('collapsed', count)
+                    continue
+            cursor.execute('INSERT INTO error_logs (message, timestamp, count, lastSeen) VALUES (?, ?, ?, ?)',
+                           (message, first.isoformat(), count, last.isoformat()))
+            self._open_rows[message] = (cursor.lastrowid, first)
+            self._count('rows')
+            self._count('collapsed', count - 1)
+        self._conn.commit()
+        self._conn.sync()
+        # Forget rows no repeat can join any more
+        cutoff = datetime.now() - timedelta(seconds=self.window)
+        self._open_rows = {m: row for m, row in self._open_rows.items() if row[1] >= cutoff}
+
+    def _reset_connection(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+        self._open_rows = {}
+
+    def _spool(self, entries):
+        try:
+            with open(self.spool_path, 'a', encoding='utf-8') as f:
+                for message, first, last, count in entries:
+                    f.write(json.dumps({'message': message, 'first': first.isoformat(),
+                                        'last': last.isoformat(), 'count': count}) + '\n')
+            self._count('spooled', len(entries))
+        except OSError:
+            self._count('dropped', sum(entry[3] for entry in entries))
+
+    def _read_spool(self):
+        if not os.path.exists(self.spool_path):
+            return []
+        entries = []
+        with open(self.spool_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                    entries.append((item['message'], datetime.fromisoformat(item['first']),
+                                    datetime.fromisoformat(item['last']), item['count']))
+                except (ValueError, KeyError):
+                    continue
+        return entries
+
+
+# Error groups for the admin viewer, most recently seen first
+def recent_errors(cursor, since=None, text='', limit=50):
+    clauses, params = [], []
+    if since:
+        clauses.append('lastSeen >= ?')
+        params.append(since.isoformat())
+    if text:
+        clauses.append("message LIKE ? ESCAPE '\\'")
+        params.append(queries.like_pattern(text))
+    where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+    cursor.execute(f'SELECT {", ".join(ERROR_COLUMNS)} FROM error_logs {where} ORDER BY lastSeen DESC LIMIT ?', params + [limit])
+    return [dict(zip(ERROR_COLUMNS, row)) for row in cursor.fetchall()]
+
+
+# Errors per hour since `since`, each group counted in the hour it was last seen
+def hourly_rate(cursor, since):
+    cursor.execute('''SELECT substr(lastSeen, 1, 13) AS hour, SUM(count), COUNT(*) FROM error_logs
+                      WHERE lastSeen >= ? GROUP BY hour ORDER BY hour''', (since.isoformat(),))
+    return [{'hour': hour, 'errors': errors, 'messages': messages} for hour, errors, messages in cursor.fetchall()]
@@ -0,0 +1,112 @@
+import csv
+import io
+import tempfile
+
+import queries
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+PARQUET_AVAILABLE = pa is not None
+
+# Database column and export header, in file order
+EXPORT_COLUMNS = (
+    ('formNumber', 'Form Number'),
+    ('date', 'Date'),
+    ('customerName', 'Customer Name'),
+    ('itemName', 'Item Name'),
+    ('mobileNumber', 'Mobile Number'),
+    ('grossWeight', 'Gross Weight'),
+    ('netWeight', 'Net Weight'),
+    ('gold', 'Gold'),
+    ('karat', 'Karat'),
+)
+
+CHUNK_SIZE = 1000
+
+
+# Stream a user's report rows from the cursor in fixed-size chunks
+def iter_report_chunks(cursor, user_id, sort_by='formNumber', customer='', start_date=None, end_date=None,
+                       chunk_size=CHUNK_SIZE):
+    where, params = queries.report_filter(user_id, customer, start_date, end_date)
+    cursor.execute(f'SELECT {", ".join(c for c, _ in EXPORT_COLUMNS)} FROM forms {where} '
+                   f'ORDER BY {queries.REPORT_SORTS[sort_by]}', params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+
+def _format_karat(value):
+    return f"{value:.2f}" if value is not None else 'N/A'
+
+
+def write_csv(chunks, fileobj):
+    text = io.TextIOWrapper(fileobj, encoding='utf-8', newline='', write_through=True)
+    writer = csv.writer(text, lineterminator='\n')
+    writer.writerow([header for _, header in EXPORT_COLUMNS])
+    karat_index = len(EXPORT_COLUMNS) - 1
+    rows = 0
+    for chunk in chunks:
+        for row in chunk:
+            row = list(row)
+            row[karat_index] = _format_karat(row[karat_index])
+            writer.writerow(row)
+        rows += len(chunk)
+    text.detach()
+    return rows
+
+
+def _parquet_schema():
+    return pa.schema([
+        ('Form Number', pa.int64()),
+        ('Date', pa.string()),
+        ('Customer Name', pa.string()),
+        ('Item Name', pa.string()),
+        ('Mobile Number', pa.string()),
+        ('Gross Weight', pa.float64()),
+        ('Net Weight', pa.float64()),
+        ('Gold', pa.float64()),
+        ('Karat', pa.float64()),
+    ])
+
+
+def write_parquet(chunks, fileobj):
+    schema = _parquet_schema()
+    rows = 0
+    with pq.ParquetWriter(fileobj, schema) as parquet_writer:
+        for chunk in chunks:
+            columns = list(zip(*chunk))
+            parquet_writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema))
+            rows += len(chunk)
+    return rows
+
+
+FORMATS = {
+    'csv': (write_csv, 'text/csv', 'csv'),
+    'parquet': (write_parquet, 'application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def available_formats():
+    return [name for name in FORMATS if name != 'parquet' or PARQUET_AVAILABLE]
+
+
+# Export a user's report into a temporary file that spills to disk past a few MB.
+# Returns the file rewound to the start, its mime type, file extension and row count.
+def export_report(cursor, user_id, fmt='csv', sort_by='formNumber', customer='', start_date=None, end_date=None,
+                  chunk_size=CHUNK_SIZE):
+    if fmt not in available_formats():
+        raise ValueError(f"Unsupported export format: {fmt}")
+    write, mime_type, extension = FORMATS[fmt]
+    fileobj = tempfile.SpooledTemporaryFile(max_size=4 * 1024 * 1024)
+    chunks = iter_report_chunks(cursor, user_id, sort_by, customer, start_date, end_date, chunk_size)
+    rows = write(chunks, fileobj)
+    fileobj.seek(0)
+    return fileobj, mime_type, extension, rows
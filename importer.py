@@ -0,0 +1,183 @@
+import argparse
+import os
+import sys
+import tomllib
+from datetime import datetime
+
+import pandas as pd
+
+import counters
+import database
+import queries
+import validation
+from cache import VersionStore
+
+# Imported columns, with the headers accepted for each. The export headers work
+# too, so a report export can be imported into another account.
+IMPORT_COLUMNS = {
+    'date': ('date', 'Date'),
+    'time': ('time', 'Time'),
+    'customerName': ('customerName', 'Customer Name'),
+    'itemName': ('itemName', 'Item Name'),
+    'mobileNumber': ('mobileNumber', 'Mobile Number'),
+    'grossWeight': ('grossWeight', 'Gross Weight'),
+    'gold': ('gold', 'Gold'),
+}
+
+TEXT_COLUMNS = ('customerName', 'itemName', 'mobileNumber', 'time')
+NUMBER_COLUMNS = ('grossWeight', 'gold')
+
+BATCH_SIZE = 500
+
+
+class ImportFailed(Exception):
+    pass
+
+
+# Read an uploaded CSV or Excel file with every cell as text
+def read_table(fileobj, filename):
+    if filename.lower().endswith(('.xlsx', '.xls')):
+        try:
+            return pd.read_excel(fileobj, dtype=str)
+        except ImportError as e:
+            raise ImportFailed(f"Excel import needs openpyxl installed ({e})") from e
+    return pd.read_csv(fileobj, dtype=str, keep_default_na=False)
+
+
+def _normalize(table):
+    headers = {str(h).strip(): h for h in table.columns}
+    frame = pd.DataFrame(index=table.index)
+    for column, names in IMPORT_COLUMNS.items():
+        source = next((headers[name] for name in names if name in headers), None)
+        frame[column] = table[source] if source is not None else ''
+    for column in TEXT_COLUMNS:
+        frame[column] = frame[column].fillna('').astype(str).str.strip()
+    return frame
+
+
+# Normalize a raw table and validate every row at once. Returns the prepared frame
+# (dates as dd-mm-YYYY, numbers parsed, karat and fine gold derived) and one error message per
+# row, empty for rows that can be imported.
+def prepare(table):
+    frame = _normalize(table)
+    messages = []
+    for column in NUMBER_COLUMNS:
+        raw = frame[column].fillna('').astype(str).str.strip()
+        frame[column] = pd.to_numeric(raw, errors='coerce')
+        messages.append(pd.Series('', index=frame.index).where(
+            raw.eq('') | frame[column].notna(), f"{IMPORT_COLUMNS[column][1]} is not a number"))
+
+    raw_date = frame['date'].fillna('').astype(str).str.strip()
+    parsed = pd.to_datetime(raw_date, dayfirst=True, errors='coerce', format='mixed')
+    frame['date'] = parsed.dt.strftime('%d-%m-%Y')
+    messages.append(pd.Series('', index=frame.index).where(parsed.notna(), "Date is missing or not a date"))
+
+    messages.append(validation.validate_frame(frame))
+    errors = pd.concat(messages, axis=1).apply(lambda row: '; '.join(m for m in row if m), axis=1)
+
+    frame['netWeight'] = frame['grossWeight']
+    frame['karat'] = validation.karat_series(frame['gold'])
+    frame['goldPurity'] = validation.gold_purity_series(frame['gold'], frame['grossWeight'])
+    return frame, errors
+
+
+# Per-row error report for the rows that were rejected; row numbers match the file,
+# counting the header as row 1
+def error_report(table, errors):
+    rejected = errors[errors != '']
+    report = table.loc[rejected.index].copy()
+    report.insert(0, 'Row', rejected.index + 2)
+    report.insert(1, 'Errors', rejected)
+    return report
+
+
+def _none(value):
+    return None if pd.isna(value) else value
+
+
+# Insert the valid rows for a user in batches. Each batch takes its form numbers
+# with one counter update, inserts with executemany and commits and syncs once.
+# Returns the number of forms imported.
+def import_forms(conn, user_id, frame, errors, batch_size=BATCH_SIZE):
+    valid = frame[errors == '']
+    cursor = conn.cursor()
+    imported = 0
+    for start in range(0, len(valid), batch_size):
+        batch = valid.iloc[start:start + batch_size]
+        try:
+            first = counters.allocate(cursor, user_id, len(batch))
+            now = datetime.now().isoformat()
+            rows = [(first + i, _none(r.date), r.time, r.customerName, r.itemName, r.mobileNumber,
+                     _none(r.grossWeight), _none(r.netWeight), _none(r.gold), _none(r.karat), now,
+                     _none(r.goldPurity), queries.created_at(r.date, r.time), user_id)
+                    for i, r in enumerate(batch.itertuples(index=False))]
+            cursor.executemany('''INSERT INTO forms (formNumber, date, time, customerName, itemName, mobileNumber,
+                                  grossWeight, netWeight, gold, karat, updatedAt, goldPurity, createdAt, userId)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                               rows)
+            cursor.execute('INSERT INTO audit_log (action, userId, username, timestamp) VALUES (?, ?, ?, ?)',
+                           ('import_forms', user_id, f"Forms {first}-{first + len(batch) - 1}", now))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        conn.sync()
+        imported += len(batch)
+    return imported
+
+
+# The app's settings, so the import writes where the app reads and bumps the
+# version file its processes watch; --database-url overrides [turso]
+def _settings(args):
+    settings = {}
+    if os.path.exists(args.secrets):
+        with open(args.secrets, 'rb') as f:
+            settings = tomllib.load(f)
+    if args.database_url:
+        settings['turso'] = {'database_url': args.database_url, 'auth_token': args.auth_token}
+    if not settings.get('turso'):
+        raise SystemExit("No database configured; pass --database-url or provide the Streamlit secrets file")
+    return settings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import forms from a CSV or Excel file")
+    parser.add_argument('file')
+    parser.add_argument('--user', required=True, help="username the forms are imported for")
+    parser.add_argument('--database-url')
+    parser.add_argument('--auth-token')
+    parser.add_argument('--secrets', default=os.path.join('.streamlit', 'secrets.toml'))
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--errors', help="write rejected rows to this CSV file")
+    parser.add_argument('--dry-run', action='store_true', help="validate only")
+    args = parser.parse_args(argv)
+
+    with open(args.file, 'rb') as f:
+        table = read_table(f, args.file)
+    frame, errors = prepare(table)
+    rejected = int((errors != '').sum())
+    print(f"{len(frame) - rejected} valid rows, {rejected} rejected")
+    if rejected and args.errors:
+        error_report(table, errors).to_csv(args.errors, index=False)
+        print(f"Rejected rows written to {args.errors}")
+    if args.dry_run:
+        return 0
+
+    settings = _settings(args)
+    conn = database.connector(settings['turso'])()
+    # The import relies on the counters, search index and createdAt of the current schema
+    database.init_db(conn)
+    cursor = conn.cursor()
+    cursor.execute('SELECT id FROM users WHERE username = ?', (args.user,))
+    user = cursor.fetchone()
+    if not user:
+        raise SystemExit(f"Unknown user: {args.user}")
+    imported = import_forms(conn, user[0], frame, errors, args.batch_size)
+    # Running app processes on this host drop their cached form lists for the user
+    VersionStore(settings.get('cache', {}).get('version_path')).bump(user[0])
+    print(f"Imported {imported} forms for {args.user}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
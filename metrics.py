@@ -0,0 +1,259 @@
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# What a timing measures
+QUERY = 'query'  # one cursor execute, keyed by its SQL
+SYNC = 'sync'    # a libsql sync with the primary
+STAGE = 'stage'  # a named step inside a page, e.g. load_forms
+PAGE = 'page'    # a whole page render
+
+# Latency buckets grow by a quarter power of two from 10 microseconds, so a
+# percentile read back from them is within about 19% of the true value
+_MIN_SECONDS = 1e-5
+_GROWTH = 2 ** 0.25
+BUCKETS = 100
+
+
+def _bucket(seconds):
+    if seconds <= _MIN_SECONDS:
+        return 0
+    return min(BUCKETS - 1, int(math.log(seconds / _MIN_SECONDS, _GROWTH)) + 1)
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total', 'max', 'rows', 'bytes')
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.bytes = 0
+
+    def record(self, seconds):
+        self.counts[_bucket(seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.rows += other.rows
+        self.bytes += other.bytes
+
+    # Upper bound of the bucket holding the p-th percentile, in seconds
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(p / 100 * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(_MIN_SECONDS * _GROWTH ** index, self.max)
+        return self.max
+
+
+# Histograms per (kind, name). Each thread records into its own dict, so the hot
+# path takes no lock; snapshot() merges them. Streamlit runs every script run on a
+# fresh thread, so whenever a thread registers, the histograms of finished threads
+# are folded into one total and only live threads are kept.
+class Registry:
+    def __init__(self):
+        self._local = threading.local()
+        self._threads = []
+        self._retired = {}
+        self._lock = threading.Lock()
+        self.since = time.time()
+
+    def _histograms(self):
+        histograms = getattr(self._local, 'histograms', None)
+        if histograms is None:
+            histograms = self._local.histograms = {}
+            with self._lock:
+                self._retire_finished()
+                self._threads.append((threading.current_thread(), histograms))
+        return histograms
+
+    # Called with the lock held
+    def _retire_finished(self):
+        live = []
+        for thread, histograms in self._threads:
+            if thread.is_alive():
+                live.append((thread, histograms))
+            else:
+                _merge_into(self._retired, histograms)
+        self._threads = live
+
+    def histogram(self, kind, name):
+        histograms = self._histograms()
+        histogram = histograms.get((kind, name))
+        if histogram is None:
+            histogram = histograms[(kind, name)] = Histogram()
+        return histogram
+
+    def record(self, kind, name, seconds):
+        self.histogram(kind, name).record(seconds)
+
+    @contextmanager
+    def timed(self, kind, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(kind, name, time.perf_counter() - start)
+
+    # Merged histograms of every thread, keyed by (kind, name)
+    def snapshot(self):
+        with self._lock:
+            self._retire_finished()
+            merged = {}
+            _merge_into(merged, self._retired)
+            for _, histograms in self._threads:
+                _merge_into(merged, histograms)
+        return merged
+
+    def reset(self):
+        with self._lock:
+            self._retired = {}
+            for _, histograms in self._threads:
+                histograms.clear()
+            self.since = time.time()
+
+
+def _merge_into(target, histograms):
+    for key, histogram in list(histograms.items()):
+        target.setdefault(key, Histogram()).merge(histogram)
+
+
+registry = Registry()
+
+
+def timed(kind, name):
+    return registry.timed(kind, name)
+
+
+# Decorator form of timed() for a stage
+def stage(name):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with registry.timed(STAGE, name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# One row per timed operation, slowest p95 first
+def summary(snapshot=None, kind=None):
+    rows = []
+    for (row_kind, name), histogram in (snapshot if snapshot is not None else registry.snapshot()).items():
+        if kind is not None and row_kind != kind or not histogram.count:
+            continue
+        rows.append({
+            'kind': row_kind,
+            'name': name,
+            'count': histogram.count,
+            'p50_ms': histogram.percentile(50) * 1000,
+            'p95_ms': histogram.percentile(95) * 1000,
+            'p99_ms': histogram.percentile(99) * 1000,
+            'mean_ms': histogram.total / histogram.count * 1000,
+            'max_ms': histogram.max * 1000,
+            'total_s': histogram.total,
+            'rows_per_call': histogram.rows / histogram.count,
+            'bytes_per_call': histogram.bytes / histogram.count,
+        })
+    return sorted(rows, key=lambda row: row['p95_ms'], reverse=True)
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_name(sql):
+    return ' '.join(sql.split())[:160]
+
+
+def _size(value):
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 8 if value is not None else 0
+
+
+# Cursor that times every execute and counts the rows and bytes fetched after it
+class InstrumentedCursor:
+    def __init__(self, cursor, registry):
+        self._cursor = cursor
+        self._registry = registry
+        self._histogram = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def _run(self, method, sql, params):
+        self._histogram = self._registry.histogram(QUERY, statement_name(sql))
+        start = time.perf_counter()
+        try:
+            method(sql, params)
+        finally:
+            self._histogram.record(time.perf_counter() - start)
+        return self
+
+    def execute(self, sql, params=()):
+        return self._run(self._cursor.execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._run(self._cursor.executemany, sql, seq_of_params)
+
+    def _count(self, rows):
+        if self._histogram is not None:
+            self._histogram.rows += len(rows)
+            self._histogram.bytes += sum(_size(value) for row in rows for value in row)
+        return rows
+
+    def fetchall(self):
+        return self._count(self._cursor.fetchall())
+
+    def fetchmany(self, *args):
+        return self._count(self._cursor.fetchmany(*args))
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._count((row,))
+        return row
+
+
+class InstrumentedConnection:
+    def __init__(self, conn, registry):
+        self._conn = conn
+        self._registry = registry
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self):
+        return InstrumentedCursor(self._conn.cursor(), self._registry)
+
+    def commit(self):
+        with self._registry.timed(QUERY, 'COMMIT'):
+            self._conn.commit()
+
+    def sync(self):
+        with self._registry.timed(SYNC, 'sync'):
+            return self._conn.sync()
+
+
+# Wrap a connection factory so every connection it makes is timed
+def instrument(connect, registry=registry):
+    return lambda: InstrumentedConnection(connect(), registry)
@@ -0,0 +1,253 @@
+from datetime import datetime
+
+import analytics
+import apikeys
+import audit
+import counters
+import photos
+import search
+
+# Ordered schema migrations. Each step is idempotent and runs once per database;
+# applied versions are recorded in schema_version.
+MIGRATIONS = []
+
+
+def migration(version, name):
+    def register(fn):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def _columns(cursor, table):
+    cursor.execute(f'PRAGMA table_info({table})')
+    return [row[1] for row in cursor.fetchall()]
+
+
+def add_column(cursor, table, column, definition):
+    if column not in _columns(cursor, table):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+@migration(1, 'base tables')
+def _base_tables(conn, cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE,
+        password TEXT,
+        is_admin BOOLEAN DEFAULT 0
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS forms (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        formNumber INTEGER,
+        date TEXT,
+        time TEXT,
+        customerName TEXT,
+        itemName TEXT,
+        mobileNumber TEXT,
+        grossWeight REAL,
+        netWeight REAL,
+        gold REAL,
+        karat REAL,
+        photo TEXT,
+        userId INTEGER
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS templates (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        itemName TEXT,
+        grossWeight REAL,
+        netWeight REAL,
+        gold REAL,
+        karat REAL,
+        userId INTEGER
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS audit_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        action TEXT,
+        userId INTEGER,
+        username TEXT,
+        timestamp TEXT
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS error_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message TEXT,
+        timestamp TEXT
+    )''')
+
+
+@migration(2, 'content-addressed photo store')
+def _photo_store(conn, cursor):
+    photos.create_table(cursor)
+    add_column(cursor, 'forms', 'photoHash', 'TEXT')
+    conn.commit()
+    photos.migrate_inline_photos(conn)
+
+
+@migration(3, 'indexes for hot queries')
+def _hot_query_indexes(conn, cursor):
+    # Duplicate form numbers from concurrent tabs would block the unique index;
+    # the oldest form keeps its number and later copies move to the end of the sequence
+    cursor.execute('''SELECT id, userId FROM forms
+                      WHERE formNumber IS NOT NULL
+                        AND id NOT IN (SELECT MIN(id) FROM forms WHERE formNumber IS NOT NULL GROUP BY userId, formNumber)
+                      ORDER BY id''')
+    for form_id, user_id in cursor.fetchall():
+        cursor.execute('UPDATE forms SET formNumber = (SELECT MAX(formNumber) FROM forms WHERE userId = ?) + 1 WHERE id = ?',
+                       (user_id, form_id))
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_forms_user_form_number ON forms (userId, formNumber)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_templates_user ON templates (userId)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_log_timestamp ON audit_log (timestamp)')
+    # users.username is already covered by the index behind its UNIQUE constraint
+
+
+@migration(4, 'workflow monitoring sort index')
+def _workflow_sort_index(conn, cursor):
+    # Shop-wide newest-first paging walks this index instead of sorting every form
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_forms_form_number ON forms (formNumber)')
+
+
+@migration(5, 'audit log filters and archive')
+def _audit_log_filters(conn, cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_log_action_timestamp ON audit_log (action, timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_log_user_timestamp ON audit_log (userId, timestamp)')
+    audit.create_archive_table(cursor)
+
+
+@migration(6, 'full-text form search')
+def _form_search_index(conn, cursor):
+    try:
+        search.create_index(cursor)
+    except Exception as e:
+        # search_forms falls back to LIKE when the server has no FTS5 module
+        if 'fts5' not in str(e).lower():
+            raise
+
+
+@migration(7, 'per-user form number counters')
+def _form_counters(conn, cursor):
+    counters.create_table(cursor)
+    counters.seed(cursor)
+
+
+@migration(8, 'form updated-at timestamps')
+def _form_updated_at(conn, cursor):
+    # Keys rendered print pages; forms saved before this stay NULL until their next save
+    add_column(cursor, 'forms', 'updatedAt', 'TEXT')
+
+
+@migration(9, 'sortable form timestamps')
+def _form_created_at(conn, cursor):
+    add_column(cursor, 'forms', 'createdAt', 'TEXT')
+    # 'dd-mm-YYYY' + 'HH:MM:SS' becomes 'YYYY-mm-ddTHH:MM:SS'; dates that do not parse get ''
+    cursor.execute('''UPDATE forms SET createdAt = CASE
+                          WHEN date GLOB '[0-9][0-9]-[0-9][0-9]-[0-9][0-9][0-9][0-9]'
+                          THEN substr(date, 7, 4) || '-' || substr(date, 4, 2) || '-' || substr(date, 1, 2) || 'T' ||
+                               CASE WHEN time GLOB '[0-9][0-9]:[0-9][0-9]:[0-9][0-9]' THEN time
+                                    WHEN time GLOB '[0-9][0-9]:[0-9][0-9]' THEN time || ':00'
+                                    ELSE '00:00:00' END
+                          ELSE '' END
+                      WHERE createdAt IS NULL''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_forms_user_created_at ON forms (userId, createdAt)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_forms_created_at ON forms (createdAt)')
+
+
+@migration(10, 'fine gold and daily summaries')
+def _daily_summary(conn, cursor):
+    add_column(cursor, 'forms', 'goldPurity', 'REAL')
+    cursor.execute('UPDATE forms SET goldPurity = ROUND(gold * grossWeight / 100, 3) WHERE goldPurity IS NULL')
+    analytics.create_tables(cursor)
+    analytics.rebuild(cursor)
+
+
+@migration(11, 'deduplicated error log')
+def _error_log_counts(conn, cursor):
+    # One row now stands for `count` identical messages, first logged at timestamp
+    add_column(cursor, 'error_logs', 'count', 'INTEGER NOT NULL DEFAULT 1')
+    add_column(cursor, 'error_logs', 'lastSeen', 'TEXT')
+    cursor.execute('UPDATE error_logs SET lastSeen = timestamp WHERE lastSeen IS NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_error_logs_last_seen ON error_logs (lastSeen)')
+
+
+@migration(12, 'ingestion API tokens and idempotency keys')
+def _api_tables(conn, cursor):
+    apikeys.create_tables(cursor)
+
+
+def current_version(cursor):
+    cursor.execute('SELECT MAX(version) FROM schema_version')
+    row = cursor.fetchone()
+    return row[0] or 0
+
+
+# Apply every pending migration in order; returns the versions applied
+def migrate(conn):
+    cursor = conn.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT,
+        appliedAt TEXT
+    )''')
+    conn.commit()
+    cursor.execute('SELECT version FROM schema_version')
+    applied = {row[0] for row in cursor.fetchall()}
+    newly_applied = []
+    for version, name, fn in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            fn(conn, cursor)
+            cursor.execute('INSERT OR IGNORE INTO schema_version (version, name, appliedAt) VALUES (?, ?, ?)',
+                           (version, name, datetime.now().isoformat()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        newly_applied.append(version)
+    if newly_applied:
+        conn.sync()
+    return newly_applied
+
+
+# Queries on the hot paths, with representative parameters
+HOT_QUERIES = {
+    'load_forms': ('SELECT id, formNumber FROM forms WHERE userId = ? ORDER BY formNumber DESC LIMIT 50', (1,)),
+    'next_form': ('SELECT id FROM forms WHERE userId = ? AND formNumber > ? ORDER BY formNumber ASC LIMIT 1', (1, 1)),
+    'prev_form': ('SELECT id FROM forms WHERE userId = ? AND formNumber < ? ORDER BY formNumber DESC LIMIT 1', (1, 1)),
+    'next_form_number': ('SELECT lastNumber FROM form_counters WHERE userId = ?', (1,)),
+    'report': ('SELECT formNumber FROM forms WHERE userId = ?', (1,)),
+    'report_by_date': ('SELECT id FROM forms WHERE userId = ? AND createdAt >= ? AND createdAt < ? '
+                       'ORDER BY createdAt DESC, id DESC LIMIT 10', (1, '2024-01-01', '2024-01-02')),
+    'login': ('SELECT * FROM users WHERE username = ?', ('admin',)),
+    'load_templates': ('SELECT id, itemName FROM templates WHERE userId = ? ORDER BY id', (1,)),
+    'audit_log': ('SELECT * FROM audit_log ORDER BY timestamp DESC, id DESC LIMIT 20', ()),
+    'audit_log_by_action': ('SELECT * FROM audit_log WHERE action = ? ORDER BY timestamp DESC, id DESC LIMIT 20', ('login',)),
+    'workflow_by_form_number': ('SELECT f.id FROM forms f JOIN users u ON f.userId = u.id '
+                                'ORDER BY f.formNumber DESC, f.id DESC LIMIT 10', ()),
+    'daily_summary': ('SELECT day FROM daily_summary WHERE day >= ? AND day <= ? ORDER BY day', ('2024-01-01', '2024-03-31')),
+    'workflow_by_date': ('SELECT f.id FROM forms f JOIN users u ON f.userId = u.id '
+                         'ORDER BY f.createdAt DESC, f.id DESC LIMIT 10', ()),
+    'error_log': ('SELECT id FROM error_logs WHERE lastSeen >= ? ORDER BY lastSeen DESC LIMIT 50', ('2024-01-01',)),
+    'api_token': ('SELECT id, userId FROM api_tokens WHERE tokenHash = ? AND revokedAt IS NULL', ('x',)),
+    'api_request': ('SELECT requestHash FROM api_requests WHERE userId = ? AND idempotencyKey = ?', (1, 'x')),
+    'workflow_by_username': ('SELECT f.id FROM users u CROSS JOIN forms f ON f.userId = u.id '
+                             'ORDER BY u.username ASC, u.id ASC, f.formNumber ASC LIMIT 10', ()),
+}
+
+
+# Return the hot queries whose plan scans a table or sorts without an index
+def check_query_plans(cursor, queries=None):
+    problems = {}
+    for name, (sql, params) in (queries or HOT_QUERIES).items():
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        details = [row[-1] for row in cursor.fetchall()]
+        unindexed = [d for d in details
+                     if 'TEMP B-TREE' in d or (d.startswith('SCAN') and 'USING' not in d)]
+        if unindexed:
+            problems[name] = details
+    return problems
+
+
+def assert_query_plans(cursor, queries=None):
+    problems = check_query_plans(cursor, queries)
+    assert not problems, f"Hot queries not using an index: {problems}"
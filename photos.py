@@ -0,0 +1,225 @@
+import base64
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+
+from PIL import Image, ImageOps, features
+
+import metrics
+
+# Longest edge kept for the stored original, and the two pre-generated thumbnails
+MAX_DIMENSION = 1600
+PRINT_SIZE = 200
+PREVIEW_SIZE = 300
+
+# Uploads past these limits are refused before any pixel data is decoded
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+MAX_PIXELS = 40_000_000
+
+VARIANT_COLUMNS = {
+    'original': 'original',
+    'print': 'printThumb',
+    'preview': 'previewThumb',
+}
+
+if features.check('webp'):
+    PHOTO_FORMAT, PHOTO_MIME = 'WEBP', 'image/webp'
+else:
+    PHOTO_FORMAT, PHOTO_MIME = 'JPEG', 'image/jpeg'
+
+
+def create_table(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS photos (
+        hash TEXT PRIMARY KEY,
+        mimeType TEXT,
+        width INTEGER,
+        height INTEGER,
+        original BLOB,
+        printThumb BLOB,
+        previewThumb BLOB,
+        createdAt TEXT
+    )''')
+
+
+def _encode(image, max_size, quality):
+    image = image.copy()
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    buffered = io.BytesIO()
+    image.save(buffered, format=PHOTO_FORMAT, quality=quality)
+    return buffered.getvalue()
+
+
+class PhotoTooLarge(ValueError):
+    pass
+
+
+# Open image bytes, checking the size from the header before decoding, and apply
+# the EXIF orientation so phone photos are stored upright
+def _open_image(data):
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise PhotoTooLarge(f"Photo is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    if width * height > MAX_PIXELS:
+        raise PhotoTooLarge(f"Photo is {width}x{height} pixels; at most {MAX_PIXELS // 1_000_000} megapixels are allowed")
+    # JPEGs can be decoded straight at a reduced scale
+    image.draft('RGB', (MAX_DIMENSION, MAX_DIMENSION))
+    return ImageOps.exif_transpose(image)
+
+
+# Turn uploaded image bytes into a bounded original plus print and preview thumbnails
+def encode_photo(data):
+    image = _open_image(data)
+    has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+    mode = 'RGBA' if has_alpha and PHOTO_FORMAT == 'WEBP' else 'RGB'
+    if image.mode != mode:
+        image = image.convert(mode)
+    original = _encode(image, MAX_DIMENSION, 85)
+    with Image.open(io.BytesIO(original)) as stored:
+        width, height = stored.size
+    return {
+        'hash': hashlib.sha256(original).hexdigest(),
+        'mimeType': PHOTO_MIME,
+        'width': width,
+        'height': height,
+        'original': original,
+        'printThumb': _encode(image, PRINT_SIZE, 90),
+        'previewThumb': _encode(image, PREVIEW_SIZE, 80),
+    }
+
+
+# Insert a processed photo; identical content maps to the same row
+def save_photo(cursor, photo):
+    cursor.execute('''INSERT OR IGNORE INTO photos (hash, mimeType, width, height, original, printThumb, previewThumb, createdAt)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                   (photo['hash'], photo['mimeType'], photo['width'], photo['height'], photo['original'],
+                    photo['printThumb'], photo['previewThumb'], datetime.now().isoformat()))
+    return photo['hash']
+
+
+def data_uri(data, mime_type=PHOTO_MIME):
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode()}"
+
+
+# Process-wide LRU of photo variants. Entries are keyed by content hash, so
+# they never go stale and need no invalidation.
+class PhotoCache:
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+photo_cache = PhotoCache()
+
+
+class UploadQueueFull(RuntimeError):
+    pass
+
+
+# Processes uploads off the script thread on a small pool. At most `max_pending`
+# uploads wait at once, and results are memoized by a hash of the uploaded bytes,
+# so the same file is decoded and encoded only once per process.
+class UploadProcessor:
+    def __init__(self, workers=2, max_pending=8, max_entries=32):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='photo-upload')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._results = PhotoCache(max_entries)
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def _run(self, key, data):
+        try:
+            with metrics.timed(metrics.STAGE, 'encode_photo'):
+                photo = encode_photo(data)
+            self._results.put(key, photo)
+            return photo
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            self._slots.release()
+
+    # Future resolving to the encode_photo() result for `data`
+    def submit(self, data):
+        key = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            photo = self._results.get(key)
+            if photo is not None:
+                future = Future()
+                future.set_result(photo)
+                return future
+            if key in self._in_flight:
+                return self._in_flight[key]
+            if not self._slots.acquire(blocking=False):
+                raise UploadQueueFull("Too many photos are being processed; try again shortly")
+            future = self._in_flight[key] = self._executor.submit(self._run, key, data)
+            return future
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._in_flight), 'hits': self._results.hits, 'misses': self._results.misses}
+
+
+upload_processor = UploadProcessor()
+
+
+# Load one variant of a stored photo as (bytes, mime type)
+def load_photo(cursor, photo_hash, variant='preview'):
+    key = (photo_hash, variant)
+    cached = photo_cache.get(key)
+    if cached is not None:
+        return cached
+    cursor.execute(f'SELECT {VARIANT_COLUMNS[variant]}, mimeType FROM photos WHERE hash = ?', (photo_hash,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    photo = (bytes(row[0]), row[1])
+    photo_cache.put(key, photo)
+    return photo
+
+
+# Convert inline data URIs in forms.photo into photo rows referenced by hash
+def migrate_inline_photos(conn, batch_size=50):
+    cursor = conn.cursor()
+    migrated = 0
+    while True:
+        cursor.execute('''SELECT id, photo FROM forms WHERE photoHash IS NULL AND photo LIKE 'data:%' LIMIT ?''',
+                       (batch_size,))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        for form_id, photo in rows:
+            try:
+                processed = encode_photo(base64.b64decode(photo.split(',', 1)[1]))
+            except Exception:
+                # Keep undecodable photos inline and mark them so they are not retried
+                cursor.execute("UPDATE forms SET photoHash = '' WHERE id = ?", (form_id,))
+                continue
+            save_photo(cursor, processed)
+            cursor.execute('UPDATE forms SET photoHash = ?, photo = NULL WHERE id = ?', (processed['hash'], form_id))
+            migrated += 1
+        conn.commit()
+    if migrated:
+        conn.sync()
+    return migrated
@@ -0,0 +1,210 @@
+import base64
+import html
+import json
+import threading
+from collections import OrderedDict
+
+import photos
+import queries
+import records
+
+# Most forms a single batch print job may hold
+MAX_BATCH = 200
+
+# Field positions on the pre-printed 6in x 7.5in certificate, in pixels at 72 DPI.
+# Both the HTML page and the server-side renderer are laid out from this.
+PAGE_WIDTH, PAGE_HEIGHT = 432, 540
+LAYOUT = {
+    'date': {'top': 80, 'left': 30, 'width': 100, 'font_size': 14},
+    'time': {'top': 80, 'left': 200, 'width': 100, 'font_size': 14},
+    'formNumber': {'top': 80, 'left': 350, 'width': 100, 'font_size': 14},
+    'customerName': {'top': 120, 'left': 30, 'width': 350, 'font_size': 16},
+    'itemName': {'top': 160, 'left': 30, 'width': 350, 'font_size': 14},
+    'sampleWeight': {'top': 200, 'left': 30, 'width': 100, 'font_size': 14},
+    'fineness': {'top': 240, 'left': 30, 'width': 100, 'font_size': 14, 'color': 'red', 'bold': True},
+    'goldPurity': {'top': 280, 'left': 30, 'width': 100, 'font_size': 14},
+    'karat': {'top': 320, 'left': 30, 'width': 100, 'font_size': 14},
+    'photo': {'top': 120, 'right': 30, 'width': 200, 'height': 200},
+}
+
+
+def _style(box):
+    style = f"position: absolute; top: {box['top']}px; "
+    style += f"right: {box['right']}px; " if 'right' in box else f"left: {box['left']}px; "
+    style += f"width: {box['width']}px;"
+    if 'height' in box:
+        style += f" height: {box['height']}px;"
+    if 'font_size' in box:
+        style += f" font-size: {box['font_size']}px;"
+    if 'color' in box:
+        style += f" color: {box['color']};"
+    if box.get('bold'):
+        style += ' font-weight: bold;'
+    return style
+
+
+FIELD_STYLES = {name: _style(box) for name, box in LAYOUT.items()}
+FIELD_STYLES['photo'] += ' object-fit: contain; border: 1px solid #ccc;'
+
+PAGE_CSS = '''
+    @page {
+        size: 6in 7.5in;
+        margin: 0;
+    }
+    body {
+        font-family: Arial, sans-serif;
+        margin: 0;
+        padding: 0;
+    }
+    .print-form {
+        position: relative;
+        width: %dpx; /* 6 inches at 72 DPI */
+        height: %dpx; /* 7.5 inches at 72 DPI */
+        overflow: hidden; /* Prevent content from spilling to additional pages */
+        page-break-after: always;
+        page-break-inside: avoid;
+    }
+    /* The photo script follows the pages, so :last-child would never match */
+    .print-form:last-of-type {
+        page-break-after: auto;
+    }
+''' % (PAGE_WIDTH, PAGE_HEIGHT)
+
+# Each distinct photo is embedded once and turned into a blob URL that every page
+# showing it points at. Printing waits until all of them have loaded.
+PHOTO_SCRIPT = '''
+    var photos = %s;
+    var urls = {};
+    Object.keys(photos).forEach(function (key) {
+        var bytes = atob(photos[key][0]);
+        var buffer = new Uint8Array(bytes.length);
+        for (var i = 0; i < bytes.length; i++) buffer[i] = bytes.charCodeAt(i);
+        urls[key] = URL.createObjectURL(new Blob([buffer], {type: photos[key][1]}));
+    });
+    document.querySelectorAll('img[data-photo]').forEach(function (img) {
+        img.src = urls[img.getAttribute('data-photo')];
+    });
+'''
+
+
+def _display(value, pattern):
+    return pattern.format(value) if value is not None else ''
+
+
+# The text printed in each field. `form` is a form data dict with goldPurity filled in.
+def field_texts(form):
+    text = {name: str(form[name]) if form[name] is not None else ''
+            for name in ('date', 'time', 'formNumber', 'customerName', 'itemName')}
+    text['sampleWeight'] = f"{_display(form['grossWeight'], '{:.3f}')} g"
+    text['fineness'] = f"{_display(form['gold'], '{:.3f}')} %"
+    text['goldPurity'] = f"{_display(form['goldPurity'], '{:.3f}')} g"
+    text['karat'] = _display(form['karat'], '{:.2f}')
+    return text
+
+
+# One certificate page
+def render_page(form):
+    styles = FIELD_STYLES
+    fields = ''.join(f'\n        <div style="{styles[name]}"><span>{html.escape(value)}</span></div>'
+                     for name, value in field_texts(form).items())
+    photo = (f'\n        <img data-photo="{html.escape(form["photoHash"])}" alt="Photo" style="{styles["photo"]}">'
+             if form.get('photoHash') else '')
+    return f'''
+    <div class="print-form">{fields}{photo}
+    </div>'''
+
+
+# Rendered pages of saved forms, keyed by (form id, updatedAt) so an edit renders afresh
+class PageCache:
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, record):
+        key = (record.id, record.updatedAt)
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                return page
+        page = render_page(record.to_form_data())
+        with self._lock:
+            self._pages[key] = page
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+        return page
+
+
+page_cache = PageCache()
+
+
+# A printable document of one page per form. `photo_variants` maps photo hash to
+# (bytes, mime type) for the photos the pages show.
+def render_document(pages, photo_variants):
+    embedded = {h: (base64.b64encode(data).decode(), mime) for h, (data, mime) in photo_variants.items()}
+    return f'''<html>
+<head><style>{PAGE_CSS}</style></head>
+<body>
+{''.join(pages)}
+<script>{PHOTO_SCRIPT % json.dumps(embedded)}</script>
+</body>
+</html>'''
+
+
+# Print thumbnails for a set of photo hashes
+def load_print_photos(cursor, photo_hashes):
+    variants = {}
+    for photo_hash in dict.fromkeys(h for h in photo_hashes if h):
+        photo = photos.load_photo(cursor, photo_hash, 'print')
+        if photo:
+            variants[photo_hash] = photo
+    return variants
+
+
+# Document for a batch of saved forms, with pages served from the page cache
+def render_batch(cursor, form_records):
+    pages = [page_cache.render(record) for record in form_records]
+    return render_document(pages, load_print_photos(cursor, [r.photoHash for r in form_records]))
+
+
+# Script that opens the document in a popup and prints it once every image has loaded.
+# The document travels as a JSON string, so nothing in a form can break out of it.
+def print_script(document):
+    payload = json.dumps(document).replace('</', '<\\/')
+    return f"""
+    <script>
+        var win = window.open('', '_blank');
+        if (win) {{
+            win.document.write({payload});
+            win.document.close();
+            win.onload = function() {{
+                var pending = Array.prototype.filter.call(win.document.images, function (img) {{ return !img.complete; }});
+                var remaining = pending.length;
+                var done = function () {{ if (--remaining <= 0) {{ win.print(); win.close(); }} }};
+                if (!remaining) {{ remaining = 1; done(); }}
+                pending.forEach(function (img) {{ img.onload = img.onerror = done; }});
+            }};
+        }} else {{
+            console.error('Failed to open new window. Please allow pop-ups.');
+            alert('Failed to open print window. Please allow pop-ups for this site.');
+        }}
+    </script>
+    """
+
+
+def _select(cursor, where, params, limit):
+    cursor.execute(f'SELECT {", ".join(queries.FORM_LIST_COLUMNS)} FROM forms WHERE {where} ORDER BY formNumber LIMIT ?',
+                   params + (limit,))
+    return records.from_rows(cursor.fetchall())
+
+
+# Forms of a user numbered from `first` to `last`, inclusive
+def select_by_range(cursor, user_id, first, last, limit=MAX_BATCH):
+    return _select(cursor, 'userId = ? AND formNumber BETWEEN ? AND ?', (user_id, first, last), limit)
+
+
+# Forms of a user dated on `day`
+def select_by_date(cursor, user_id, day, limit=MAX_BATCH):
+    return _select(cursor, 'userId = ? AND createdAt >= ? AND createdAt < ?',
+                   (user_id,) + queries.created_at_range(day, day), limit)
@@ -0,0 +1,192 @@
+from datetime import datetime, timedelta
+
+import photos
+import records
+
+# Columns the form selector, search and navigation need; never the photo
+FORM_LIST_COLUMNS = records.FORM_RECORD_FIELDS
+
+# Columns shown in the report table
+REPORT_COLUMNS = ('formNumber', 'date', 'customerName', 'itemName', 'mobileNumber', 'grossWeight',
+                  'netWeight', 'gold', 'karat')
+
+
+def _rows_to_dicts(columns, rows):
+    return [dict(zip(columns, row)) for row in rows]
+
+
+# How many of a user's newest forms the form selector keeps loaded
+RECENT_FORMS = 50
+
+
+# List a user's forms as records, newest first, without photos
+def list_forms(cursor, user_id, limit=None):
+    cursor.execute(f'SELECT {", ".join(FORM_LIST_COLUMNS)} FROM forms WHERE userId = ? ORDER BY formNumber DESC LIMIT ?',
+                   (user_id, -1 if limit is None else limit))
+    return records.from_rows(cursor.fetchall())
+
+
+def get_form(cursor, user_id, form_id):
+    cursor.execute(f'SELECT {", ".join(FORM_LIST_COLUMNS)} FROM forms WHERE id = ? AND userId = ?', (form_id, user_id))
+    row = cursor.fetchone()
+    return records.FormRecord.from_row(row) if row else None
+
+
+def get_form_by_number(cursor, user_id, form_number):
+    cursor.execute(f'SELECT {", ".join(FORM_LIST_COLUMNS)} FROM forms WHERE userId = ? AND formNumber = ?', (user_id, form_number))
+    row = cursor.fetchone()
+    return records.FormRecord.from_row(row) if row else None
+
+
+# The user's form with the next higher number, via a single seek on (userId, formNumber)
+def next_form(cursor, user_id, form_number):
+    cursor.execute(f'''SELECT {", ".join(FORM_LIST_COLUMNS)} FROM forms
+                       WHERE userId = ? AND formNumber > ? ORDER BY formNumber ASC LIMIT 1''', (user_id, form_number))
+    row = cursor.fetchone()
+    return records.FormRecord.from_row(row) if row else None
+
+
+# The user's form with the next lower number
+def prev_form(cursor, user_id, form_number):
+    cursor.execute(f'''SELECT {", ".join(FORM_LIST_COLUMNS)} FROM forms
+                       WHERE userId = ? AND formNumber < ? ORDER BY formNumber DESC LIMIT 1''', (user_id, form_number))
+    row = cursor.fetchone()
+    return records.FormRecord.from_row(row) if row else None
+
+
+TEMPLATE_COLUMNS = ('id', 'itemName', 'grossWeight', 'netWeight', 'gold', 'karat')
+
+
+def list_templates(cursor, user_id):
+    cursor.execute(f'SELECT {", ".join(TEMPLATE_COLUMNS)} FROM templates WHERE userId = ? ORDER BY id', (user_id,))
+    return _rows_to_dicts(TEMPLATE_COLUMNS, cursor.fetchall())
+
+
+# Sortable ISO timestamp of a form's 'dd-mm-YYYY' date and 'HH:MM:SS' time, stored in
+# forms.createdAt. Dates that do not parse get '', which sorts before every real date.
+def created_at(date, time=None):
+    for fmt in ('%d-%m-%Y %H:%M:%S', '%d-%m-%Y %H:%M'):
+        try:
+            return datetime.strptime(f"{date} {time or '00:00:00'}", fmt).isoformat()
+        except (TypeError, ValueError):
+            pass
+    return ''
+
+
+# createdAt bounds for an inclusive range of days
+def created_at_range(start_date=None, end_date=None):
+    return (start_date.isoformat() if start_date else None,
+            (end_date + timedelta(days=1)).isoformat() if end_date else None)
+
+
+REPORT_SORTS = {
+    'formNumber': 'formNumber DESC',
+    'date': 'createdAt DESC, id DESC',
+}
+
+
+def like_pattern(text):
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+# WHERE clause for a user's report: customer name contains, and an inclusive date range
+def report_filter(user_id, customer='', start_date=None, end_date=None):
+    clauses, params = ['userId = ?'], [user_id]
+    if customer:
+        clauses.append("customerName LIKE ? ESCAPE '\\'")
+        params.append(like_pattern(customer))
+    start, end = created_at_range(start_date, end_date)
+    if start:
+        clauses.append('createdAt >= ?')
+        params.append(start)
+    if end:
+        clauses.append('createdAt < ?')
+        params.append(end)
+    return 'WHERE ' + ' AND '.join(clauses), params
+
+
+def count_report_rows(cursor, user_id, customer='', start_date=None, end_date=None):
+    where, params = report_filter(user_id, customer, start_date, end_date)
+    cursor.execute(f'SELECT COUNT(*) FROM forms {where}', params)
+    return cursor.fetchone()[0]
+
+
+# One page of a user's report
+def page_report_rows(cursor, user_id, sort_by='formNumber', customer='', start_date=None, end_date=None,
+                     limit=10, offset=0):
+    where, params = report_filter(user_id, customer, start_date, end_date)
+    cursor.execute(f'SELECT {", ".join(REPORT_COLUMNS)} FROM forms {where} ORDER BY {REPORT_SORTS[sort_by]} LIMIT ? OFFSET ?',
+                   params + [limit, offset])
+    return _rows_to_dicts(REPORT_COLUMNS, cursor.fetchall())
+
+
+# Fetch one form's photo on demand, as something st.image can display
+def get_form_photo(cursor, form_id, variant='preview'):
+    cursor.execute('SELECT photoHash, photo FROM forms WHERE id = ?', (form_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    if row[0]:
+        photo = photos.load_photo(cursor, row[0], variant)
+        return photo[0] if photo else None
+    # Inline data URI that predates the photo store
+    return row[1] or None
+
+
+# Ordering columns and direction for each Workflow Monitoring sort, plus the join
+# order that lets SQLite walk an index instead of sorting every form. The trailing
+# columns make each ordering total, so they double as the keyset seek key.
+WORKFLOW_SORTS = {
+    'formNumber': (('f.formNumber', 'f.id'), 'DESC', 'forms f JOIN users u ON f.userId = u.id'),
+    'date': (('f.createdAt', 'f.id'), 'DESC', 'forms f JOIN users u ON f.userId = u.id'),
+    'username': (('u.username', 'u.id', 'f.formNumber'), 'ASC', 'users u CROSS JOIN forms f ON f.userId = u.id'),
+}
+
+WORKFLOW_COLUMNS = FORM_LIST_COLUMNS + ('userId', 'username')
+
+
+def _workflow_filter(username_filter):
+    if username_filter:
+        return "WHERE u.username LIKE ? ESCAPE '\\'", [like_pattern(username_filter)]
+    return '', []
+
+
+def _order_by(keys, direction):
+    return ', '.join(f'{key} {direction}' for key in keys)
+
+
+# Number of forms matching the Workflow Monitoring filter
+def count_workflow_forms(cursor, username_filter=''):
+    where, params = _workflow_filter(username_filter)
+    cursor.execute(f'SELECT COUNT(*) FROM forms f JOIN users u ON f.userId = u.id {where}', params)
+    return cursor.fetchone()[0]
+
+
+# Keyset page of the shop's forms. `after` is the seek key of the last row of the
+# previous page; returns the rows and the key to pass for the next page.
+def page_workflow_forms(cursor, sort_by='formNumber', username_filter='', after=None, limit=10):
+    keys, direction, source = WORKFLOW_SORTS[sort_by]
+    where, params = _workflow_filter(username_filter)
+    if after is not None:
+        seek = f"({', '.join(keys)}) {'<' if direction == 'DESC' else '>'} ({', '.join('?' for _ in keys)})"
+        where = f'{where} AND {seek}' if where else f'WHERE {seek}'
+        params += list(after)
+    cursor.execute(f'''SELECT {", ".join("f." + c for c in FORM_LIST_COLUMNS)}, f.userId, u.username, {", ".join(keys)}
+                       FROM {source} {where}
+                       ORDER BY {_order_by(keys, direction)} LIMIT ?''', params + [limit])
+    rows = cursor.fetchall()
+    next_key = tuple(rows[-1][-len(keys):]) if len(rows) == limit else None
+    return _rows_to_dicts(WORKFLOW_COLUMNS, rows), next_key
+
+
+# Seek key of the row just before `offset`, so a page can be opened without walking the ones before it
+def workflow_page_key(cursor, sort_by='formNumber', username_filter='', offset=0):
+    if offset <= 0:
+        return None
+    keys, direction, source = WORKFLOW_SORTS[sort_by]
+    where, params = _workflow_filter(username_filter)
+    cursor.execute(f'''SELECT {", ".join(keys)} FROM {source} {where}
+                       ORDER BY {_order_by(keys, direction)} LIMIT 1 OFFSET ?''', params + [offset - 1])
+    row = cursor.fetchone()
+    return tuple(row) if row else None
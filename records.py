@@ -0,0 +1,68 @@
+import sys
+from dataclasses import dataclass, fields
+
+import validation
+
+# Columns repeated across many forms; interning keeps one copy of each value per process
+_INTERNED = ('date', 'itemName')
+
+
+# One row of a user's form list. Records are immutable and shared by every session
+# of the user; the form being edited is copied out with to_form_data().
+@dataclass(frozen=True, slots=True)
+class FormRecord:
+    id: int
+    formNumber: int
+    date: str
+    time: str
+    customerName: str
+    itemName: str
+    mobileNumber: str
+    grossWeight: float
+    netWeight: float
+    gold: float
+    karat: float
+    photoHash: str
+    updatedAt: str
+
+    @classmethod
+    def from_row(cls, row):
+        values = dict(zip(FORM_RECORD_FIELDS, row))
+        for name in _INTERNED:
+            if isinstance(values[name], str):
+                values[name] = sys.intern(values[name])
+        return cls(**values)
+
+    @property
+    def label(self):
+        return f"Form {self.formNumber} - {self.customerName or 'No Customer'}"
+
+    # Editable copy for st.session_state.form_data
+    def to_form_data(self):
+        form_data = {name: getattr(self, name) for name in FORM_RECORD_FIELDS}
+        form_data['goldPurity'] = validation.gold_purity_for(self.gold, self.grossWeight)
+        return form_data
+
+
+FORM_RECORD_FIELDS = tuple(f.name for f in fields(FormRecord))
+
+
+def from_rows(rows):
+    return [FormRecord.from_row(row) for row in rows]
+
+
+# Approximate bytes held by a list of records, counting each distinct object once
+def memory_usage(records):
+    seen = set()
+    total = 0
+    for obj in [records, *records]:
+        if id(obj) not in seen:
+            seen.add(id(obj))
+            total += sys.getsizeof(obj)
+    for record in records:
+        for name in FORM_RECORD_FIELDS:
+            value = getattr(record, name)
+            if value is not None and id(value) not in seen:
+                seen.add(id(value))
+                total += sys.getsizeof(value)
+    return total
@@ -0,0 +1,67 @@
+import re
+
+import queries
+import records
+
+SEARCH_COLUMNS = ('customerName', 'itemName', 'mobileNumber', 'formNumber')
+
+_fts_available = None
+
+
+# Contentless FTS5 index over the searchable form columns. The owner column holds a
+# 'u<userId>' token so a search can be scoped to one user inside the index itself.
+def create_index(cursor):
+    cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS forms_fts USING fts5(
+        customerName, itemName, mobileNumber, formNumber, owner,
+        content='', tokenize='unicode61 remove_diacritics 2'
+    )''')
+    values = ', '.join(f'{{row}}.{c}' for c in SEARCH_COLUMNS) + ", 'u' || {row}.userId"
+    columns = ', '.join(SEARCH_COLUMNS + ('owner',))
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS forms_fts_insert AFTER INSERT ON forms BEGIN
+        INSERT INTO forms_fts (rowid, {columns}) VALUES (new.id, {values.format(row='new')});
+    END''')
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS forms_fts_delete AFTER DELETE ON forms BEGIN
+        INSERT INTO forms_fts (forms_fts, rowid, {columns}) VALUES ('delete', old.id, {values.format(row='old')});
+    END''')
+    cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS forms_fts_update
+        AFTER UPDATE OF {', '.join(SEARCH_COLUMNS)}, userId ON forms BEGIN
+        INSERT INTO forms_fts (forms_fts, rowid, {columns}) VALUES ('delete', old.id, {values.format(row='old')});
+        INSERT INTO forms_fts (rowid, {columns}) VALUES (new.id, {values.format(row='new')});
+    END''')
+    cursor.execute('DELETE FROM forms_fts')
+    cursor.execute(f"INSERT INTO forms_fts (rowid, {columns}) SELECT id, {values.format(row='forms')} FROM forms")
+
+
+def fts_available(cursor):
+    global _fts_available
+    if _fts_available is None:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'forms_fts'")
+        _fts_available = cursor.fetchone() is not None
+    return _fts_available
+
+
+# Every word of the query must prefix-match one of the searchable columns
+def build_match(user_id, query):
+    tokens = re.findall(r'\w+', query)
+    if not tokens:
+        return None
+    terms = ' AND '.join(f'"{token}"*' for token in tokens)
+    return f'owner : "u{int(user_id)}" AND {{{" ".join(SEARCH_COLUMNS)}}} : ({terms})'
+
+
+# Ranked, limited search over a user's forms; returns form records
+def search_forms(cursor, user_id, query, limit=50):
+    columns = ', '.join('f.' + c for c in queries.FORM_LIST_COLUMNS)
+    if fts_available(cursor):
+        match = build_match(user_id, query)
+        if match is None:
+            return []
+        cursor.execute(f'''SELECT {columns} FROM forms_fts JOIN forms f ON f.id = forms_fts.rowid
+                           WHERE forms_fts MATCH ? ORDER BY rank, f.formNumber DESC LIMIT ?''', (match, limit))
+    else:
+        # Databases built without FTS5 fall back to an indexed scan of the user's forms
+        pattern = queries.like_pattern(query)
+        cursor.execute(f'''SELECT {columns} FROM forms f
+                           WHERE f.userId = ? AND (f.customerName LIKE ? ESCAPE '\\' OR CAST(f.formNumber AS TEXT) LIKE ? ESCAPE '\\')
+                           ORDER BY f.formNumber DESC LIMIT ?''', (user_id, pattern, pattern, limit))
+    return records.from_rows(cursor.fetchall())
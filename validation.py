@@ -0,0 +1,89 @@
+import math
+
+import pandas as pd
+
+# Field rules shared by the form editor and bulk import
+MOBILE_PATTERN = r'\d{10}'
+REQUIRED_FIELDS = ('customerName', 'itemName', 'grossWeight', 'gold')
+
+MOBILE_ERROR = "Please enter a valid 10-digit mobile number"
+GROSS_WEIGHT_ERROR = "Gross Weight must be non-negative"
+GOLD_ERROR = "Gold percentage must be between 0 and 100"
+NUMBER_ERROR = "Gross Weight and Gold (%) must be finite numbers"
+REQUIRED_ERROR = "Customer Name, Item Name, Gross Weight, and Gold (%) are required fields for saving/printing."
+TEMPLATE_REQUIRED_ERROR = "Item Name is required for a template"
+TEMPLATE_NUMBERS_ERROR = "Template requires Gross Weight and Gold (%) to be specified."
+
+
+def karat_for(gold):
+    return round((float(gold) / 100) * 24, 2) if gold is not None else None
+
+
+# Fine gold in grams: the gold share of the sample weight
+def gold_purity_for(gold, gross_weight):
+    return round((float(gold) * float(gross_weight)) / 100, 3) if gold is not None and gross_weight is not None else None
+
+
+# Range errors of grossWeight and gold; NaN and infinities are never valid
+def _number_errors(data):
+    numbers = [float(data[name]) for name in ('grossWeight', 'gold') if data[name] is not None]
+    if not all(math.isfinite(number) for number in numbers):
+        return [NUMBER_ERROR]
+    errors = []
+    if data['grossWeight'] is not None and float(data['grossWeight']) < 0:
+        errors.append(GROSS_WEIGHT_ERROR)
+    if data['gold'] is not None and not 0 <= float(data['gold']) <= 100:
+        errors.append(GOLD_ERROR)
+    return errors
+
+
+# Error messages for one form; empty when it is valid
+def validate_form_data(form_data):
+    errors = []
+    mobile = form_data['mobileNumber']
+    if mobile and not (mobile.isdigit() and len(mobile) == 10):
+        errors.append(MOBILE_ERROR)
+    errors += _number_errors(form_data)
+    if not form_data['customerName'] or not form_data['itemName'] or form_data['grossWeight'] is None or form_data['gold'] is None:
+        errors.append(REQUIRED_ERROR)
+    return errors
+
+
+# Error messages for one template; the editor and the API both require the weights
+def validate_template_data(template_data):
+    errors = []
+    if not template_data['itemName']:
+        errors.append(TEMPLATE_REQUIRED_ERROR)
+    if template_data['grossWeight'] is None or template_data['gold'] is None:
+        errors.append(TEMPLATE_NUMBERS_ERROR)
+    errors += _number_errors(template_data)
+    return errors
+
+
+# The same rules over a whole frame of forms at once. Expects text columns for
+# customerName, itemName and mobileNumber and numeric columns (NaN when missing or
+# unparseable) for grossWeight and gold. Returns one '; '-joined message per row,
+# empty for valid rows.
+def validate_frame(frame):
+    mobile = frame['mobileNumber'].fillna('').astype(str).str.strip()
+    rules = [
+        ((mobile != '') & ~mobile.str.fullmatch(MOBILE_PATTERN), MOBILE_ERROR),
+        ((frame['grossWeight'].abs() == math.inf) | (frame['gold'].abs() == math.inf), NUMBER_ERROR),
+        (frame['grossWeight'] < 0, GROSS_WEIGHT_ERROR),
+        ((frame['gold'] < 0) | (frame['gold'] > 100), GOLD_ERROR),
+        (frame['customerName'].fillna('').astype(str).str.strip().eq('')
+         | frame['itemName'].fillna('').astype(str).str.strip().eq('')
+         | frame['grossWeight'].isna() | frame['gold'].isna(), REQUIRED_ERROR),
+    ]
+    messages = pd.Series('', index=frame.index)
+    for failed, message in rules:
+        messages = messages.where(~failed, messages + message + '; ')
+    return messages.str.rstrip('; ')
+
+
+def karat_series(gold):
+    return (gold / 100 * 24).round(2)
+
+
+def gold_purity_series(gold, gross_weight):
+    return (gold * gross_weight / 100).round(3)
@@ -0,0 +1,246 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# Durability modes: commit and sync every unit on its own, or coalesce units
+# from all sessions into one transaction and one sync per group
+SYNC_PER_WRITE = 'sync'
+GROUPED = 'grouped'
+
+
+class _Unit:
+    __slots__ = ('work', 'future', 'statements', 'report_errors')
+
+    def __init__(self, work, statements, report_errors=True):
+        self.work = work
+        self.future = Future()
+        self.statements = statements
+        self.report_errors = report_errors
+
+
+class _Barrier:
+    __slots__ = ('future',)
+
+    def __init__(self):
+        self.future = Future()
+
+
+# Single background writer that owns its own connection. Callers submit units of
+# work and get a Future back; the future resolves once the unit is committed.
+# flush() resolves once everything submitted before it has also been synced.
+class GroupCommitWriter:
+    def __init__(self, connect, mode=GROUPED, max_delay_ms=50, max_statements=100, on_error=None):
+        if mode not in (SYNC_PER_WRITE, GROUPED):
+            raise ValueError(f"Unknown durability mode: {mode}")
+        self._connect = connect
+        self.mode = mode
+        self.max_delay = max_delay_ms / 1000.0
+        self.max_statements = max_statements
+        self.on_error = on_error
+        self._queue = queue.Queue()
+        self._conn = None
+        self._dirty = False
+        self._closed = False
+        self._pending_outcomes = []
+        self._lock = threading.Lock()
+        self._stats = {
+            'units': 0,
+            'statements': 0,
+            'groups': 0,
+            'syncs': 0,
+            'failed_units': 0,
+            'sync_errors': 0,
+            'commit_time': 0.0,
+            'sync_time': 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name='group-commit-writer', daemon=True)
+        self._thread.start()
+
+    # Submit a callable that receives the writer cursor; its return value resolves the future
+    def submit(self, work, statements=1, report_errors=True):
+        if self._closed:
+            raise RuntimeError("Writer is closed")
+        unit = _Unit(work, statements, report_errors)
+        self._queue.put(unit)
+        return unit.future
+
+    def execute(self, sql, params=(), report_errors=True):
+        def work(cursor):
+            cursor.execute(sql, params)
+            return cursor.lastrowid
+        return self.submit(work, report_errors=report_errors)
+
+    # Run several statements atomically; resolves to the lastrowid of each statement
+    def execute_many(self, statements, report_errors=True):
+        statements = list(statements)
+
+        def work(cursor):
+            rowids = []
+            for sql, params in statements:
+                cursor.execute(sql, params)
+                rowids.append(cursor.lastrowid)
+            return rowids
+        return self.submit(work, statements=len(statements), report_errors=report_errors)
+
+    # Block until every write submitted so far is committed and synced
+    def flush(self, timeout=None):
+        barrier = _Barrier()
+        self._queue.put(barrier)
+        return barrier.future.result(timeout=timeout)
+
+    def close(self, timeout=None):
+        if self._closed:
+            return
+        self.flush(timeout=timeout)
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['mode'] = self.mode
+        stats['pending'] = self._queue.qsize()
+        stats['avg_group_size'] = stats['statements'] / stats['groups'] if stats['groups'] else 0.0
+        return stats
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _reset_connection(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    # A lone unit commits at once. Only when a second unit is already queued do
+    # others seem to be writing, and then the group lingers for more as long as
+    # they keep arriving within max_delay / 10 of each other, up to max_delay.
+    # Units that queue up while a commit runs make up the next group either way.
+    def _collect(self, first):
+        batch = [first]
+        if self.mode == SYNC_PER_WRITE or isinstance(first, _Barrier):
+            return batch
+        count = first.statements
+        deadline = None
+        while count < self.max_statements:
+            try:
+                if deadline is None:
+                    item = self._queue.get_nowait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    item = self._queue.get(timeout=min(remaining, self.max_delay / 10))
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+            if isinstance(item, _Barrier):
+                break
+            count += item.statements
+            if deadline is None:
+                deadline = time.monotonic() + self.max_delay
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = self._collect(first)
+            units = [item for item in batch if isinstance(item, _Unit)]
+            barriers = [item for item in batch if isinstance(item, _Barrier)]
+            if units:
+                self._commit_group(units)
+            self._sync(units if self.mode == SYNC_PER_WRITE else [], barriers)
+        self._reset_connection()
+
+    def _commit_group(self, units):
+        start = time.perf_counter()
+        outcomes = []
+        try:
+            conn = self._connection()
+            cursor = conn.cursor()
+            cursor.execute('BEGIN')
+            for unit in units:
+                # A savepoint per unit keeps one bad write from failing the whole group
+                cursor.execute('SAVEPOINT unit')
+                try:
+                    result = unit.work(cursor)
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO unit')
+                    cursor.execute('RELEASE unit')
+                    outcomes.append((unit, None, e))
+                else:
+                    cursor.execute('RELEASE unit')
+                    outcomes.append((unit, result, None))
+            conn.commit()
+        except Exception as e:
+            try:
+                self._conn.rollback()
+            except Exception:
+                self._reset_connection()
+            outcomes = [(unit, None, e) for unit in units]
+        else:
+            self._dirty = True
+        elapsed = time.perf_counter() - start
+
+        failed = [(unit, error) for unit, _, error in outcomes if error is not None]
+        with self._lock:
+            self._stats['groups'] += 1
+            self._stats['units'] += len(units)
+            self._stats['statements'] += sum(unit.statements for unit in units)
+            self._stats['failed_units'] += len(failed)
+            self._stats['commit_time'] += elapsed
+        for unit, error in failed:
+            if unit.report_errors and self.on_error:
+                try:
+                    self.on_error(f"Write error: {str(error)}")
+                except Exception:
+                    pass
+        # In grouped mode callers only wait for the commit; the sync follows
+        if self.mode == GROUPED:
+            self._resolve(outcomes)
+        else:
+            self._pending_outcomes = outcomes
+
+    def _sync(self, units, barriers):
+        error = None
+        if self._dirty:
+            start = time.perf_counter()
+            try:
+                self._connection().sync()
+                self._dirty = False
+            except Exception as e:
+                error = e
+                with self._lock:
+                    self._stats['sync_errors'] += 1
+            with self._lock:
+                self._stats['syncs'] += 1
+                self._stats['sync_time'] += time.perf_counter() - start
+        if units:
+            outcomes = self._pending_outcomes
+            self._pending_outcomes = []
+            if error is not None:
+                outcomes = [(unit, None, error if exc is None else exc) for unit, _, exc in outcomes]
+            self._resolve(outcomes)
+        for barrier in barriers:
+            if error is not None:
+                barrier.future.set_exception(error)
+            else:
+                barrier.future.set_result(None)
+
+    def _resolve(self, outcomes):
+        for unit, result, error in outcomes:
+            if error is not None:
+                unit.future.set_exception(error)
+            else:
+                unit.future.set_result(result)